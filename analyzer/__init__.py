@@ -0,0 +1,3 @@
+from .runstore import Run, RunStore
+
+__all__ = ['Run', 'RunStore']
@@ -1,7 +1,27 @@
 import argparse
+import os
+import sys
 
-import trajectory
-import scalability
+# `python analyzer <subcommand>` runs this file as a script with the analyzer directory first on sys.path
+# It is swapped for the directory above, so the modules load as the analyzer package and shadow nothing
+if not __package__:
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = 'analyzer'
+
+from . import trajectory
+from . import scalability
+from . import capacity
+from . import regression
+from . import compact
+from . import simulate
+from . import report
+from . import regions
+from . import phases
+from . import pinning
+from . import stacks
+from . import breakdown
+from . import clocks
+from . import doe
 
 parser = argparse.ArgumentParser()
 subparsers = parser.add_subparsers(dest='mode', required=True)
@@ -16,6 +36,66 @@ parser_scalability = subparsers.add_parser('scalability', aliases=['s'])
 parser_scalability.set_defaults(func=scalability.main)
 scalability.init(parser_scalability)
 
+# python analyzer capacity
+parser_capacity = subparsers.add_parser('capacity', aliases=['c'])
+parser_capacity.set_defaults(func=capacity.main)
+capacity.init(parser_capacity)
+
+# python analyzer regression
+parser_regression = subparsers.add_parser('regression', aliases=['r'])
+parser_regression.set_defaults(func=regression.main)
+regression.init(parser_regression)
+
+# python analyzer compact
+parser_compact = subparsers.add_parser('compact')
+parser_compact.set_defaults(func=compact.main)
+compact.init(parser_compact)
+
+# python analyzer simulate
+parser_simulate = subparsers.add_parser('simulate')
+parser_simulate.set_defaults(func=simulate.main)
+simulate.init(parser_simulate)
+
+# python analyzer report
+parser_report = subparsers.add_parser('report')
+parser_report.set_defaults(func=report.main)
+report.init(parser_report)
+
+# python analyzer regions
+parser_regions = subparsers.add_parser('regions')
+parser_regions.set_defaults(func=regions.main)
+regions.init(parser_regions)
+
+# python analyzer phases
+parser_phases = subparsers.add_parser('phases')
+parser_phases.set_defaults(func=phases.main)
+phases.init(parser_phases)
+
+# python analyzer pinning
+parser_pinning = subparsers.add_parser('pinning')
+parser_pinning.set_defaults(func=pinning.main)
+pinning.init(parser_pinning)
+
+# python analyzer stacks
+parser_stacks = subparsers.add_parser('stacks')
+parser_stacks.set_defaults(func=stacks.main)
+stacks.init(parser_stacks)
+
+# python analyzer breakdown
+parser_breakdown = subparsers.add_parser('breakdown')
+parser_breakdown.set_defaults(func=breakdown.main)
+breakdown.init(parser_breakdown)
+
+# python analyzer clocks
+parser_clocks = subparsers.add_parser('clocks')
+parser_clocks.set_defaults(func=clocks.main)
+clocks.init(parser_clocks)
+
+# python analyzer doe
+parser_doe = subparsers.add_parser('doe')
+parser_doe.set_defaults(func=doe.main)
+doe.init(parser_doe)
+
 # Invoke main
 args = parser.parse_args()
 args.func(args)
@@ -0,0 +1,241 @@
+import json
+import lzma
+import os
+import struct
+import zlib
+
+from . import lazy
+
+np = lazy.lazy_import('numpy')
+
+
+# Single file archive of a finished run directory (label.txt, group.txt, <thread>.csv)
+#
+#     MAGIC | uint32 header length | header (json) | blobs
+#
+# Every .csv whose values are plain integers or fixed-point decimals is stored column by column.
+# A column is scaled to integers, delta-encoded, cut into chunks of chunk_rows rows, narrowed
+# to the smallest integer type holding the deltas of the chunk and compressed chunk by chunk,
+# so readers decompress one chunk at a time straight into a NumPy array.
+# Anything that does not re-format to the exact same bytes is stored as compressed text instead.
+
+MAGIC = b'SIMZ\x01'
+EXTENSION = '.simz'
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 9), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=9), lzma.decompress),
+}
+
+DELTA_DTYPES = ['int8', 'int16', 'int32', 'int64']
+
+
+def is_archive(path):
+    return path.endswith(EXTENSION) and os.path.isfile(path)
+
+
+def format_value(value, decimals):
+    if decimals is None:
+        return str(value)
+    sign = '-' if value < 0 else ''
+    value = abs(value)
+    scale = 10 ** decimals
+    return sign + str(value // scale) + '.' + str(value % scale).zfill(decimals)
+
+
+def parse_column(strings):
+    '''
+    (np.array of int64, decimals) where decimals is None for integers
+    None when the strings are not all in one integer or fixed-point format
+    '''
+    decimals = {len(s) - s.index('.') - 1 if '.' in s else None for s in strings}
+    if len(decimals) != 1:
+        return None
+    decimals = decimals.pop()
+    try:
+        return np.array([int(s.replace('.', '', 1)) for s in strings], dtype=np.int64), decimals
+    except (ValueError, OverflowError):
+        return None
+
+
+def format_rows(columns, decimals):
+    lines = [','.join(row) for row in zip(*[[format_value(int(v), d) for v in col] for col, d in zip(columns, decimals)])]
+    return ''.join(line + '\n' for line in lines)
+
+
+class ArchiveWriter:
+    def __init__(self, codec, chunk_rows):
+        assert codec in CODECS
+        self.__compress = CODECS[codec][0]
+        self.__chunk_rows = chunk_rows
+        self.__header = {'codec': codec, 'files': dict()}
+        self.__blobs = list()
+        self.__offset = 0
+
+    def __add_blob(self, data):
+        blob = self.__compress(data)
+        self.__blobs.append(blob)
+        self.__offset += len(blob)
+        return [self.__offset - len(blob), len(blob)]
+
+    def add_text(self, name, text):
+        self.__header['files'][name] = {'kind': 'text', 'blob': self.__add_blob(text.encode('utf-8'))}
+
+    def add_csv(self, name, text):
+        '''
+        Stores text column by column if it round-trips exactly, as plain text otherwise
+        '''
+        lines = text.split('\n')
+        header_line = lines[0]
+        ncol = len(header_line.replace(',', ' ').split())
+        body = lines[1:-1] if text.endswith('\n') else lines[1:]
+
+        # Rows after the first irregular one (cut short at shutdown) are kept verbatim
+        nrow = 0
+        while nrow < len(body) and body[nrow].count(',') == ncol - 1 and len(body[nrow]) > 0:
+            nrow += 1
+        tail = text[len(header_line) + 1 + sum(len(line) + 1 for line in body[:nrow]):] if len(lines) > 1 else ''
+
+        parsed = [parse_column(col) for col in zip(*[line.split(',') for line in body[:nrow]])] if nrow > 0 else [(np.zeros(0, dtype=np.int64), None)] * ncol
+        if len(lines) < 2 or any(col is None for col in parsed) or len(parsed) != ncol:
+            self.add_text(name, text)
+            return
+        columns, decimals = zip(*parsed)
+        if header_line + '\n' + format_rows(columns, decimals) + tail != text:
+            self.add_text(name, text)
+            return
+
+        entry = {'kind': 'columns', 'header': header_line, 'nrow': nrow, 'tail': tail, 'columns': list()}
+        for values, decimals_ in zip(columns, decimals):
+            chunks = list()
+            previous = 0
+            for start in range(0, nrow, self.__chunk_rows):
+                chunk = values[start:start + self.__chunk_rows]
+                deltas = np.diff(chunk, prepend=previous)
+                previous = chunk[-1]
+                dtype = next(dtype for dtype in DELTA_DTYPES if deltas.min() >= np.iinfo(dtype).min and deltas.max() <= np.iinfo(dtype).max)
+                chunks.append(self.__add_blob(deltas.astype('<' + np.dtype(dtype).str[1:]).tobytes()) + [len(chunk), np.dtype(dtype).name])
+            entry['columns'].append({'decimals': decimals_, 'chunks': chunks})
+        self.__header['files'][name] = entry
+
+    def write(self, path):
+        header = json.dumps(self.__header, separators=(',', ':')).encode('utf-8')
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, mode='wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for blob in self.__blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+
+
+class ArchiveReader:
+    def __init__(self, path):
+        self.__file = open(path, mode='rb')
+        if self.__file.read(len(MAGIC)) != MAGIC:
+            self.__file.close()
+            raise ValueError(path + ' is not a metrics archive')
+        length, = struct.unpack('<I', self.__file.read(4))
+        self.__header = json.loads(self.__file.read(length).decode('utf-8'))
+        self.__base = len(MAGIC) + 4 + length
+        self.__decompress = CODECS[self.__header['codec']][1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.__file.close()
+
+    def names(self):
+        return sorted(self.__header['files'])
+
+    def __read_blob(self, blob):
+        offset, length = blob[0:2]
+        self.__file.seek(self.__base + offset)
+        return self.__decompress(self.__file.read(length))
+
+    def read_text(self, name):
+        '''
+        Original content of name, None if the archive does not hold it
+        '''
+        entry = self.__header['files'].get(name)
+        if entry is None:
+            return None
+        if entry['kind'] == 'text':
+            return self.__read_blob(entry['blob']).decode('utf-8')
+        columns = [self.__read_integers(column, entry['nrow']) for column in entry['columns']]
+        return entry['header'] + '\n' + format_rows(columns, [column['decimals'] for column in entry['columns']]) + entry['tail']
+
+    def __read_integers(self, column, max_row):
+        '''
+        np.array of int64 of the first max_row rows, decompressed one chunk at a time
+        '''
+        values = np.empty(max_row, dtype=np.int64)
+        filled = 0
+        previous = 0
+        for chunk in column['chunks']:
+            if filled >= max_row:
+                break
+            deltas = np.frombuffer(self.__read_blob(chunk), dtype='<' + np.dtype(chunk[3]).str[1:])
+            take = min(len(deltas), max_row - filled)
+            np.cumsum(deltas[:take], dtype=np.int64, out=values[filled:filled + take])
+            values[filled:filled + take] += previous
+            previous = values[filled + take - 1]
+            filled += take
+        return values[:filled]
+
+    def read_columns(self, name, max_row=None):
+        '''
+        {column_name: np.array of float} of a .csv entry, the same values a text parser would produce
+        Trailing rows that were cut short by the server shutting down are dropped
+        '''
+        entry = self.__header['files'][name]
+        if entry['kind'] == 'text':
+            return None
+        nrow = entry['nrow'] if max_row is None else min(max_row, entry['nrow'])
+        result = dict()
+        for column_name, column in zip(entry['header'].replace(',', ' ').split(), entry['columns']):
+            values = self.__read_integers(column, nrow).astype(np.float64)
+            if column['decimals']:
+                values /= 10 ** column['decimals']
+            result[column_name] = values
+        return result
+
+
+def compact_run(run_metric_dir, path, codec='zlib', chunk_rows=16384):
+    '''
+    Writes the archive of run_metric_dir to path and checks every file reads back byte for byte
+    (original bytes, archive bytes)
+    '''
+    writer = ArchiveWriter(codec, chunk_rows)
+    originals = dict()
+    for name in sorted(os.listdir(run_metric_dir)):
+        file_path = os.path.join(run_metric_dir, name)
+        if not os.path.isfile(file_path):
+            continue
+        with open(file_path, mode='r', newline='') as f:
+            originals[name] = f.read()
+        if name.endswith('.csv'):
+            writer.add_csv(name, originals[name])
+        else:
+            writer.add_text(name, originals[name])
+    writer.write(path)
+
+    with ArchiveReader(path) as reader:
+        for name, text in originals.items():
+            if reader.read_text(name) != text:
+                os.remove(path)
+                raise ValueError(name + ' of ' + run_metric_dir + ' does not round-trip')
+    return sum(len(text.encode('utf-8')) for text in originals.values()), os.path.getsize(path)
+
+
+def extract_run(path, run_metric_dir):
+    os.makedirs(run_metric_dir, exist_ok=True)
+    with ArchiveReader(path) as reader:
+        for name in reader.names():
+            with open(os.path.join(run_metric_dir, name), mode='w', newline='') as f:
+                f.write(reader.read_text(name))
@@ -8,3 +8,19 @@ def load_argument(parser):
     parser.add_argument('--debug', action='store_true', help='Print debug messages when on')
     parser.add_argument('--gui', action='store_true', help='Open charts on GUI')
     parser.add_argument('--output', type=str, help='Location to dump chart')
+
+
+def load_run_set_argument(parser):
+    parser.add_argument('--path', type=str, default='./metrics', help='Path to the metrics directory')
+    black_white_group = parser.add_mutually_exclusive_group(required=False)
+    black_white_group.add_argument('--whitelist', type=str, nargs='+', help='List of groups to include. Check comma separated group_strs inside group.txt')
+    black_white_group.add_argument('--blacklist', type=str, nargs='+', help='List of groups to exclude. Check comma separated group_strs inside group.txt')
+
+
+def load_cache_argument(parser):
+    parser.add_argument('--cache_dir', type=str, default='./.analyzer_cache', help='Directory of the parsed columnar cache')
+    parser.add_argument('--no_cache', action='store_true', help='Always parse the raw .csv files and do not write the cache')
+
+
+def get_cache_dir(args):
+    return None if args.no_cache else args.cache_dir
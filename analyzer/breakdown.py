@@ -0,0 +1,192 @@
+import functools
+import multiprocessing
+import os
+import time
+
+from . import arguments
+from . import cache
+from . import lazy
+from . import utility
+from .runstore import RunStore
+
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Phases of a tick in the order the server runs them. The update time is split into the serialization
+# of the updates and their sending. Waiting for requests fills the rest of server.regular_update_interval
+PHASES = ['request wait', 'request processing', 'barrier 1', 'balance', 'barrier 2', 'serialization', 'send', 'barrier 3']
+PHASE_COLORS = ['#dddddd', 'tab:blue', 'tab:olive', 'tab:red', 'tab:pink', 'tab:green', 'tab:cyan', 'tab:purple']
+
+
+def init(parser):
+    parser.description='Break the ticks of the server down into their phases and show how the share of every phase changes with the number of clients'
+    arguments.load_run_set_argument(parser)
+    parser.add_argument('--run', type=str, help='Plot the phases of every tick of this run, per thread, instead of the run set')
+    parser.add_argument('--busy', action='store_true', help='Leave waiting for requests out, shares are of the rest of the tick')
+    parser.add_argument('--warmup', type=int, default=100, help='Number of leading ticks of every run to ignore')
+    arguments.load_cache_argument(parser)
+    arguments.load_argument(parser)
+
+
+def phase_columns(columns):
+    '''
+    [np.array of ms per tick] indexed like PHASES, None if the run does not record the phases
+    '''
+    if any(name not in columns for name in utility.PHASE_COLUMNS):
+        return None
+    ntick = min(len(columns[name]) for name in utility.PHASE_COLUMNS)
+    return [values[:ntick] for values in [
+        columns['request_wait'],
+        columns['request_time'],
+        columns['barrier1_wait'],
+        columns['balance_time'],
+        columns['barrier2_wait'],
+        columns['update_time'] - columns['send_time'],
+        columns['send_time'],
+        columns['barrier3_wait'],
+    ]]
+
+
+def summarize_run(run_metric_dir, args):
+    '''
+    (run_name, label, {phase: mean ms per tick over all threads}) or None if the run does not record the phases
+    '''
+    if args.debug:
+        print('Debug:', 'Breaking down', run_metric_dir)
+    columns_per_thread = cache.load_run_columns(run_metric_dir, arguments.get_cache_dir(args), args.max_row)
+    phases_per_thread = [phase_columns(columns) for columns in columns_per_thread]
+    if len(phases_per_thread) == 0 or any(phases is None for phases in phases_per_thread):
+        return None
+    means = {phase: float(np.mean(np.concatenate([phases[idx][args.warmup:] for phases in phases_per_thread]))) for idx, phase in enumerate(PHASES)}
+    return os.path.basename(os.path.normpath(run_metric_dir)), tuple(utility.parse_label_file(run_metric_dir)), means
+
+
+def shares(means, busy):
+    '''
+    {phase: % of the tick}, without waiting for requests if busy
+    '''
+    phases = PHASES[1:] if busy else PHASES
+    total = max(sum(means[phase] for phase in phases), 1e-9)
+    return {phase: means[phase] / total * 100. for phase in phases}
+
+
+def main(args):
+    if args.run:
+        show_run_fig(args)
+        return
+
+    store = RunStore(args.path, arguments.get_cache_dir(args))
+    runs = store.filter(whitelist=args.whitelist, blacklist=args.blacklist)
+
+    pool = multiprocessing.Pool()
+    start = time.time()
+    results = [result for result in pool.map(functools.partial(summarize_run, args=args), [run.path for run in runs]) if result]
+    pool.close()
+    print('Info:', 'Breaking down', len(results), 'of', len(runs), 'runs took', float_fmt(time.time() - start), 'seconds')
+    if len(results) == 0:
+        print('Warning:', 'No run records the phases of its ticks. They are written by servers with the', ', '.join(utility.PHASE_COLUMNS), 'columns')
+        return
+    results.sort(key=lambda result: (result[1][1], result[1][0], int(result[1][2]), result[0]))
+
+    phases = PHASES[1:] if args.busy else PHASES
+    print('Info:')
+    print('Info:', '{:<24} {:<22} {:>8} | '.format('run', 'label', 'tick ms') + ' '.join('{:>10}'.format(phase[:10]) for phase in phases))
+    for run_name, label, means in results:
+        run_shares = shares(means, args.busy)
+        print('Info:', '{:<24} {:<22} {:>8} | '.format(run_name, ','.join(label), float_fmt(sum(means[phase] for phase in phases))) + ' '.join('{:>9}%'.format(float_fmt(run_shares[phase])) for phase in phases))
+
+    print('Info:')
+    for config, selected in group_by_config(results).items():
+        if len(selected) < 2:
+            continue
+        first, last = shares(selected[0][2], args.busy), shares(selected[-1][2], args.busy)
+        growth = {phase: last[phase] - first[phase] for phase in phases if phase != 'request wait'}
+        phase = max(growth, key=growth.get)
+        print('Info:', ' '.join(config) + ':', 'from', selected[0][1][2], 'to', selected[-1][1][2], 'clients', phase, 'grew the most, from', float_fmt(first[phase]) + '%', 'to', float_fmt(last[phase]) + '% of the tick')
+
+    if args.gui or args.output:
+        show_fig(args, results)
+
+
+def group_by_config(results):
+    '''
+    {(spread_static, quest_noquest): [result sorted by number of clients]}
+    '''
+    configs = dict()
+    for result in results:
+        configs.setdefault(result[1][:2], list()).append(result)
+    for selected in configs.values():
+        selected.sort(key=lambda result: int(result[1][2]))
+    return configs
+
+
+def show_fig(args, results):
+    '''
+    Share of every phase of the tick against the number of clients, per configuration
+    '''
+    configs = group_by_config(results)
+    phases = PHASES[1:] if args.busy else PHASES
+    colors = PHASE_COLORS[1:] if args.busy else PHASE_COLORS
+    figname = 'breakdown_' + str(len(results))
+    fig = plt.figure(figname, figsize=(16, 8))
+    fig.suptitle('Share of the Tick per Phase' + (' (without waiting for requests)' if args.busy else ''), fontsize=16)
+    for idx, (config, selected) in enumerate(sorted(configs.items())):
+        ax = fig.add_subplot(1, len(configs), idx + 1)
+        nclients = [int(label[2]) for _, label, _ in selected]
+        run_shares = [shares(means, args.busy) for _, _, means in selected]
+        ax.stackplot(nclients, *[[share[phase] for share in run_shares] for phase in phases], labels=phases, colors=colors)
+        ax.set_title(' '.join(config))
+        ax.set(xlabel='Number of Clients', ylabel='Share of the tick (%)')
+        ax.set_ylim(0., 100.)
+        if len(nclients) > 1:
+            ax.set_xlim(min(nclients), max(nclients))
+        ax.grid(axis='x', linestyle='--')
+    ax.legend(loc='upper left', bbox_to_anchor=(1.02, 1.))
+
+    plt.tight_layout()
+    if args.output:
+        filename = os.path.join(args.output, figname)
+        plt.savefig(filename)
+        print('Info:', 'Chart is dumped to', filename)
+    if args.gui:
+        plt.show()
+
+
+def show_run_fig(args):
+    '''
+    Stacked phases of every tick of one run, one chart per thread, smoothed over iter_num ticks
+    '''
+    columns_per_thread = cache.load_run_columns(args.run, arguments.get_cache_dir(args), args.max_row)
+    phases_per_thread = [phase_columns(columns) for columns in columns_per_thread]
+    if len(phases_per_thread) == 0 or any(phases is None for phases in phases_per_thread):
+        print('Error:', args.run, 'does not record the phases of its ticks')
+        return
+    skip = 1 if args.busy else 0
+
+    label = utility.parse_label_file(args.run)
+    figtitle = 'breakdown_' + utility.genereate_run_name(*label) if label else 'breakdown'
+    fig = plt.figure(figtitle, figsize=(16, 3 * len(phases_per_thread) + 1))
+    fig.suptitle(' '.join(figtitle.split('_')), fontsize=16)
+    for thread, phases in enumerate(phases_per_thread):
+        ax = fig.add_subplot(len(phases_per_thread), 1, thread + 1)
+        smooth = [utility.moving_average(values, args.iter_num) for values in phases[skip:]]
+        ax.stackplot(np.arange(len(smooth[0])) + args.iter_num - 1, *smooth, labels=PHASES[skip:], colors=PHASE_COLORS[skip:])
+        ax.set(ylabel='Thread ' + str(thread) + ' (ms)')
+        ax.set_xlim(0, max(1, len(phases[0])))
+        ax.grid(axis='y', linestyle='--')
+        if thread == 0:
+            ax.legend(loc='upper left', bbox_to_anchor=(1.01, 1.))
+    ax.set_xlabel('Iteration')
+
+    plt.tight_layout()
+    if args.output:
+        filename = os.path.join(args.output, figtitle)
+        plt.savefig(filename)
+        print('Info:', 'Chart is dumped to', filename)
+    if args.gui:
+        plt.show()
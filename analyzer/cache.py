@@ -0,0 +1,103 @@
+import hashlib
+import os
+
+from . import archive
+from . import chunked
+from . import lazy
+from . import pyramid
+from . import utility
+
+np = lazy.lazy_import('numpy')
+
+
+# Bump when the layout of the cached files changes
+CACHE_VERSION = 1
+
+
+def cache_key(run_metric_dir, csv_filenames):
+    '''
+    Digest of everything the cached columns depend on, so edited or re-recorded runs are parsed again
+    '''
+    digest = hashlib.sha1()
+    digest.update(str(CACHE_VERSION).encode())
+    digest.update(os.path.abspath(run_metric_dir).encode())
+    for csv_filename in csv_filenames:
+        stat = os.stat(os.path.join(run_metric_dir, csv_filename))
+        digest.update('{}:{}:{}'.format(csv_filename, stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()[:16]
+
+
+def cache_path(run_metric_dir, cache_dir, csv_filenames):
+    run_name = os.path.basename(os.path.normpath(run_metric_dir))
+    return os.path.join(cache_dir, run_name + '-' + cache_key(run_metric_dir, csv_filenames) + '.npz')
+
+
+def pyramid_path(run_metric_dir, cache_dir):
+    '''
+    Path without extension of the pyramids of a run, keyed like the columns
+    Archives are keyed by the archive file itself
+    '''
+    run_name = os.path.basename(os.path.normpath(run_metric_dir))
+    if archive.is_archive(run_metric_dir):
+        stat = os.stat(run_metric_dir)
+        digest = hashlib.sha1()
+        digest.update(str(CACHE_VERSION).encode())
+        digest.update(os.path.abspath(run_metric_dir).encode())
+        digest.update('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode())
+        key = digest.hexdigest()[:16]
+    else:
+        key = cache_key(run_metric_dir, utility.list_thread_csvs(run_metric_dir))
+    return os.path.join(cache_dir, run_name + '-' + key + '.pyramid')
+
+
+def load_run_pyramids(run_metric_dir, cache_dir=None):
+    '''
+    [{column_name: pyramid.Pyramid}] indexed by thread id, over every row of the run
+    Pyramids are built once from the columns and memory-mapped from cache_dir afterwards
+    '''
+    path = pyramid_path(run_metric_dir, cache_dir) if cache_dir else None
+    pyramids = pyramid.read(path) if path else None
+    if pyramids is not None:
+        return pyramids
+
+    data, index = pyramid.build(load_run_columns(run_metric_dir, cache_dir))
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        pyramid.write(path, data, index)
+        return pyramid.read(path)
+    return pyramid.to_pyramids(data, index)
+
+
+def load_run_columns(run_metric_dir, cache_dir=None, max_row=None):
+    '''
+    [{column_name: np.array}] indexed by thread id, as returned by utility.load_columns
+    Parsed columns are stored under cache_dir and reused while the CSV files are unchanged
+    The cache always holds every row, max_row is applied on the way out
+    Archives are already columnar and are read directly
+    '''
+    if archive.is_archive(run_metric_dir):
+        return utility.load_run_columns(run_metric_dir, max_row)
+
+    csv_filenames = utility.list_thread_csvs(run_metric_dir)
+
+    columns_per_thread = None
+    path = cache_path(run_metric_dir, cache_dir, csv_filenames) if cache_dir else None
+    if path and os.path.isfile(path):
+        with np.load(path) as npz:
+            columns_per_thread = [dict() for _ in csv_filenames]
+            for key in npz.files:
+                thread, name = key.split('.', 1)
+                columns_per_thread[int(thread)][name] = npz[key]
+
+    if columns_per_thread is None:
+        columns_per_thread = chunked.load_files([os.path.join(run_metric_dir, csv_filename) for csv_filename in csv_filenames])
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write under a temporary name so concurrent readers never see half a file
+            tmp_path = path + '.' + str(os.getpid()) + '.tmp.npz'
+            np.savez(tmp_path, **{str(thread) + '.' + name: values for thread, columns in enumerate(columns_per_thread) for name, values in columns.items()})
+            os.replace(tmp_path, path)
+
+    if max_row is not None:
+        columns_per_thread = [{name: values[:max_row] for name, values in columns.items()} for columns in columns_per_thread]
+    return columns_per_thread
@@ -0,0 +1,212 @@
+import csv
+import multiprocessing
+import os
+import time
+
+from . import arguments
+from . import lazy
+from . import scalability
+
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def init(parser):
+    parser.description='Fit a saturation model to # client vs update interval and estimate the knee and capacity under an SLO'
+    arguments.load_run_set_argument(parser)
+    parser.add_argument('--slo', type=float, default=100., help='Largest acceptable update interval in ms')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='Number of bootstrap refits used for the uncertainty')
+    parser.add_argument('--confidence', type=float, default=0.9, help='Confidence level of the reported intervals')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the bootstrap resampling')
+    parser.add_argument('--suggest', type=int, default=3, help='Number of client counts to suggest for the next runs')
+    parser.add_argument('--step', type=int, default=100, help='Granularity of the suggested client counts')
+    parser.add_argument('--report', type=str, help='CSV file to write the estimates and suggestions to')
+    arguments.load_argument(parser)
+
+
+def fit_hinge(x, y, nknot=200):
+    '''
+    (intercept, slope, extra_slope, knee, sse) of the least-squares fit of
+        y = intercept + slope * x + extra_slope * max(0, x - knee)
+    Every candidate knee is solved at once through batched normal equations
+    All nan if there are not enough distinct client counts to place a knee
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    distinct = np.unique(x)
+    if len(distinct) < 4:
+        return (np.nan,) * 5
+
+    # Keep at least two distinct client counts on each side of the knee
+    knees = np.linspace(distinct[1], distinct[-2], nknot)
+    # [nknot][len(x)][3]
+    design = np.stack(np.broadcast_arrays(np.ones_like(x), x, np.maximum(0., x[None, :] - knees[:, None])), axis=-1)
+    gram = np.einsum('kni,knj->kij', design, design)
+    moment = np.einsum('kni,n->ki', design, y)
+    solvable = np.abs(np.linalg.det(gram)) > 1e-9
+    if not solvable.any():
+        return (np.nan,) * 5
+    coefs = np.linalg.solve(gram[solvable], moment[solvable][..., None])[..., 0]
+    residuals = y[None, :] - np.einsum('kni,ki->kn', design[solvable], coefs)
+    sse = np.sum(residuals ** 2, axis=1)
+    best = np.argmin(sse)
+    return (*coefs[best], knees[solvable][best], sse[best])
+
+
+def predict_hinge(model, x):
+    intercept, slope, extra_slope, knee, _ = model
+    return intercept + slope * x + extra_slope * np.maximum(0., x - knee)
+
+
+def capacity_under_slo(model, slo, x_max):
+    '''
+    Smallest client count at which the fitted update interval reaches slo
+    nan when the fit stays under slo up to x_max
+    '''
+    grid = np.linspace(0., x_max, 4096)
+    over = np.flatnonzero(predict_hinge(model, grid) >= slo)
+    if len(over) == 0:
+        return np.nan
+    return grid[over[0]]
+
+
+def estimate_capacity(x, y, slo, nresample, confidence, seed):
+    '''
+    {knee, capacity: (estimate, ci_low, ci_high), model, capacity_samples}
+    Uncertainty from a pairs bootstrap of the (nclient, update interval) points
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Extrapolate at most half the sweep past the largest measured client count
+    x_max = x.max() * 1.5
+    model = fit_hinge(x, y)
+
+    rng = np.random.default_rng(seed)
+    knee_samples = np.full(nresample, np.nan)
+    capacity_samples = np.full(nresample, np.nan)
+    for idx, sample in enumerate(rng.integers(0, len(x), size=(nresample, len(x)))):
+        resampled_model = fit_hinge(x[sample], y[sample])
+        if np.isnan(resampled_model[3]):
+            continue
+        knee_samples[idx] = resampled_model[3]
+        capacity_samples[idx] = capacity_under_slo(resampled_model, slo, x_max)
+
+    alpha = (1. - confidence) / 2.
+    def interval(estimate, samples):
+        samples = samples[~np.isnan(samples)]
+        if len(samples) == 0:
+            return (estimate, np.nan, np.nan)
+        return (estimate, *np.quantile(samples, [alpha, 1. - alpha]))
+
+    return {
+        'model': model,
+        'knee': interval(model[3], knee_samples),
+        'capacity': interval(capacity_under_slo(model, slo, x_max) if not np.isnan(model[3]) else np.nan, capacity_samples),
+        'capacity_samples': capacity_samples,
+    }
+
+
+def estimate_capacity_wrapper(single_arg):
+    return estimate_capacity(*single_arg)
+
+
+def suggest_client_counts(estimate, measured, count, step):
+    '''
+    [nclient] to run next, spread over the bootstrap distribution of the capacity
+    Runs placed where the SLO crossing is still uncertain narrow the interval the most
+    '''
+    samples = estimate['capacity_samples']
+    samples = samples[~np.isnan(samples)]
+    if len(samples) == 0 or count <= 0:
+        return list()
+
+    measured = set(measured)
+    suggestions = list()
+    # Start from the median and widen towards the tails
+    for quantile in sorted(np.linspace(0., 1., count + 2)[1:-1], key=lambda q: abs(q - 0.5)):
+        nclient = int(max(step, round(np.quantile(samples, quantile) / step) * step))
+        while nclient in measured or nclient in suggestions:
+            nclient += step
+        suggestions.append(nclient)
+    return sorted(suggestions)
+
+
+def main(args):
+    pool = multiprocessing.Pool()
+    _, database = scalability.load_database(pool, args)
+
+    configs = [(quest_noquest, static_spread) for quest_noquest, chart_database in database.items() for static_spread in chart_database]
+    points = [list(zip(*database[quest_noquest][static_spread]))[0:2] for quest_noquest, static_spread in configs]
+
+    print('Info:', 'Fitting', len(configs), 'configurations with', args.bootstrap, 'bootstrap refits each...')
+    start = time.time()
+    estimates = pool.map(estimate_capacity_wrapper, [(x, y, args.slo, args.bootstrap, args.confidence, args.seed + idx) for idx, (x, y) in enumerate(points)])
+    pool.close()
+    print('Info:', 'Fitting took', float_fmt(time.time() - start), 'seconds')
+
+    def interval_fmt(interval):
+        estimate, ci_low, ci_high = interval
+        return float_fmt(estimate) + ' [' + float_fmt(ci_low) + ', ' + float_fmt(ci_high) + ']'
+
+    print('Info:')
+    print('Info:', 'Capacity under SLO of', float_fmt(args.slo), 'ms at', '{:.0%}'.format(args.confidence), 'confidence:')
+    rows = list()
+    for (quest_noquest, static_spread), (x, _), estimate in zip(configs, points, estimates):
+        suggestions = suggest_client_counts(estimate, x, args.suggest, args.step)
+        print('Info:', '    [' + quest_noquest + '] [' + static_spread + ']', str(len(x)), 'runs')
+        print('Info:', '        knee     =', interval_fmt(estimate['knee']))
+        print('Info:', '        capacity =', interval_fmt(estimate['capacity']))
+        if np.isnan(estimate['capacity'][0]):
+            print('Warning:', '        Fit stays under the SLO, capacity is beyond the measured client counts')
+        print('Info:', '        next runs:', *suggestions)
+        rows.append([quest_noquest, static_spread, len(x), *estimate['knee'], *estimate['capacity'], ' '.join(map(str, suggestions))])
+
+    if args.report:
+        with open(args.report, mode='w', newline='') as f:
+            csv_writer = csv.writer(f, delimiter=',')
+            csv_writer.writerow(['quest_noquest', 'static_spread', 'nrun', 'knee', 'knee_low', 'knee_high', 'capacity', 'capacity_low', 'capacity_high', 'suggestions'])
+            csv_writer.writerows(rows)
+        print('Info:', 'Report is written to', args.report)
+
+    if args.gui or args.output:
+        show_fig(args, database, configs, estimates)
+
+
+def show_fig(args, database, configs, estimates):
+    quests = list(database)
+    figname = 'capacity_' + '{:.0f}'.format(args.slo) + 'ms'
+    fig = plt.figure(figname, figsize=(16, 8))
+    fig.suptitle('Update Interval Saturation Model (SLO ' + float_fmt(args.slo) + ' ms)', fontsize=16)
+    axes = {quest_noquest: fig.add_subplot(1, len(quests), idx+1) for idx, quest_noquest in enumerate(quests)}
+
+    for (quest_noquest, static_spread), estimate in zip(configs, estimates):
+        ax = axes[quest_noquest]
+        x, y = list(zip(*database[quest_noquest][static_spread]))[0:2]
+        points, = ax.plot(x, y, 'o', label=static_spread)
+        if not np.isnan(estimate['model'][3]):
+            grid = np.linspace(0., max(x), 512)
+            ax.plot(grid, predict_hinge(estimate['model'], grid), '-', color=points.get_color())
+            ax.axvline(estimate['knee'][0], color=points.get_color(), linestyle=':')
+        capacity, ci_low, ci_high = estimate['capacity']
+        if not np.isnan(ci_low):
+            ax.axvspan(ci_low, ci_high, color=points.get_color(), alpha=0.15)
+
+    for quest_noquest, ax in axes.items():
+        ax.set_title(quest_noquest)
+        ax.axhline(args.slo, color='k', linestyle='--', label='SLO')
+        ax.legend()
+        ax.set(xlabel='Number of Clients', ylabel='Update Interval Time (ms)')
+        ax.set_ylim(bottom=0.)
+        ax.grid(axis='x', linestyle='--')
+        ax.grid(axis='y', linestyle='-')
+
+    if args.output:
+        filename = os.path.join(args.output, figname)
+        plt.savefig(filename)
+        print('Info:', 'Chart is dumped to', filename)
+    if args.gui:
+        plt.show()
@@ -0,0 +1,141 @@
+import atexit
+import mmap
+import multiprocessing
+import os
+
+from . import lazy
+from . import utility
+
+np = lazy.lazy_import('numpy')
+
+
+# Files are split into chunks of at least this many bytes, smaller files are parsed in one piece
+CHUNK_BYTES = 1 << 19
+
+# Started on first use and kept for the next run opened by the same process
+pool = None
+
+
+def get_pool():
+    global pool
+    if pool is None:
+        pool = multiprocessing.Pool()
+        atexit.register(pool.terminate)
+    return pool
+
+
+def plan_chunks(filename, max_row=None, chunk_bytes=CHUNK_BYTES, nchunk=None):
+    '''
+    (header_line, [(start, stop)]) byte ranges of the data lines of a .csv, every range starting and ending at a line boundary
+    Ranges cover the first max_row data lines, split in nchunk (one per cpu by default) of at least chunk_bytes
+    '''
+    with open(filename, mode='rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return '', list()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            buffer = np.frombuffer(mm, dtype=np.uint8)
+            # End of every line, the last line may have no newline when the server was cut short
+            ends = np.flatnonzero(buffer == ord('\n')) + 1
+            del buffer
+            if len(ends) == 0 or ends[-1] != len(mm):
+                ends = np.append(ends, len(mm))
+            header_line = mm[:ends[0]].decode()
+
+    ends = ends[1:] if max_row is None else ends[1:1 + max_row]
+    if len(ends) == 0:
+        return header_line, list()
+    start = len(header_line.encode())
+    nbyte = int(ends[-1]) - start
+    nchunk = max(1, min(nchunk or os.cpu_count() or 1, nbyte // chunk_bytes))
+    # Last line of every chunk, the one ending closest past an equal share of the bytes
+    targets = start + np.arange(1, nchunk) * (nbyte / nchunk)
+    cuts = np.unique(np.concatenate([ends[np.minimum(np.searchsorted(ends, targets), len(ends) - 1)], ends[-1:]]))
+    return header_line, list(zip([start] + cuts[:-1].tolist(), cuts.tolist()))
+
+
+def parse_chunk(task):
+    '''
+    utility.parse_lines of the byte range (start, stop) of a .csv
+    '''
+    filename, header_line, start, stop = task
+    with open(filename, mode='rb') as f:
+        f.seek(start)
+        lines = f.read(stop - start).decode().splitlines(keepends=True)
+    return utility.parse_lines(header_line, lines)
+
+
+def stitch(chunks):
+    '''
+    {column_name: np.array} of the chunks of one file in order
+    '''
+    if len(chunks) == 1:
+        return chunks[0]
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def load_chunks(filenames, max_row=None, chunk_bytes=CHUNK_BYTES):
+    '''
+    [[{column_name: np.array} of every chunk in order]] of every file, the chunks of all files parsed in one pool
+    Inside pool workers, e.g. of the subcommands that spread runs over processes, chunks are parsed in turn
+    '''
+    parallel = not multiprocessing.current_process().daemon and (os.cpu_count() or 1) > 1
+    plans = [plan_chunks(filename, max_row, chunk_bytes, None if parallel else 1) for filename in filenames]
+    tasks = [(filename, header_line, start, stop) for filename, (header_line, ranges) in zip(filenames, plans) for start, stop in ranges]
+    if parallel and len(tasks) > 1:
+        chunks = get_pool().map(parse_chunk, tasks, chunksize=1)
+    else:
+        chunks = [parse_chunk(task) for task in tasks]
+
+    chunks_per_file = list()
+    for header_line, ranges in plans:
+        file_chunks, chunks = chunks[:len(ranges)], chunks[len(ranges):]
+        chunks_per_file.append(file_chunks if file_chunks else [utility.parse_lines(header_line, list())])
+    return chunks_per_file
+
+
+def load_files(filenames, max_row=None, chunk_bytes=CHUNK_BYTES):
+    '''
+    [utility.load_columns(filename, max_row)] of every file
+    '''
+    return [stitch(chunks) for chunks in load_chunks(filenames, max_row, chunk_bytes)]
+
+
+def load_run_columns(run_metric_dir, max_row=None):
+    '''
+    utility.load_run_columns of a run directory, every thread file chunked and parsed in parallel
+    '''
+    return load_files(thread_filenames(run_metric_dir), max_row)
+
+
+def load_run_avgs(run_metric_dir, iter_num, max_row=None, raw=False):
+    '''
+    [utility.columns_to_avg(columns, iter_num, raw)] indexed by thread id of a run directory
+    Averages are taken chunk by chunk, see stitched_moving_average
+    '''
+    avgs = list()
+    for chunks in load_chunks(thread_filenames(run_metric_dir), max_row):
+        avg_chunks = [utility.columns_to_avg(chunk, iter_num, raw=True) for chunk in chunks]
+        ncol = len(avg_chunks[0])
+        if raw:
+            avgs.append([np.concatenate([avg[col] for avg in avg_chunks]) for col in range(ncol)])
+        else:
+            avgs.append([stitched_moving_average([avg[col] for avg in avg_chunks], iter_num) for col in range(ncol)])
+    return avgs
+
+
+def thread_filenames(run_metric_dir):
+    return [os.path.join(run_metric_dir, csv_filename) for csv_filename in utility.list_thread_csvs(run_metric_dir)]
+
+
+def stitched_moving_average(chunks, iter_num):
+    '''
+    utility.moving_average of the concatenated chunks without concatenating them
+    The last iter_num - 1 values of the chunks so far are carried into the next one, so windows across chunk boundaries are complete
+    '''
+    averages = list()
+    carry = np.zeros(0)
+    for chunk in chunks:
+        values = np.concatenate((carry, chunk))
+        averages.append(utility.moving_average(values, iter_num))
+        carry = values[max(0, len(values) - iter_num + 1):]
+    return np.concatenate(averages) if averages else np.zeros(0)
@@ -0,0 +1,131 @@
+import csv
+import json
+import os
+
+from . import arguments
+from . import lazy
+from . import utility
+from .runstore import RunStore
+
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Written by the launcher (clocksync.py at the top of the repository) and moved into the run directory by the server:
+#     {'reference': server host, 'hosts': {host: {'offset', 'drift', 'time', 'uncertainty', 'start', 'end'}}}
+# offset is the clock of the host minus the clock of the server host in seconds at epoch second time, drift in seconds per second
+CLOCKS_FILENAME = 'clocks.json'
+
+
+def init(parser):
+    parser.description='Show the clock offset and drift of every client host of the runs against their server and flag the runs whose client timestamps cannot be aligned within a tolerance'
+    arguments.load_run_set_argument(parser)
+    parser.add_argument('--tolerance', type=float, default=1., help='Flag hosts whose offset is known less precisely than this many ms over the run')
+    parser.add_argument('--report', type=str, help='CSV file to write the clock of every host of every run to')
+    arguments.load_cache_argument(parser)
+    arguments.load_argument(parser)
+
+
+def load_run_clocks(run_metric_dir):
+    '''
+    {host: clock} of a run as in CLOCKS_FILENAME, None if its clocks were not probed
+    '''
+    text = utility.read_run_file(run_metric_dir, CLOCKS_FILENAME)
+    return json.loads(text)['hosts'] if text else None
+
+
+def offset_at(clock, times):
+    '''
+    Offset in seconds of the clock of a host at epoch seconds times of the server host
+    '''
+    return clock['offset'] + clock['drift'] * (np.asarray(times, dtype=np.float64) - clock['time'])
+
+
+def to_server_time(clock, times):
+    '''
+    Epoch seconds times read on the clock of a host, on the clock of the server host instead
+    Offsets are at most milliseconds and drifts ppm, so evaluating the offset at the host time is exact enough
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    return times - offset_at(clock, times - clock['offset'])
+
+
+def error_bound(clock, times):
+    '''
+    Seconds to_server_time may be off by at epoch seconds times, growing outside the probed span
+    '''
+    start, end = clock.get('start'), clock.get('end')
+    if start is None or end is None or end['time'] <= start['time']:
+        return np.full(np.shape(times), clock['uncertainty'])
+    drift_bound = (start['uncertainty'] + end['uncertainty']) / (end['time'] - start['time'])
+    outside = np.maximum(0., np.maximum(start['time'] - np.asarray(times), np.asarray(times) - end['time']))
+    return clock['uncertainty'] + drift_bound * outside
+
+
+def merge_timelines(clocks, host_times):
+    '''
+    (np.array of server epoch seconds, np.array of host index) of {host: epoch seconds on its clock} merged in time order
+    Hosts without a probed clock are left out with a warning
+    '''
+    hosts = sorted(host for host in host_times if host in clocks)
+    for host in sorted(set(host_times).difference(hosts)):
+        print('Warning:', 'The clock of', host, 'was not probed, its timestamps are left out')
+    if not hosts:
+        return np.zeros(0), np.zeros(0, dtype=np.intp)
+    times = np.concatenate([to_server_time(clocks[host], host_times[host]) for host in hosts])
+    indices = np.concatenate([np.full(len(host_times[host]), idx, dtype=np.intp) for idx, host in enumerate(hosts)])
+    order = np.argsort(times, kind='stable')
+    return times[order], indices[order]
+
+
+def main(args):
+    store = RunStore(args.path, arguments.get_cache_dir(args))
+    runs = store.filter(whitelist=args.whitelist, blacklist=args.blacklist)
+
+    results = list()
+    for run in runs:
+        clocks = load_run_clocks(run.path)
+        if clocks is None:
+            if args.debug:
+                print('Debug:', run.path, 'does not have', CLOCKS_FILENAME)
+            continue
+        results.append((os.path.basename(os.path.normpath(run.path)), tuple(utility.parse_label_file(run.path)), clocks))
+    print('Info:', len(results), 'of', len(runs), 'runs have', CLOCKS_FILENAME)
+    if len(results) == 0:
+        print('Warning:', 'No run probed the clocks of its client hosts. They are probed by super.py --clock_probes')
+        return
+
+    print('Info:')
+    print('Info:', '{:<24} {:<22} {:<28} {:>12} {:>10} {:>11} {:>10}'.format('run', 'label', 'host', 'offset ms', '+- ms', 'drift ppm', 'rtt ms'))
+    flagged = list()
+    rows = list()
+    for run_name, label, clocks in results:
+        for host, clock in sorted(clocks.items()):
+            rtt = max(estimate['rtt'] for estimate in [clock.get('start'), clock.get('end')] if estimate)
+            # Worst case over the probed span, where the timestamps of the run are
+            bound = float(error_bound(clock, clock['end']['time'] if clock.get('end') else clock['time'])) * 1000.
+            print('Info:', '{:<24} {:<22} {:<28} {:>+12.3f} {:>10.3f} {:>+11.2f} {:>10.3f}'.format(run_name, ','.join(label), host, clock['offset'] * 1000., bound, clock['drift'] * 1e6, rtt * 1000.))
+            rows.append([run_name, *label, host, clock['offset'] * 1000., bound, clock['drift'] * 1e6, rtt * 1000., int(clock.get('end') is not None)])
+            if bound > args.tolerance:
+                flagged.append((run_name, host, bound))
+            if clock.get('end') is None:
+                flagged.append((run_name, host, None))
+
+    print('Info:')
+    for run_name, host, bound in flagged:
+        if bound is None:
+            print('Warning:', run_name, host, 'was only probed once, its drift is unknown')
+        else:
+            print('Warning:', run_name, host, 'is only known to', float_fmt(bound), 'ms, above the tolerance of', float_fmt(args.tolerance), 'ms')
+    if not flagged:
+        print('Info:', 'Every host is aligned to within', float_fmt(args.tolerance), 'ms')
+
+    if args.report:
+        with open(args.report, mode='w', newline='') as f:
+            csv_writer = csv.writer(f, delimiter=',')
+            csv_writer.writerow(['run', 'static_spread', 'quest_noquest', 'nclient', 'host', 'offset_ms', 'uncertainty_ms', 'drift_ppm', 'rtt_ms', 'probed_twice'])
+            csv_writer.writerows(rows)
+        print('Info:', 'Report is written to', args.report)
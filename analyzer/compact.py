@@ -0,0 +1,82 @@
+import functools
+import multiprocessing
+import os
+import shutil
+import time
+
+from . import archive
+from . import utility
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def sizeof_fmt(num, suffix='B'):
+    for unit in ['', 'Ki', 'Mi']:
+        if abs(num) < 1024.0:
+            return '%3.2f%s%s' % (num, unit, suffix)
+        num /= 1024.0
+    return '%.2f%s%s' % (num, 'Gi', suffix)
+
+
+def init(parser):
+    parser.description='Convert finished run directories into single compressed columnar archives and back'
+    parser.add_argument('--path', type=str, default='./metrics', help='Path to the metrics directory')
+    parser.add_argument('--runs', type=str, nargs='+', help='Only these run names. All runs by default')
+    parser.add_argument('--codec', type=str, default='lzma', choices=sorted(archive.CODECS), help='Compression of the archive chunks')
+    parser.add_argument('--chunk_rows', type=int, default=16384, help='Rows per independently compressed chunk')
+    parser.add_argument('--remove', action='store_true', help='Delete the originals once they are verified to round-trip')
+    parser.add_argument('--extract', action='store_true', help='Turn archives back into run directories instead')
+
+
+def compact_run(run_name, args):
+    '''
+    (run_name, original bytes, archive bytes) or None on failure
+    '''
+    run_metric_dir = os.path.join(args.path, run_name)
+    try:
+        original_size, archive_size = archive.compact_run(run_metric_dir, run_metric_dir + archive.EXTENSION, args.codec, args.chunk_rows)
+    except ValueError as e:
+        print('Error:', str(e) + '. Kept as is')
+        return None
+    if args.remove:
+        shutil.rmtree(run_metric_dir)
+    return run_name, original_size, archive_size
+
+
+def extract_run(run_name, args):
+    archive_path = os.path.join(args.path, run_name)
+    run_metric_dir = archive_path[:-len(archive.EXTENSION)]
+    archive.extract_run(archive_path, run_metric_dir)
+    if args.remove:
+        os.remove(archive_path)
+    return run_name
+
+
+def main(args):
+    run_names = args.runs if args.runs else utility.list_runs(args.path)
+    start = time.time()
+    pool = multiprocessing.Pool()
+
+    if args.extract:
+        run_names = [run_name for run_name in run_names if archive.is_archive(os.path.join(args.path, run_name))]
+        print('Info:', 'Extracting', len(run_names), 'archives...')
+        pool.map(functools.partial(extract_run, args=args), run_names)
+        pool.close()
+        print('Info:', 'Extracting took', float_fmt(time.time() - start), 'seconds')
+        return
+
+    run_names = [run_name for run_name in run_names if os.path.isdir(os.path.join(args.path, run_name))]
+    print('Info:', 'Compacting', len(run_names), 'runs with', args.codec + '...')
+    results = list(filter(None, pool.map(functools.partial(compact_run, args=args), run_names)))
+    pool.close()
+
+    for run_name, original_size, archive_size in results:
+        print('Info:', '    ' + run_name, sizeof_fmt(original_size), '->', sizeof_fmt(archive_size))
+    total_original = sum(result[1] for result in results)
+    total_archive = sum(result[2] for result in results)
+    print('Info:')
+    print('Info:', 'Compacted', len(results), 'runs', sizeof_fmt(total_original), '->', sizeof_fmt(total_archive), '(' + float_fmt(total_original / total_archive if total_archive else 0.) + 'x)', 'in', float_fmt(time.time() - start), 'seconds')
+    if not args.remove:
+        print('Info:', 'Originals are kept. Use --remove to delete them once archived')
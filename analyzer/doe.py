@@ -0,0 +1,305 @@
+import configparser
+import functools
+import itertools
+import multiprocessing
+import os
+import time
+
+from . import arguments
+from . import lazy
+from . import utility
+from .runstore import Run, RunStore
+
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Written by super.py and moved into the run directory by the server, the config the run was started with
+CONFIG_FILENAME = 'config.ini'
+# Factor of the number of clients, taken from the label of the run
+COUNT_FACTOR = 'count'
+# Steps over the measured range of a numeric factor the best settings are picked on
+GRID_STEPS = 10
+
+
+def init(parser):
+    parser.description='Fit a surrogate of the tail update interval against the server settings the runs vary, e.g. a sweep.py design, and show the most influential settings and the best ones for a client count'
+    arguments.load_run_set_argument(parser)
+    parser.add_argument('--params', type=str, nargs='+', help='Settings to model, e.g. server.light_level. Every setting that differs between the runs by default')
+    parser.add_argument('--quantile', type=float, default=99., help='Percentile of the update interval to model')
+    parser.add_argument('--warmup', type=int, default=100, help='Number of leading ticks of every run to ignore')
+    parser.add_argument('--target', type=int, help='Client count to find the best settings for. The largest measured by default')
+    parser.add_argument('--ridge', type=float, default=1e-3, help='Ridge penalty of the surrogate, keeps it stable when the design has fewer runs than terms')
+    parser.add_argument('--candidates', type=int, default=20000, help='Random settings the surrogate is evaluated on to rank settings and find the best ones')
+    parser.add_argument('--top', type=int, default=5, help='Number of best settings to show')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the candidate settings')
+    arguments.load_cache_argument(parser)
+    arguments.load_argument(parser)
+
+
+def parse_config(text):
+    '''
+    {setting: str} of every section of a server config
+    '''
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    return {key: value for section in config.sections() for key, value in config[section].items()}
+
+
+def load_run(run_metric_dir, args):
+    '''
+    (run_name, {setting: str}, tail update interval in ms) or None if the run has no config or label
+    '''
+    text = utility.read_run_file(run_metric_dir, CONFIG_FILENAME)
+    run = Run(run_metric_dir, arguments.get_cache_dir(args))
+    if text is None or run.label is None:
+        if args.debug:
+            print('Debug:', run_metric_dir, 'does not have', CONFIG_FILENAME, 'or a label')
+        return None
+    settings = parse_config(text)
+    settings[COUNT_FACTOR] = str(run.nclient)
+    tail = run.summary(args.quantile, args.warmup, args.max_row)['update_interval_tail']
+    return run.name, settings, tail
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+class Factors:
+    '''
+    Encoding of settings into the terms of a quadratic surrogate
+    Numeric factors are scaled to [-1, 1] over their measured range and get linear terms, categorical ones a 0/1 term per level but the first
+    Squares and then pairwise interactions are added while there are at least two runs per term
+    '''
+    def __init__(self, names, settings):
+        self.names = names
+        self.numeric = [name for name in names if all(is_number(setting[name]) for setting in settings)]
+        self.levels = {name: sorted(set(setting[name] for setting in settings)) for name in names if name not in self.numeric}
+        values = {name: np.array([float(setting[name]) for setting in settings]) for name in self.numeric}
+        self.low = {name: float(values[name].min()) for name in self.numeric}
+        self.high = {name: float(values[name].max()) for name in self.numeric}
+        self.integer = {name: all(float(setting[name]).is_integer() for setting in settings) for name in self.numeric}
+        # Squares need a third level to be told apart from the linear term
+        self.curved = [name for name in self.numeric if len(np.unique(values[name])) >= 3]
+        self.pairs = list(itertools.combinations(self.numeric, 2))
+        nlinear = 1 + len(self.numeric) + sum(len(levels) - 1 for levels in self.levels.values())
+        if len(settings) < 2 * (nlinear + len(self.curved)):
+            self.curved = list()
+        if len(settings) < 2 * (nlinear + len(self.curved) + len(self.pairs)):
+            self.pairs = list()
+
+    def scale(self, name, values):
+        return 2. * (np.asarray(values, dtype=np.float64) - self.low[name]) / (self.high[name] - self.low[name]) - 1.
+
+    def snap(self, name, values):
+        '''
+        values moved to the nearest of GRID_STEPS + 1 points over the measured range, integers kept integral
+        '''
+        step = (self.high[name] - self.low[name]) / GRID_STEPS
+        snapped = self.low[name] + np.round((np.asarray(values, dtype=np.float64) - self.low[name]) / step) * step
+        return np.round(snapped) if self.integer[name] else snapped
+
+    def terms(self):
+        names = ['1'] + self.numeric + [name + '^2' for name in self.curved]
+        names += [a + ' x ' + b for a, b in self.pairs]
+        names += [name + '=' + level for name, levels in self.levels.items() for level in levels[1:]]
+        return names
+
+    def encode(self, columns):
+        '''
+        [nrow][nterm] np.array of {factor: [values]}
+        '''
+        nrow = len(next(iter(columns.values())))
+        scaled = {name: self.scale(name, columns[name]) for name in self.numeric}
+        terms = [np.ones(nrow)] + [scaled[name] for name in self.numeric] + [scaled[name] ** 2 for name in self.curved]
+        terms += [scaled[a] * scaled[b] for a, b in self.pairs]
+        terms += [np.array([value == level for value in columns[name]], dtype=np.float64) for name, levels in self.levels.items() for level in levels[1:]]
+        return np.stack(terms, axis=1)
+
+    def sample(self, count, rng, fixed=None):
+        '''
+        {factor: [values]} of count random settings inside the measured ranges, fixed {factor: value} held
+        '''
+        columns = dict()
+        for name in self.numeric:
+            values = rng.uniform(self.low[name], self.high[name], count)
+            columns[name] = np.round(values) if self.integer[name] else values
+        for name, levels in self.levels.items():
+            columns[name] = [levels[idx] for idx in rng.integers(0, len(levels), count)]
+        for name, value in (fixed or dict()).items():
+            columns[name] = np.full(count, float(value)) if name in self.numeric else [value] * count
+        return columns
+
+
+def format_value(factors, name, value):
+    if name not in factors.numeric:
+        return value
+    return str(int(value)) if factors.integer[name] else float_fmt(value)
+
+
+def fit(design, response, ridge):
+    '''
+    Coefficients of the ridge regression of response on the design, the intercept is not penalized
+    '''
+    penalty = np.eye(design.shape[1]) * ridge * len(response)
+    penalty[0, 0] = 0.
+    return np.linalg.solve(design.T @ design + penalty, design.T @ response)
+
+
+def leave_one_out(design, response, ridge):
+    '''
+    np.array of the prediction of every run by the surrogate fitted on the others
+    '''
+    predictions = np.zeros(len(response))
+    for idx in range(len(response)):
+        keep = np.arange(len(response)) != idx
+        predictions[idx] = design[idx] @ fit(design[keep], response[keep], ridge)
+    return predictions
+
+
+def influence(factors, coefficients, candidates, ngrid=9):
+    '''
+    {factor: mean ms the predicted tail spans when the factor alone sweeps its range}, the other factors at the candidate settings
+    '''
+    spans = dict()
+    count = len(next(iter(candidates.values())))
+    for name in factors.names:
+        grid = np.linspace(factors.low[name], factors.high[name], ngrid) if name in factors.numeric else factors.levels[name]
+        predictions = list()
+        for value in grid:
+            columns = dict(candidates)
+            columns[name] = np.full(count, float(value)) if name in factors.numeric else [value] * count
+            predictions.append(np.exp(factors.encode(columns) @ coefficients))
+        predictions = np.stack(predictions)
+        spans[name] = float(np.mean(predictions.max(axis=0) - predictions.min(axis=0)))
+    return spans
+
+
+def main(args):
+    store = RunStore(args.path, arguments.get_cache_dir(args))
+    runs = store.filter(whitelist=args.whitelist, blacklist=args.blacklist)
+
+    pool = multiprocessing.Pool()
+    start = time.time()
+    results = [result for result in pool.map(functools.partial(load_run, args=args), [run.path for run in runs]) if result and np.isfinite(result[2])]
+    pool.close()
+    print('Info:', 'Loading', len(results), 'of', len(runs), 'runs with', CONFIG_FILENAME, 'took', float_fmt(time.time() - start), 'seconds')
+    if len(results) < 3:
+        print('Warning:', 'Too few runs record their config to fit a surrogate. Runs started by super.py keep theirs, sweep.py runs a design')
+        return
+
+    run_names, settings, tails = zip(*results)
+    names = args.params + [COUNT_FACTOR] if args.params else sorted(name for name in settings[0] if len(set(setting.get(name) for setting in settings)) > 1)
+    names = [name for name in names if len(set(setting.get(name) for setting in settings)) > 1]
+    missing = [name for name in names if any(name not in setting for setting in settings)]
+    if missing:
+        print('Error:', 'Not every run has', ', '.join(missing))
+        return
+    if not names:
+        print('Warning:', 'The runs do not differ in any setting')
+        return
+
+    factors = Factors(names, settings)
+    design = factors.encode({name: [setting[name] for setting in settings] for name in names})
+    # The tail grows about exponentially past the knee, a log response keeps the fit from chasing the worst run
+    response = np.log(np.array(tails))
+    coefficients = fit(design, response, args.ridge)
+    fitted = np.exp(design @ coefficients)
+    loo = np.exp(leave_one_out(design, response, args.ridge))
+    measured = np.array(tails)
+    r2 = 1. - np.sum((response - design @ coefficients) ** 2) / max(np.sum((response - response.mean()) ** 2), 1e-12)
+
+    print('Info:')
+    print('Info:', len(results), 'runs over', len(names), 'settings,', design.shape[1], 'terms: ' + ', '.join(factors.terms()))
+    print('Info:', '    ', 'R^2 of log p' + '{:g}'.format(args.quantile), float_fmt(r2) + ',', 'leave one out error', float_fmt(float(np.sqrt(np.mean((loo - measured) ** 2)))), 'ms RMS,', float_fmt(float(np.median(np.abs(loo - measured) / measured) * 100.)) + '% median')
+    if design.shape[1] > len(results):
+        print('Warning:', '    ', 'More terms than runs, the ridge penalty decides between aliased terms')
+
+    rng = np.random.default_rng(args.seed)
+    spans = influence(factors, coefficients, factors.sample(min(args.candidates, 2000), rng))
+    print('Info:')
+    print('Info:', '{:<36} {:>14} {:>24}'.format('setting', 'influence ms', 'measured range'))
+    for name, span in sorted(spans.items(), key=lambda item: -item[1]):
+        measured_range = float_fmt(factors.low[name]) + ' .. ' + float_fmt(factors.high[name]) if name in factors.numeric else ','.join(factors.levels[name])
+        print('Info:', '{:<36} {:>14} {:>24}'.format(name, float_fmt(span), measured_range))
+
+    fixed = dict()
+    if COUNT_FACTOR in factors.numeric:
+        target = args.target if args.target is not None else int(factors.high[COUNT_FACTOR])
+        if not factors.low[COUNT_FACTOR] <= target <= factors.high[COUNT_FACTOR]:
+            print('Warning:', target, 'clients is outside the measured', int(factors.low[COUNT_FACTOR]), '..', str(int(factors.high[COUNT_FACTOR])) + ',', 'the surrogate extrapolates')
+        fixed[COUNT_FACTOR] = target
+    candidates = factors.sample(args.candidates, rng, fixed)
+    # Random candidates differ in digits nobody sets, on a grid the best ones are distinct settings
+    for name in factors.numeric:
+        if name not in fixed:
+            candidates[name] = factors.snap(name, candidates[name])
+    predictions = np.exp(factors.encode(candidates) @ coefficients)
+    order = np.argsort(predictions)
+    print('Info:')
+    print('Info:', 'Best settings' + (' for ' + str(fixed[COUNT_FACTOR]) + ' clients' if fixed else '') + ', predicted p' + '{:g}'.format(args.quantile), 'update interval:')
+    shown = set()
+    for idx in order:
+        setting = ' '.join(name + '=' + format_value(factors, name, candidates[name][idx]) for name in names if name != COUNT_FACTOR)
+        if setting in shown:
+            continue
+        shown.add(setting)
+        print('Info:', '    ', '{:>10} ms'.format(float_fmt(predictions[idx])), setting)
+        if len(shown) == args.top:
+            break
+
+    # Only the runs at the client count of the predictions compare with them
+    compared = np.arange(len(measured))
+    if fixed:
+        distances = np.abs(np.array([float(setting[COUNT_FACTOR]) for setting in settings]) - fixed[COUNT_FACTOR])
+        compared = np.flatnonzero(distances == distances.min())
+    best = compared[int(np.argmin(measured[compared]))]
+    print('Info:', '    ', 'Best measured' + (' at ' + settings[best][COUNT_FACTOR] + ' clients' if fixed else '') + ':', float_fmt(measured[best]), 'ms in', run_names[best], ' '.join(name + '=' + settings[best][name] for name in names if name != COUNT_FACTOR))
+
+    if args.gui or args.output:
+        show_fig(args, spans, measured, fitted, loo)
+
+
+def show_fig(args, spans, measured, fitted, loo):
+    '''
+    Influence of every setting, and the surrogate against the measured tail of every run
+    '''
+    figname = 'doe_' + str(len(measured))
+    fig = plt.figure(figname, figsize=(16, 7))
+    fig.suptitle('Surrogate of the p' + '{:g}'.format(args.quantile) + ' Update Interval', fontsize=16)
+
+    ax = fig.add_subplot(1, 2, 1)
+    ranked = sorted(spans.items(), key=lambda item: item[1])
+    ax.barh(range(len(ranked)), [span for _, span in ranked], color='tab:blue')
+    ax.set_yticks(range(len(ranked)))
+    ax.set_yticklabels([name for name, _ in ranked])
+    ax.set(title='Influence', xlabel='Predicted tail span over the setting range (ms)')
+    ax.grid(axis='x', linestyle='--')
+
+    ax = fig.add_subplot(1, 2, 2)
+    ax.scatter(measured, fitted, label='fitted', color='tab:blue')
+    ax.scatter(measured, loo, label='left out', color='tab:orange', marker='x')
+    limits = [min(measured.min(), fitted.min(), loo.min()), max(measured.max(), fitted.max(), loo.max())]
+    ax.plot(limits, limits, 'k--', linewidth=0.8)
+    ax.set(title='Surrogate against measured', xlabel='Measured (ms)', ylabel='Predicted (ms)')
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.legend()
+    ax.grid(linestyle='--')
+
+    plt.tight_layout()
+    if args.output:
+        filename = os.path.join(args.output, figname)
+        plt.savefig(filename)
+        print('Info:', 'Chart is dumped to', filename)
+    if args.gui:
+        plt.show()
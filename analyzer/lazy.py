@@ -0,0 +1,35 @@
+import importlib
+
+
+class LazyModule:
+    '''
+    Stands in for a module and imports it the first time one of its attributes is used
+    Attributes are kept on the stand-in once looked up, so later uses cost a plain attribute access
+    '''
+    def __init__(self, name, package):
+        self.__name = name
+        self.__package = package
+        self.__module = None
+
+    def is_loaded(self):
+        return self.__module is not None
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        if self.__module is None:
+            try:
+                self.__module = importlib.import_module(self.__name)
+            except ImportError:
+                print('Please pip install', self.__package)
+                raise
+        value = getattr(self.__module, attr)
+        setattr(self, attr, value)
+        return value
+
+
+def lazy_import(name, package=None):
+    '''
+    lazy_import('numpy') or lazy_import('matplotlib.pyplot', 'matplotlib')
+    '''
+    return LazyModule(name, package if package else name.split('.')[0])
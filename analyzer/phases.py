@@ -0,0 +1,257 @@
+import csv
+import functools
+import multiprocessing
+import os
+import time
+
+from . import arguments
+from . import cache
+from . import doe
+from . import lazy
+from . import timeline
+from . import utility
+from .runstore import RunStore
+
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Written by the server next to the thread .csv files, one row per quest event:
+#     tick,timestamp,event,x,y
+# event is 1 when a quest starts at (x, y) and 0 when it is over, tick is the row of the thread .csv files
+QUESTS_FILENAME = 'quests.txt'
+
+PHASES = ['quest', 'idle']
+# Signals quest phases are inferred from when a run has no quests.txt
+INFER_METHODS = ['concentration', 'requests']
+# Quest timing of the shipped quest configs, for runs recorded before the server kept config.ini. Seconds and ms
+QUEST_DEFAULTS = {'quest.between': 20., 'quest.min': 40., 'quest.max': 90., 'server.regular_update_interval': 50.}
+
+
+def init(parser):
+    parser.description='Split every run into quest and idle phases and compare their update interval'
+    arguments.load_run_set_argument(parser)
+    load_phase_argument(parser)
+    parser.add_argument('--quantile', type=float, default=99., help='Percentile used as the tail update interval')
+    parser.add_argument('--warmup', type=int, default=100, help='Number of leading ticks of every run to ignore')
+    parser.add_argument('--report', type=str, help='CSV file to write the per-phase stats of every run to')
+    arguments.load_cache_argument(parser)
+    arguments.load_argument(parser)
+
+
+def load_phase_argument(parser):
+    parser.add_argument('--infer', type=str, default='concentration', choices=INFER_METHODS, help='Signal quest phases are inferred from in runs without ' + QUESTS_FILENAME + ': share of the requests on the busiest thread or total requests')
+    parser.add_argument('--window', type=int, default=100, help='Number of ticks the inference signal is smoothed over')
+
+
+def parse_quests(text):
+    '''
+    {'tick', 'timestamp', 'event', 'x', 'y'} as np.arrays with one value per quest event
+    '''
+    lines = text.splitlines()
+    header = lines[0].split()
+    rows = [line for line in lines[1:] if line.count(',') == len(header) - 1]
+    data = np.loadtxt(rows, delimiter=',', dtype=np.int64, ndmin=2) if rows else np.zeros((0, len(header)), dtype=np.int64)
+    return {name: data[:, idx] for idx, name in enumerate(header)}
+
+
+def labels_from_events(quests, ntick):
+    '''
+    np.array of bool, True on the ticks from a quest start up to its end
+    '''
+    delta = np.zeros(ntick + 1, dtype=np.int64)
+    ticks = np.clip(quests['tick'], 0, ntick)
+    np.add.at(delta, ticks, np.where(quests['event'] == 1, 1, -1))
+    # A run stopped during a quest stays in it up to its last tick
+    return np.cumsum(delta)[:-1] > 0
+
+
+def infer_signal(columns_per_thread, method):
+    '''
+    Per tick np.array that rises while players crowd into the quest area
+    concentration is the share of all requests handled by the busiest thread, requests is their total
+    '''
+    ntick = min(len(columns['request_number']) for columns in columns_per_thread)
+    requests = np.stack([columns['request_number'][:ntick] for columns in columns_per_thread])
+    total = requests.sum(axis=0)
+    if method == 'requests':
+        return total
+    return requests.max(axis=0) / np.maximum(total, 1)
+
+
+def centered_average(values, window):
+    '''
+    Moving average of window centered on every value, over fewer values near the ends
+    '''
+    cumsum = np.concatenate(([0.], np.cumsum(values, dtype=float)))
+    idx = np.arange(len(values))
+    begin = np.clip(idx - window // 2, 0, len(values))
+    end = np.clip(idx + window - window // 2, 0, len(values))
+    return (cumsum[end] - cumsum[begin]) / (end - begin)
+
+
+def quest_timing(run_metric_dir):
+    '''
+    {'quest.between', 'quest.min', 'quest.max', 'server.regular_update_interval'} of the config of a run, QUEST_DEFAULTS without one
+    '''
+    timing = dict(QUEST_DEFAULTS)
+    text = utility.read_run_file(run_metric_dir, doe.CONFIG_FILENAME)
+    if text is not None:
+        settings = doe.parse_config(text)
+        timing.update({name: float(settings[name]) for name in timing if name in settings})
+    return timing
+
+
+def infer_labels(signal, times, timing, window, warmup=0):
+    '''
+    np.array of bool, True where the smoothed signal surges above its local level, None when there are no periodic surges
+    times are the tick starts in ms. The local level is the average over a quest and the pause before it, so the slow drift
+    of a run is not taken for a quest. Surges that do not last quest.min to quest.max seconds, give or take the smoothing, are dropped
+    '''
+    period = (timing['quest.between'] + timing['quest.max']) * 1000.
+    if len(signal) <= warmup + window or times[-1] - times[warmup] < 2 * period:
+        return None
+    tick_ms = np.median(np.diff(times[warmup:]))
+    smooth = centered_average(signal[warmup:], window)
+    detrended = smooth - centered_average(smooth, max(window, int(period / tick_ms)))
+    low, high = np.percentile(detrended, [10, 90])
+    if high - low < 0.05 * max(abs(np.mean(smooth)), 1e-9):
+        return None
+
+    labels = np.zeros(len(signal), dtype=bool)
+    slack = window * tick_ms
+    for start, stop in spans(detrended > (low + high) / 2.):
+        duration = times[warmup + stop - 1] - times[warmup + start]
+        if timing['quest.min'] * 1000. - slack <= duration <= timing['quest.max'] * 1000. + slack:
+            labels[warmup + start:warmup + stop] = True
+
+    # Quests follow each other every quest.between plus their own length, far fewer surges are noise
+    expected = (times[-1] - times[warmup]) / ((timing['quest.between'] + (timing['quest.min'] + timing['quest.max']) / 2.) * 1000.)
+    if len(spans(labels)) < max(2, expected / 2.):
+        return None
+    return labels
+
+
+def run_labels(run_metric_dir, columns_per_thread, args, warmup=0):
+    '''
+    (np.array of bool per tick, True during quests, 'events'/'inferred'/'noquest')
+    or (None, 'unknown') when the run has no quests.txt and no quest phases can be inferred
+    '''
+    ntick = min([len(columns['request_number']) for columns in columns_per_thread] or [0])
+    label = utility.parse_label_file(run_metric_dir)
+    text = utility.read_run_file(run_metric_dir, QUESTS_FILENAME)
+    if text is not None:
+        return labels_from_events(parse_quests(text), ntick), 'events'
+    if label and label[1] == 'noquest':
+        return np.zeros(ntick, dtype=bool), 'noquest'
+    timing = quest_timing(run_metric_dir)
+    times, _ = timeline.tick_times(columns_per_thread, timing['server.regular_update_interval'])
+    labels = infer_labels(infer_signal(columns_per_thread, args.infer), times, timing, args.window, warmup)
+    return (labels, 'inferred') if labels is not None else (None, 'unknown')
+
+
+def spans(labels):
+    '''
+    [(start, stop)] tick ranges of the True runs of labels
+    '''
+    edges = np.diff(np.concatenate(([0], labels.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def phase_stats(columns_per_thread, labels, quantile, warmup):
+    '''
+    {phase: {'ntick', 'mean', 'p50', 'tail', 'max'}} of the update interval of all threads during quest and idle ticks
+    labels None leaves both phases empty
+    '''
+    if labels is None:
+        return {phase: {'ntick': 0, 'mean': float('nan'), 'p50': float('nan'), 'tail': float('nan'), 'max': float('nan')} for phase in PHASES}
+    ntick = len(labels)
+    intervals = np.stack([(columns['request_time'] + columns['update_time'])[:ntick] for columns in columns_per_thread])[:, warmup:]
+    labels = labels[warmup:]
+    stats = dict()
+    for phase, selected in zip(PHASES, [labels, ~labels]):
+        values = intervals[:, selected].ravel()
+        stats[phase] = {'ntick': int(selected.sum())}
+        for name, statistic in [('mean', np.mean), ('p50', np.median), ('tail', lambda v: np.percentile(v, quantile)), ('max', np.max)]:
+            stats[phase][name] = float(statistic(values)) if len(values) else float('nan')
+    return stats
+
+
+def summarize_run(run_metric_dir, args):
+    '''
+    (run_name, label, source, stats) or None if the run has no data
+    '''
+    if args.debug:
+        print('Debug:', 'Segmenting', run_metric_dir)
+    columns_per_thread = cache.load_run_columns(run_metric_dir, arguments.get_cache_dir(args), args.max_row)
+    if len(columns_per_thread) == 0:
+        print('Error:', run_metric_dir, 'does not have any valid csv files. Data dropped')
+        return None
+    labels, source = run_labels(run_metric_dir, columns_per_thread, args, args.warmup)
+    return os.path.basename(os.path.normpath(run_metric_dir)), tuple(utility.parse_label_file(run_metric_dir)), source, phase_stats(columns_per_thread, labels, args.quantile, args.warmup)
+
+
+def main(args):
+    store = RunStore(args.path, arguments.get_cache_dir(args))
+    runs = store.filter(whitelist=args.whitelist, blacklist=args.blacklist)
+
+    pool = multiprocessing.Pool()
+    start = time.time()
+    results = [result for result in pool.map(functools.partial(summarize_run, args=args), [run.path for run in runs]) if result]
+    pool.close()
+    print('Info:', 'Segmenting', len(results), 'runs took', float_fmt(time.time() - start), 'seconds')
+    results.sort(key=lambda result: (result[1][1], result[1][0], int(result[1][2]), result[0]))
+
+    print('Info:')
+    print('Info:', '{:<24} {:<22} {:<9} {:>6} | {:>8} {:>8} {:>8} | {:>8} {:>8} {:>8}'.format('run', 'label', 'source', 'quest%', 'q mean', 'q p' + '{:g}'.format(args.quantile), 'q max', 'i mean', 'i p' + '{:g}'.format(args.quantile), 'i max'))
+    rows = list()
+    for run_name, label, source, stats in results:
+        quest, idle = stats['quest'], stats['idle']
+        share = quest['ntick'] / max(1, quest['ntick'] + idle['ntick']) * 100.
+        print('Info:', '{:<24} {:<22} {:<9} {:>6} | {:>8} {:>8} {:>8} | {:>8} {:>8} {:>8}'.format(
+            run_name, ','.join(label), source, float_fmt(share), *[float_fmt(phase[name]) for phase in [quest, idle] for name in ['mean', 'tail', 'max']]))
+        rows.append([run_name, *label, source] + [stats[phase][name] for phase in PHASES for name in ['ntick', 'mean', 'p50', 'tail', 'max']])
+
+    if args.report:
+        with open(args.report, mode='w', newline='') as f:
+            csv_writer = csv.writer(f, delimiter=',')
+            csv_writer.writerow(['run', 'static_spread', 'quest_noquest', 'nclient', 'source'] + [phase + '_' + name for phase in PHASES for name in ['ntick', 'mean', 'p50', 'tail', 'max']])
+            csv_writer.writerows(rows)
+        print('Info:', 'Report is written to', args.report)
+
+    if args.gui or args.output:
+        show_fig(args, results)
+
+
+def show_fig(args, results):
+    '''
+    Tail update interval of the quest and idle phases of quest runs against the number of clients
+    '''
+    results = [result for result in results if result[1][1] == 'quest' and result[2] != 'unknown']
+    balances = sorted({label[0] for _, label, _, _ in results})
+    figname = 'phases_' + str(len(results))
+    fig = plt.figure(figname, figsize=(16, 8))
+    fig.suptitle('p' + '{:g}'.format(args.quantile) + ' Update Interval during Quests and in between', fontsize=16)
+    for idx, balance in enumerate(balances):
+        ax = fig.add_subplot(1, len(balances), idx + 1)
+        selected = [result for result in results if result[1][0] == balance]
+        for phase, style in zip(PHASES, ['r', 'b']):
+            xy = sorted((int(label[2]), stats[phase]['tail']) for _, label, _, stats in selected)
+            ax.plot(*zip(*xy), style, marker='o', label=phase)
+        ax.set_title(balance)
+        ax.legend()
+        ax.set(xlabel='Number of Clients', ylabel='Update Interval Time (ms)')
+        ax.set_ylim(bottom=0.)
+        ax.grid(axis='x', linestyle='--')
+        ax.grid(axis='y', linestyle='-')
+
+    if args.output:
+        filename = os.path.join(args.output, figname)
+        plt.savefig(filename)
+        print('Info:', 'Chart is dumped to', filename)
+    if args.gui:
+        plt.show()
@@ -0,0 +1,149 @@
+import csv
+import functools
+import json
+import multiprocessing
+import os
+import time
+
+from . import arguments
+from . import cache
+from . import lazy
+from . import utility
+from .runstore import RunStore
+
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Written by the launcher (placement.py at the top of the repository) and moved into the run directory by the server:
+#     {'threads': {'wu<i>': [cpus]}, 'server': [cpus], 'clients': [cpus], 'tids', 'nice', 'warnings', 'timestamp', ...}
+# timestamp is epoch seconds, right after the threads were pinned
+PLACEMENT_FILENAME = 'placement.json'
+# Written by the server next to the thread .csv files, one row per tick sampled at its start:
+#     cpu_<i>...,nivcsw_<i>...
+# cpu_<i> is the cpu world update thread i ran on, nivcsw_<i> its involuntary context switches so far
+CPUS_FILENAME = 'cpus.txt'
+
+
+def init(parser):
+    parser.description='Check the cpu placement of the server threads of every run against the plan of the launcher and flag runs where it was violated'
+    arguments.load_run_set_argument(parser)
+    parser.add_argument('--max_nivcsw', type=float, default=0.5, help='Flag pinned threads preempted more often than this many times per tick on average, which means something else ran on their core')
+    parser.add_argument('--warmup', type=int, default=100, help='Number of leading ticks of runs without a placement timestamp to ignore')
+    parser.add_argument('--report', type=str, help='CSV file to write the placement check of every run to')
+    arguments.load_cache_argument(parser)
+    arguments.load_argument(parser)
+
+
+def parse_cpus(text):
+    '''
+    {'cpu': [ntick][nthread], 'nivcsw': [ntick][nthread]} as np.arrays
+    '''
+    lines = text.splitlines()
+    header = lines[0].split()
+    rows = lines[1:]
+    while len(rows) > 0 and rows[-1].count(',') != len(header) - 1:
+        rows.pop()
+    data = np.loadtxt(rows, delimiter=',', dtype=np.int64, ndmin=2) if rows else np.zeros((0, len(header)), dtype=np.int64)
+    nthread = len([name for name in header if name.startswith('cpu_')])
+    return {'cpu': data[:, :nthread], 'nivcsw': data[:, nthread:2 * nthread]}
+
+
+def first_pinned_tick(columns_per_thread, timestamp):
+    '''
+    First tick every thread started after the epoch second timestamp, None without tick_start
+    '''
+    if not columns_per_thread or any('tick_start' not in columns for columns in columns_per_thread):
+        return None
+    return max(int(np.searchsorted(columns['tick_start'], timestamp * 1000.)) for columns in columns_per_thread)
+
+
+def check_run(run_metric_dir, args):
+    '''
+    (run_name, label, status, stats, violations) or None if the run recorded no cpus
+    status is 'pinned' with a placement, else 'unpinned'
+    stats is {'ntick', 'off_plan', 'cpu_changes', 'nivcsw'}, off_plan being the share of ticks any thread ran off its planned cpus
+    '''
+    text = utility.read_run_file(run_metric_dir, CPUS_FILENAME)
+    if text is None:
+        if args.debug:
+            print('Debug:', run_metric_dir, 'does not have', CPUS_FILENAME)
+        return None
+    cpus = parse_cpus(text)
+    placement_text = utility.read_run_file(run_metric_dir, PLACEMENT_FILENAME)
+    placement = json.loads(placement_text) if placement_text else None
+
+    # Threads are only pinned a few seconds into the run
+    start = args.warmup
+    if placement and 'timestamp' in placement:
+        columns_per_thread = cache.load_run_columns(run_metric_dir, arguments.get_cache_dir(args), None)
+        pinned = first_pinned_tick(columns_per_thread, placement['timestamp'])
+        start = args.warmup if pinned is None else pinned
+    observed = cpus['cpu'][start:]
+    nivcsw = np.diff(cpus['nivcsw'][start:], axis=0)
+    ntick, nthread = observed.shape
+
+    violations = list()
+    off_plan = np.zeros(ntick, dtype=bool)
+    if placement:
+        violations.extend(placement.get('warnings', list()))
+        for idx in range(nthread):
+            planned = placement['threads'].get('wu' + str(idx))
+            if planned is None:
+                violations.append('wu' + str(idx) + ' has no planned cpus')
+                continue
+            outside = ~np.isin(observed[:, idx], planned) & (observed[:, idx] >= 0)
+            if outside.any():
+                violations.append('wu' + str(idx) + ' ran off its cpus ' + ','.join(map(str, planned)) + ' on ' + str(int(outside.sum())) + ' ticks, on cpus ' + ','.join(map(str, np.unique(observed[outside, idx]))))
+            off_plan |= outside
+            rate = float(np.mean(nivcsw[:, idx])) if len(nivcsw) else 0.
+            if rate > args.max_nivcsw:
+                violations.append('wu' + str(idx) + ' was preempted ' + float_fmt(rate) + ' times per tick on its own core')
+
+    stats = {
+        'ntick': ntick,
+        'off_plan': float(np.mean(off_plan)) if ntick else 0.,
+        'cpu_changes': int(np.sum(np.diff(observed, axis=0) != 0)),
+        'nivcsw': float(np.mean(nivcsw)) if nivcsw.size else 0.,
+    }
+    return os.path.basename(os.path.normpath(run_metric_dir)), tuple(utility.parse_label_file(run_metric_dir)), 'pinned' if placement else 'unpinned', stats, violations
+
+
+def main(args):
+    store = RunStore(args.path, arguments.get_cache_dir(args))
+    runs = store.filter(whitelist=args.whitelist, blacklist=args.blacklist)
+
+    pool = multiprocessing.Pool()
+    start = time.time()
+    results = [result for result in pool.map(functools.partial(check_run, args=args), [run.path for run in runs]) if result]
+    pool.close()
+    print('Info:', 'Checking', len(results), 'of', len(runs), 'runs with', CPUS_FILENAME, 'took', float_fmt(time.time() - start), 'seconds')
+    if len(results) == 0:
+        print('Warning:', 'No run recorded its cpus. They are written by servers that sample the cpu of every thread')
+        return
+    results.sort(key=lambda result: (result[1][1], result[1][0], int(result[1][2]), result[0]))
+
+    print('Info:')
+    print('Info:', '{:<24} {:<22} {:<9} {:>7} {:>9} {:>12} {:>8}'.format('run', 'label', 'placement', 'ticks', 'off plan%', 'cpu changes', 'nivcsw'))
+    for run_name, label, status, stats, violations in results:
+        print('Info:', '{:<24} {:<22} {:<9} {:>7} {:>9} {:>12} {:>8}'.format(
+            run_name, ','.join(label), status, stats['ntick'], float_fmt(stats['off_plan'] * 100.), stats['cpu_changes'], float_fmt(stats['nivcsw'])))
+
+    violated = [result for result in results if result[4]]
+    print('Info:')
+    print('Info:', len(violated), 'of', len(results), 'runs violated their placement,', sum(result[2] == 'unpinned' for result in results), 'were not pinned')
+    for run_name, label, _, _, violations in violated:
+        print('Warning:', run_name, ','.join(label))
+        for violation in violations:
+            print('Warning:', '    ', violation)
+
+    if args.report:
+        with open(args.report, mode='w', newline='') as f:
+            csv_writer = csv.writer(f, delimiter=',')
+            csv_writer.writerow(['run', 'static_spread', 'quest_noquest', 'nclient', 'placement', 'ntick', 'off_plan', 'cpu_changes', 'nivcsw', 'violations'])
+            for run_name, label, status, stats, violations in results:
+                csv_writer.writerow([run_name, *label, status, stats['ntick'], stats['off_plan'], stats['cpu_changes'], stats['nivcsw'], '; '.join(violations)])
+        print('Info:', 'Report is written to', args.report)
@@ -0,0 +1,131 @@
+import json
+import os
+
+from . import lazy
+from . import utility
+
+np = lazy.lazy_import('numpy')
+
+
+# Columns a pyramid is built for, the update interval is derived as in utility.columns_to_avg
+PYRAMID_COLUMNS = utility.COLUMN_NAMES + ['update_interval']
+# Rows of the stored data, one per aggregate
+STATS = ['mean', 'min', 'max']
+
+
+# A pyramid of a column holds level k = 0, 1, 2, ... where every value of level k aggregates 2**k
+# consecutive ticks, level 0 being the raw values. Levels are built until a single value is left.
+#
+# All pyramids of a run are stored in one float32 .npy of shape [len(STATS)][total length] next to
+# a small .json index of {thread: {column: [[offset, length] per level]}}. The .npy is memory-mapped,
+# so a query only reads the slice of the one level that matches the resolution it asks for.
+
+
+def build_levels(values):
+    '''
+    [(mean, min, max)] indexed by level, level 0 being values itself
+    '''
+    values = np.asarray(values, dtype=float)
+    levels = [(values, values, values)]
+    scale = 1
+    while len(levels[-1][0]) > 1:
+        scale *= 2
+        edges = np.arange(0, len(values), scale)
+        counts = np.diff(np.append(edges, len(values)))
+        levels.append((np.add.reduceat(values, edges) / counts, np.minimum.reduceat(values, edges), np.maximum.reduceat(values, edges)))
+    return levels
+
+
+class Pyramid:
+    '''
+    min/max/mean aggregates of one column at every power-of-two resolution
+    data is [len(STATS)][total length], possibly memory-mapped; levels is [(offset, length)] indexed by level
+    '''
+    def __init__(self, data, levels):
+        self.__data = data
+        self.__levels = levels
+
+    def __len__(self):
+        '''
+        Number of ticks
+        '''
+        return self.__levels[0][1]
+
+    @property
+    def nlevel(self):
+        return len(self.__levels)
+
+    def level_for(self, start, stop, npixel):
+        '''
+        Finest level with at most npixel values over the ticks [start, stop)
+        '''
+        span = max(1, stop - start)
+        level = 0
+        while level + 1 < len(self.__levels) and -(-span // 2 ** level) > npixel:
+            level += 1
+        return level
+
+    def query(self, start=0, stop=None, npixel=1000):
+        '''
+        (x, mean, min, max) as np.arrays covering the ticks [start, stop) in at most about npixel values
+        x is the first tick aggregated by every value, only the needed slice of one level is read
+        '''
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(0, min(start, stop))
+        level = self.level_for(start, stop, npixel)
+        scale = 2 ** level
+        offset, length = self.__levels[level]
+        low, high = start // scale, min(length, -(-stop // scale))
+        block = np.asarray(self.__data[:, offset + low:offset + high], dtype=float)
+        return np.arange(low, high) * scale, block[0], block[1], block[2]
+
+
+def build(columns_per_thread):
+    '''
+    (data, index) of every PYRAMID_COLUMNS of [{column_name: np.array}] indexed by thread id
+    '''
+    blocks = list()
+    index = dict()
+    offset = 0
+    for thread, columns in enumerate(columns_per_thread):
+        raw = utility.columns_to_avg(columns, None, raw=True)
+        index[str(thread)] = dict()
+        for name, values in zip(PYRAMID_COLUMNS, raw):
+            levels = build_levels(values)
+            index[str(thread)][name] = list()
+            for level in levels:
+                blocks.append(np.stack(level))
+                index[str(thread)][name].append([offset, len(level[0])])
+                offset += len(level[0])
+    data = np.concatenate(blocks, axis=1).astype(np.float32) if blocks else np.zeros((len(STATS), 0), dtype=np.float32)
+    return data, index
+
+
+def to_pyramids(data, index):
+    '''
+    [{column_name: Pyramid}] indexed by thread id
+    '''
+    return [{name: Pyramid(data, [tuple(level) for level in levels]) for name, levels in index[str(thread)].items()} for thread in range(len(index))]
+
+
+def write(path, data, index):
+    '''
+    Writes path + '.npy' and path + '.json', the index last so readers never find it without its data
+    '''
+    tmp_suffix = '.' + str(os.getpid()) + '.tmp'
+    np.save(path + tmp_suffix + '.npy', data)
+    os.replace(path + tmp_suffix + '.npy', path + '.npy')
+    with open(path + tmp_suffix + '.json', mode='w') as f:
+        json.dump(index, f)
+    os.replace(path + tmp_suffix + '.json', path + '.json')
+
+
+def read(path):
+    '''
+    [{column_name: Pyramid}] of what write stored under path, None if there is nothing
+    '''
+    if not os.path.isfile(path + '.json'):
+        return None
+    with open(path + '.json', mode='r') as f:
+        index = json.load(f)
+    return to_pyramids(np.load(path + '.npy', mmap_mode='r'), index)
@@ -0,0 +1,192 @@
+import os
+
+from . import archive
+from . import arguments
+from . import cache
+from . import lazy
+from . import utility
+
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Written by the server next to the thread .csv files, one row per tick:
+#     timestamp,balanced,migrations,layout_<x>_<y>...,players_<x>_<y>...
+# timestamp is epoch ms, balanced is 1 on ticks where a balance invocation was due and migrations
+# counts the regions it reassigned. Row k is recorded during tick k, like row k of every thread .csv
+REGIONS_FILENAME = 'regions.txt'
+
+
+def init(parser):
+    parser.description='Region to thread assignment, region load and migration churn of a run, against the update interval'
+    parser.add_argument('--path', type=str, required=True, help='Path to the directory of .csv files or to its archive')
+    parser.add_argument('--window', type=int, default=20, help='Number of ticks before and after every balance invocation compared for update interval spikes')
+    arguments.load_cache_argument(parser)
+    arguments.load_argument(parser)
+
+
+def parse_regions(text):
+    '''
+    {'timestamp': [ntick], 'balanced': [ntick], 'migrations': [ntick], 'layout': [ntick][nx][ny], 'players': [ntick][nx][ny]} as np.arrays
+    '''
+    lines = text.splitlines()
+    header = lines[0].split()
+    cells = [tuple(map(int, name.split('_')[1:])) for name in header if name.startswith('layout_')]
+    nx, ny = (max(x for x, _ in cells) + 1, max(y for _, y in cells) + 1) if cells else (0, 0)
+
+    # Only the last row can be partially written
+    rows = lines[1:]
+    while len(rows) > 0 and rows[-1].count(',') != len(header) - 1:
+        rows.pop()
+    data = np.loadtxt(rows, delimiter=',', dtype=np.int64, ndmin=2) if rows else np.zeros((0, len(header)), dtype=np.int64)
+
+    nregion = nx * ny
+    return {
+        'timestamp': data[:, 0],
+        'balanced': data[:, 1].astype(bool),
+        'migrations': data[:, 2].astype(np.int32),
+        'layout': data[:, 3:3 + nregion].astype(np.int16).reshape(-1, nx, ny),
+        'players': data[:, 3 + nregion:3 + 2 * nregion].astype(np.int32).reshape(-1, nx, ny),
+    }
+
+
+def load_run_regions(run_metric_dir, cache_dir=None):
+    '''
+    parse_regions of a run, cached as NumPy arrays under cache_dir like the thread columns
+    None if the run has no region log
+    '''
+    path = None
+    if cache_dir and not archive.is_archive(run_metric_dir) and os.path.isfile(os.path.join(run_metric_dir, REGIONS_FILENAME)):
+        path = cache.cache_path(run_metric_dir, cache_dir, [REGIONS_FILENAME])[:-len('.npz')] + '.regions.npz'
+        if os.path.isfile(path):
+            with np.load(path) as npz:
+                return {name: npz[name] for name in npz.files}
+
+    text = utility.read_run_file(run_metric_dir, REGIONS_FILENAME)
+    if text is None:
+        return None
+    regions = parse_regions(text)
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(tmp_path, **regions)
+        os.replace(tmp_path, path)
+    return regions
+
+
+def thread_load(regions, nthread):
+    '''
+    [ntick][nthread] players handled by every thread, from the region assignment and load of every tick
+    '''
+    layout = regions['layout'].reshape(len(regions['layout']), -1)
+    ntick = len(layout)
+    index = (np.arange(ntick)[:, None] * nthread + layout).ravel()
+    return np.bincount(index, weights=regions['players'].reshape(ntick, -1).ravel(), minlength=ntick * nthread).reshape(ntick, nthread)
+
+
+def churn(regions):
+    '''
+    [nx][ny] number of times every region changed thread
+    '''
+    return np.sum(np.diff(regions['layout'], axis=0) != 0, axis=0)
+
+
+def invocation_spikes(regions, update_interval, window):
+    '''
+    (ticks, migrations, before, after) of every balance invocation
+    before is the median and after the largest update interval of the window ticks before and from the invocation on
+    update_interval is per tick, aligned with the region log by index
+    '''
+    ticks = np.flatnonzero(regions['balanced'])
+    ticks = ticks[(ticks >= window) & (ticks + window <= len(update_interval))]
+    if len(ticks) == 0:
+        return ticks, np.zeros(0, dtype=int), np.zeros(0), np.zeros(0)
+    offsets = np.arange(window)
+    before = np.median(update_interval[ticks[:, None] - window + offsets], axis=1)
+    after = np.max(update_interval[ticks[:, None] + offsets], axis=1)
+    return ticks, regions['migrations'][ticks], before, after
+
+
+def main(args):
+    regions = load_run_regions(args.path, arguments.get_cache_dir(args))
+    if regions is None:
+        print('Error:', args.path, 'does not have', REGIONS_FILENAME + '. It is written by servers that record the region assignment')
+        return
+
+    columns_per_thread = cache.load_run_columns(args.path, arguments.get_cache_dir(args), args.max_row)
+    nthread = len(columns_per_thread)
+    ntick = min([len(regions['timestamp'])] + [len(columns['request_time']) for columns in columns_per_thread])
+    regions = {name: values[:ntick] for name, values in regions.items()}
+    # Slowest thread of every tick
+    update_interval = np.max([(columns['request_time'] + columns['update_time'])[:ntick] for columns in columns_per_thread], axis=0) if nthread else np.zeros(ntick)
+
+    _, nx, ny = regions['layout'].shape
+    load = thread_load(regions, nthread)
+    region_churn = churn(regions)
+    ticks, migrations, before, after = invocation_spikes(regions, update_interval, args.window)
+    spikes = after - before
+
+    print('Info:', str(nx) + 'x' + str(ny), 'regions on', nthread, 'threads over', ntick, 'ticks')
+    print('Info:', 'Balance invocations:', int(regions['balanced'].sum()), 'moving', int(regions['migrations'].sum()), 'regions in total')
+    if len(ticks):
+        print('Info:', '    migrations per invocation: mean=' + float_fmt(np.mean(migrations)), 'max=' + str(int(np.max(migrations))), '(' + float_fmt(np.mean(migrations) / (nx * ny) * 100.) + '% of the map)')
+        for name, selected in [('with migrations', migrations > 0), ('without migrations', migrations == 0)]:
+            if selected.any():
+                print('Info:', '    update interval jump', name + ':', 'mean=' + float_fmt(np.mean(spikes[selected])), 'ms max=' + float_fmt(np.max(spikes[selected])), 'ms over', int(selected.sum()), 'invocations')
+        if len(ticks) > 2 and np.std(migrations) > 0 and np.std(spikes) > 0:
+            print('Info:', '    correlation of migrations and update interval jump:', float_fmt(np.corrcoef(migrations, spikes)[0, 1]))
+    print('Info:', 'Region changes of thread, by region:')
+    for row in region_churn.T:
+        print('Info:', '   ', ' '.join('{:5d}'.format(count) for count in row))
+    print('Info:', 'Players per thread: mean', ' '.join(float_fmt(value) for value in load.mean(axis=0)), 'imbalance (max/mean)', float_fmt(np.mean(load.max(axis=1) / np.maximum(load.mean(axis=1), 1e-9))))
+
+    if args.gui or args.output:
+        show_fig(args, regions, load, region_churn, ticks, migrations, update_interval)
+
+
+def show_fig(args, regions, load, region_churn, ticks, migrations, update_interval):
+    ntick, nx, ny = regions['layout'].shape
+    label = utility.parse_label_file(args.path)
+    figtitle = 'regions_' + utility.genereate_run_name(*label) if label else 'regions'
+    fig = plt.figure(figtitle, figsize=(16, 9))
+    fig.suptitle(' '.join(figtitle.split('_')), fontsize=16)
+    extent = (0, ntick, nx * ny - 0.5, -0.5)
+
+    ax = fig.add_subplot(2, 2, 1)
+    image = ax.imshow(regions['players'].reshape(ntick, -1).T, aspect='auto', interpolation='nearest', cmap='viridis', extent=extent)
+    fig.colorbar(image, ax=ax, label='Players')
+    ax.set(title='Region load', xlabel='Iteration', ylabel='Region (x * ' + str(ny) + ' + y)')
+
+    ax = fig.add_subplot(2, 2, 2)
+    image = ax.imshow(regions['layout'].reshape(ntick, -1).T, aspect='auto', interpolation='nearest', cmap='tab10', vmin=-0.5, vmax=max(1, load.shape[1]) - 0.5, extent=extent)
+    fig.colorbar(image, ax=ax, label='Thread', ticks=range(load.shape[1]))
+    ax.set(title='Region assignment', xlabel='Iteration', ylabel='Region (x * ' + str(ny) + ' + y)')
+
+    ax = fig.add_subplot(2, 2, 3)
+    ax.plot(np.arange(len(update_interval)), update_interval, 'k', linewidth=0.5)
+    ax.set(title='Migrations per balance invocation', xlabel='Iteration', ylabel='Slowest update interval (ms)')
+    ax_migrations = ax.twinx()
+    ax_migrations.bar(ticks, migrations, width=max(1, ntick // 400), color='r', alpha=0.6)
+    ax_migrations.set_ylabel('Migrated regions', color='r')
+
+    ax = fig.add_subplot(2, 2, 4)
+    image = ax.imshow(region_churn.T, interpolation='nearest', cmap='magma')
+    for x in range(nx):
+        for y in range(ny):
+            ax.text(x, y, str(region_churn[x, y]), ha='center', va='center', color='w', fontsize=8)
+    ax.set_xticks(range(nx))
+    ax.set_yticks(range(ny))
+    fig.colorbar(image, ax=ax, label='Changes of thread')
+    ax.set(title='Assignment churn', xlabel='Region x', ylabel='Region y')
+
+    plt.tight_layout()
+    if args.output:
+        filename = os.path.join(args.output, figtitle)
+        plt.savefig(filename)
+        print('Info:', 'Chart is dumped to', filename)
+    if args.gui:
+        plt.show()
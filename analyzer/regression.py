@@ -0,0 +1,167 @@
+import collections
+import functools
+import multiprocessing
+import os
+import sys
+import time
+
+from . import arguments
+from . import cache
+from . import confidence
+from . import lazy
+from . import utility
+
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# (metric name, per-tick values from a thread's columns, reduction of the threads of a tick, summary statistic, True if larger is worse)
+# The threads of a tick meet at its barriers, so they are one sample: the slowest sets the update interval
+METRICS = [
+    ('update_interval', lambda columns: columns['request_time'] + columns['update_time'], 'max', 'tail', True),
+    ('request_time', lambda columns: columns['request_time'], 'mean', 'mean', True),
+    ('update_number', lambda columns: columns['update_number'], 'mean', 'mean', False),
+]
+
+
+def init(parser):
+    parser.description='Compare a candidate run set against a baseline run set and fail on significant regressions'
+    parser.add_argument('--candidate', type=str, required=True, help='Metrics directory of the candidate runs')
+    parser.add_argument('--baseline', type=str, required=True, help='Metrics directory of the baseline runs')
+    parser.add_argument('--quantile', type=float, default=99., help='Percentile used as the tail update interval')
+    parser.add_argument('--alpha', type=float, default=0.01, help='Significance level of the Mann-Whitney U test')
+    parser.add_argument('--block', type=int, default=200, help='Consecutive ticks summarized into one sample of the test when a side has fewer than --replicates runs, so the samples are close to independent')
+    parser.add_argument('--replicates', type=int, default=5, help='Runs of a configuration on both sides from which the test compares one summary per run, so run to run differences are not taken for a regression')
+    parser.add_argument('--tolerance', type=float, default=5., help='Relative change in percent below which a significant difference is still accepted')
+    parser.add_argument('--warmup', type=int, default=100, help='Number of leading ticks of every run to ignore')
+    parser.add_argument('--max_row', type=int, default=None, help='Number of iterations of raw data to process')
+    parser.add_argument('--debug', action='store_true', help='Print debug messages when on')
+    arguments.load_cache_argument(parser)
+
+
+def load_run_samples(run_metric_dir, args):
+    '''
+    (label, {metric name: np.array of per-tick values, the threads of a tick reduced to one}) or None if the run has no label
+    '''
+    label = utility.parse_label_file(run_metric_dir)
+    if label is None:
+        print('Error:', run_metric_dir, 'does not have a valid label file. Data dropped')
+        return None
+    if args.debug:
+        print('Debug:', 'Loading', run_metric_dir)
+
+    columns_per_thread = cache.load_run_columns(run_metric_dir, arguments.get_cache_dir(args), args.max_row)
+    ntick = min([len(columns['request_time']) for columns in columns_per_thread] or [0])
+    samples = dict()
+    for name, extract, reduction, _, _ in METRICS:
+        per_thread = np.stack([extract(columns)[:ntick] for columns in columns_per_thread] or [np.zeros(0)])[:, args.warmup:]
+        samples[name] = per_thread.max(axis=0) if reduction == 'max' else per_thread.mean(axis=0)
+    return tuple(label), samples
+
+
+def load_run_set(pool, path, args):
+    '''
+    {(static/spread, quest/noquest, nclient): [{metric name: np.array} of every replicate run]}
+    '''
+    run_dirs = [os.path.join(path, run_name) for run_name in utility.list_runs(path)]
+    loaded = pool.map(functools.partial(load_run_samples, args=args), run_dirs)
+
+    replicates = collections.defaultdict(list)
+    for data in filter(None, loaded):
+        replicates[data[0]].append(data[1])
+    print('Info:', 'Loaded', len(run_dirs), 'runs of', len(replicates), 'configurations from', path)
+    return dict(replicates)
+
+
+def summarize(values, statistic, quantile):
+    if len(values) == 0:
+        return np.nan
+    if statistic == 'tail':
+        return np.percentile(values, quantile)
+    return np.mean(values)
+
+
+def summarize_blocks(values, block, statistic, quantile):
+    '''
+    np.array of the statistic of every full block of consecutive ticks
+    Consecutive ticks are autocorrelated, the summaries of blocks much less
+    '''
+    nblock = len(values) // block
+    if nblock == 0:
+        return np.zeros(0)
+    blocks = np.reshape(values[:nblock * block], (nblock, block))
+    if statistic == 'tail':
+        return np.percentile(blocks, quantile, axis=1)
+    return np.mean(blocks, axis=1)
+
+
+def test_samples(runs, name, statistic, args, per_run):
+    '''
+    np.array the test compares for one side: a summary per run, or the block summaries of all runs
+    '''
+    if per_run:
+        return np.array([summarize(run[name], statistic, args.quantile) for run in runs])
+    return np.concatenate([summarize_blocks(run[name], args.block, statistic, args.quantile) for run in runs])
+
+
+def compare(candidate, baseline, args):
+    '''
+    [(metric name, baseline summary, candidate summary, relative delta %, p, verdict)]
+    candidate and baseline are the replicate runs of a configuration. With --replicates runs on both sides the test
+    compares their run summaries, else the blocks of all runs, which takes run to run differences for significant ones
+    verdict is 'REGRESSION', 'IMPROVED' or 'PASS'
+    '''
+    per_run = min(len(candidate), len(baseline)) >= args.replicates
+    rows = list()
+    for name, _, _, statistic, larger_is_worse in METRICS:
+        base = summarize(np.concatenate([run[name] for run in baseline]), statistic, args.quantile)
+        cand = summarize(np.concatenate([run[name] for run in candidate]), statistic, args.quantile)
+        delta = (cand - base) / base * 100. if base else np.nan
+        _, _, p = confidence.mann_whitney(test_samples(candidate, name, statistic, args, per_run), test_samples(baseline, name, statistic, args, per_run))
+
+        verdict = 'PASS'
+        if p < args.alpha and abs(delta) > args.tolerance:
+            worse = (delta > 0) == larger_is_worse
+            verdict = 'REGRESSION' if worse else 'IMPROVED'
+        rows.append((name, base, cand, delta, p, verdict))
+    return rows
+
+
+def main(args):
+    pool = multiprocessing.Pool()
+    start = time.time()
+    candidates = load_run_set(pool, args.candidate, args)
+    baselines = load_run_set(pool, args.baseline, args)
+    pool.close()
+    print('Info:', 'Loading took', float_fmt(time.time() - start), 'seconds')
+
+    for label in sorted(set(candidates).symmetric_difference(baselines)):
+        print('Warning:', ', '.join(label), 'is only in the', 'candidate' if label in candidates else 'baseline', 'run set. Skipped')
+
+    labels = sorted(set(candidates).intersection(baselines), key=lambda label: (label[0], label[1], int(label[2])))
+    if len(labels) == 0:
+        print('Error:', 'No configuration is present in both run sets')
+        sys.exit(2)
+
+    for label in labels:
+        if min(len(candidates[label]), len(baselines[label])) < args.replicates:
+            print('Warning:', ','.join(label), 'has', len(baselines[label]), 'baseline and', len(candidates[label]), 'candidate runs, fewer than --replicates', str(args.replicates) + '.',
+                  'Blocks of ticks are tested, a difference between the runs themselves counts as significant')
+
+    row_fmt = '{:<28} {:<16} {:>12} {:>12} {:>9} {:>10} {:>11}'
+    print('Info:')
+    print('Info:', row_fmt.format('configuration', 'metric', 'baseline', 'candidate', 'delta', 'p', 'verdict'))
+    regressions = 0
+    for label in labels:
+        for name, base, cand, delta, p, verdict in compare(candidates[label], baselines[label], args):
+            regressions += verdict == 'REGRESSION'
+            print('Info:', row_fmt.format(','.join(label), name, float_fmt(base), float_fmt(cand), '{:+.1f}%'.format(delta), '{:.1e}'.format(p), verdict))
+    print('Info:')
+
+    if regressions > 0:
+        print('Error:', regressions, 'significant regressions')
+        sys.exit(1)
+    print('Info:', 'No significant regression')
@@ -0,0 +1,401 @@
+import base64
+import collections
+import datetime
+import functools
+import html
+import json
+import multiprocessing
+import os
+import time
+import webbrowser
+
+from . import arguments
+from . import cache
+from . import capacity
+from . import lazy
+from . import pyramid
+from . import utility
+from .runstore import RunStore
+
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Series embedded for every thread of a run, in order, as trajectory plots them
+SERIES = ['request_number', 'request_time', 'update_number', 'update_time', 'update_interval', 'update_interval_min', 'update_interval_max']
+# Colors of the threads, same order as trajectory
+THREAD_COLORS = ['#d62728', '#1f77b4', '#2ca02c', '#000000', '#ff7f0e', '#9467bd', '#8c564b', '#e377c2']
+
+
+def init(parser):
+    parser.description='Build one static HTML report of a run set: scalability chart linked to every run, capacity and tail stats'
+    arguments.load_run_set_argument(parser)
+    parser.add_argument('--slo', type=float, default=100., help='Largest acceptable update interval in ms')
+    parser.add_argument('--quantile', type=float, default=99., help='Percentile used as the tail update interval')
+    parser.add_argument('--warmup', type=int, default=100, help='Number of leading ticks of every run left out of the tail stats')
+    parser.add_argument('--points', type=int, default=400, help='Largest number of points of every thread trajectory, read from the matching pyramid level')
+    parser.add_argument('--bootstrap', type=int, default=200, help='Number of bootstrap refits of the capacity estimate')
+    parser.add_argument('--confidence', type=float, default=0.9, help='Confidence level of the capacity intervals')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the bootstrap resampling')
+    arguments.load_cache_argument(parser)
+    arguments.load_argument(parser)
+
+
+def encode_floats(arrays):
+    '''
+    base64 of the arrays concatenated as little-endian float32, read back with a Float32Array
+    '''
+    return base64.b64encode(np.concatenate(arrays or [np.zeros(0)]).astype('<f4').tobytes()).decode('ascii')
+
+
+def summarize_run(run_metric_dir, args):
+    '''
+    {name, label, largest_update_interval, stats, nticks, lengths, scales, data} of one run or None if it has no data
+    largest_update_interval is the scalability metric: the largest moving average over all threads
+    '''
+    if args.debug:
+        print('Debug:', 'Summarizing', run_metric_dir)
+    label = utility.parse_label_file(run_metric_dir)
+    columns_per_thread = cache.load_run_columns(run_metric_dir, arguments.get_cache_dir(args), args.max_row)
+    if len(columns_per_thread) == 0 or all(len(columns['request_time']) == 0 for columns in columns_per_thread):
+        print('Error:', run_metric_dir, 'does not have any valid csv files. Data dropped')
+        return None
+
+    largest = max((np.max(avg[4]) for avg in (utility.columns_to_avg(columns, args.iter_num) for columns in columns_per_thread) if len(avg[4])), default=np.nan)
+
+    intervals = np.concatenate([(columns['request_time'] + columns['update_time'])[args.warmup:] for columns in columns_per_thread])
+    stats = {'nthread': len(columns_per_thread), 'ntick': int(max(len(columns['request_time']) for columns in columns_per_thread))}
+    if len(intervals):
+        stats.update(mean=np.mean(intervals), p50=np.median(intervals), tail=np.percentile(intervals, args.quantile), max=np.max(intervals), over_slo=np.mean(intervals > args.slo) * 100.)
+    else:
+        stats.update(mean=np.nan, p50=np.nan, tail=np.nan, max=np.nan, over_slo=np.nan)
+    requests = np.concatenate([columns['request_number'][args.warmup:] for columns in columns_per_thread])
+    stats['request_number'] = np.mean(requests) if len(requests) else np.nan
+
+    # Only the pyramid level with about --points values per thread is read
+    arrays = list()
+    lengths = list()
+    scales = list()
+    for pyramids, columns in zip(cache.load_run_pyramids(run_metric_dir, arguments.get_cache_dir(args)), columns_per_thread):
+        queried = [pyramids[name].query(0, len(columns['request_time']), args.points) for name in pyramid.PYRAMID_COLUMNS]
+        arrays.extend(mean for _, mean, _, _ in queried)
+        arrays.extend(queried[-1][2:])
+        lengths.append(len(queried[0][0]))
+        scales.append(int(queried[0][0][1] - queried[0][0][0]) if len(queried[0][0]) > 1 else 1)
+
+    return {
+        'name': os.path.basename(os.path.normpath(run_metric_dir)),
+        'label': label,
+        'largest_update_interval': float(largest),
+        'stats': {key: float(value) for key, value in stats.items()},
+        'nticks': [len(columns['request_time']) for columns in columns_per_thread],
+        'lengths': lengths,
+        'scales': scales,
+        'data': encode_floats(arrays),
+    }
+
+
+def main(args):
+    store = RunStore(args.path, arguments.get_cache_dir(args))
+    runs = store.filter(whitelist=args.whitelist, blacklist=args.blacklist)
+    print('Info:', 'Found', len(store), 'runs,', len(runs), 'labelled and selected')
+
+    pool = multiprocessing.Pool()
+    start = time.time()
+    summaries = pool.map(functools.partial(summarize_run, args=args), [run.path for run in runs])
+    summaries = [summary for summary in summaries if summary]
+    print('Info:', 'Summarizing', len(summaries), 'runs took', float_fmt(time.time() - start), 'seconds')
+
+    # {quest_noquest: {static_spread: [summary] sorted by nclient}}
+    database = collections.defaultdict(lambda:collections.defaultdict(list))
+    for summary in summaries:
+        static_spread, quest_noquest, _ = summary['label']
+        database[quest_noquest][static_spread].append(summary)
+    for datachart in database.values():
+        for dataline in datachart.values():
+            dataline.sort(key=lambda summary: (int(summary['label'][2]), summary['largest_update_interval']))
+
+    configs = [(quest_noquest, static_spread) for quest_noquest in sorted(database) for static_spread in sorted(database[quest_noquest])]
+    start = time.time()
+    estimates = pool.map(capacity.estimate_capacity_wrapper, [
+        ([int(summary['label'][2]) for summary in database[quest_noquest][static_spread]], [summary['largest_update_interval'] for summary in database[quest_noquest][static_spread]], args.slo, args.bootstrap, args.confidence, args.seed + idx)
+        for idx, (quest_noquest, static_spread) in enumerate(configs)])
+    pool.close()
+    print('Info:', 'Fitting', len(configs), 'configurations took', float_fmt(time.time() - start), 'seconds')
+
+    output = args.output if args.output else '.'
+    os.makedirs(output, exist_ok=True)
+    filename = os.path.join(output, 'report_' + str(len(summaries)) + '_' + datetime.datetime.now().strftime('%y%m%d_%H%M%S') + '.html')
+    with open(filename, mode='w') as f:
+        f.write(render(args, database, configs, estimates))
+    print('Info:', 'Report of', len(summaries), 'runs is written to', filename, '(' + float_fmt(os.path.getsize(filename) / 1024. / 1024.) + ' MB)')
+
+    if args.gui:
+        webbrowser.open('file://' + os.path.abspath(filename))
+
+
+def run_anchor(name):
+    return 'run-' + name
+
+
+def number_fmt(num, fmt='{:.2f}'):
+    return '-' if num is None or np.isnan(num) else fmt.format(num)
+
+
+def render_scalability(args, quest_noquest, chart_database, estimates, width=560, height=360):
+    '''
+    SVG of one scalability panel, every point links to the trajectory view of its run
+    '''
+    left, right, top, bottom = 56, 16, 28, 40
+    points = [(int(summary['label'][2]), summary['largest_update_interval']) for dataline in chart_database.values() for summary in dataline]
+    x_max = max([x for x, _ in points] + [1]) * 1.05
+    y_max = max([y for _, y in points if not np.isnan(y)] + [args.slo]) * 1.1
+
+    def sx(x):
+        return left + x / x_max * (width - left - right)
+
+    def sy(y):
+        return height - bottom - y / y_max * (height - top - bottom)
+
+    svg = ['<svg class="chart" viewBox="0 0 {} {}" width="{}" height="{}">'.format(width, height, width, height)]
+    svg.append('<text x="{}" y="18" class="title">{}</text>'.format(width / 2, html.escape(quest_noquest)))
+    for tick in np.linspace(0, y_max, 6)[:-1]:
+        svg.append('<line x1="{:.1f}" x2="{:.1f}" y1="{:.1f}" y2="{:.1f}" class="grid"/>'.format(left, width - right, sy(tick), sy(tick)))
+        svg.append('<text x="{:.1f}" y="{:.1f}" class="ytick">{:.0f}</text>'.format(left - 4, sy(tick) + 4, tick))
+    for tick in np.linspace(0, x_max, 6)[:-1]:
+        svg.append('<text x="{:.1f}" y="{:.1f}" class="xtick">{:.0f}</text>'.format(sx(tick), height - bottom + 16, tick))
+    svg.append('<line x1="{:.1f}" x2="{:.1f}" y1="{:.1f}" y2="{:.1f}" class="slo"/>'.format(left, width - right, sy(args.slo), sy(args.slo)))
+    svg.append('<text x="{:.1f}" y="{:.1f}" class="xlabel">Number of Clients</text>'.format((left + width - right) / 2, height - 6))
+    svg.append('<text x="14" y="{:.1f}" class="ylabel" transform="rotate(-90 14 {:.1f})">Update Interval Time (ms)</text>'.format((top + height - bottom) / 2, (top + height - bottom) / 2))
+
+    for idx, (static_spread, dataline) in enumerate(sorted(chart_database.items())):
+        color = THREAD_COLORS[idx % len(THREAD_COLORS)]
+        xy = [(int(summary['label'][2]), summary['largest_update_interval']) for summary in dataline]
+        svg.append('<polyline class="line" stroke="{}" points="{}"/>'.format(color, ' '.join('{:.1f},{:.1f}'.format(sx(x), sy(y)) for x, y in xy)))
+        model = estimates.get(static_spread, {}).get('model')
+        if model is not None and not np.isnan(model[3]):
+            grid = np.linspace(0., max(x for x, _ in xy), 64)
+            svg.append('<polyline class="fit" stroke="{}" points="{}"/>'.format(color, ' '.join('{:.1f},{:.1f}'.format(sx(x), sy(min(y, y_max))) for x, y in zip(grid, capacity.predict_hinge(model, grid)))))
+        for summary, (x, y) in zip(dataline, xy):
+            svg.append('<a href="#{}"><circle cx="{:.1f}" cy="{:.1f}" r="4" fill="{}"><title>{} {} clients: {} ms</title></circle></a>'.format(
+                html.escape(run_anchor(summary['name'])), sx(x), sy(y), color, html.escape(summary['name']), x, float_fmt(y)))
+        svg.append('<text x="{}" y="{}" class="legend" fill="{}">{}</text>'.format(width - right - 4, top + 14 + idx * 16, color, html.escape(static_spread)))
+    svg.append('</svg>')
+    return '\n'.join(svg)
+
+
+def render(args, database, configs, estimates):
+    '''
+    The whole report as one HTML document, nothing is loaded from elsewhere
+    '''
+    estimates_by_chart = collections.defaultdict(dict)
+    for (quest_noquest, static_spread), estimate in zip(configs, estimates):
+        estimates_by_chart[quest_noquest][static_spread] = estimate
+
+    body = list()
+    nrun = sum(len(dataline) for datachart in database.values() for dataline in datachart.values())
+    body.append('<h1>SimMud run report</h1>')
+    body.append('<p>{} runs from <code>{}</code>, generated {}. SLO {} ms, tail p{:g}, first {} ticks of every run left out of the stats.</p>'.format(
+        nrun, html.escape(os.path.abspath(args.path)), datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), float_fmt(args.slo), args.quantile, args.warmup))
+
+    body.append('<h2>Scalability</h2>')
+    body.append('<p>Largest {}-tick moving average of the update interval per run, dashed lines are the fitted saturation model. Click a point to open its run.</p>'.format(args.iter_num))
+    body.append('<div class="charts">')
+    for quest_noquest in sorted(database):
+        body.append(render_scalability(args, quest_noquest, database[quest_noquest], estimates_by_chart[quest_noquest]))
+    body.append('</div>')
+
+    body.append('<h2>Capacity</h2>')
+    body.append('<table><tr><th>quest</th><th>balance</th><th>runs</th><th>knee</th><th colspan="2">{:.0%} interval</th><th>capacity</th><th colspan="2">{:.0%} interval</th></tr>'.format(args.confidence, args.confidence))
+    for (quest_noquest, static_spread), estimate in zip(configs, estimates):
+        body.append('<tr><td>{}</td><td>{}</td><td>{}</td>{}{}</tr>'.format(
+            html.escape(quest_noquest), html.escape(static_spread), len(database[quest_noquest][static_spread]),
+            ''.join('<td>{}</td>'.format(number_fmt(value, '{:.0f}')) for value in estimate['knee']),
+            ''.join('<td>{}</td>'.format(number_fmt(value, '{:.0f}')) for value in estimate['capacity'])))
+    body.append('</table>')
+
+    body.append('<h2>Tail stats</h2>')
+    body.append('<table class="sortable"><tr><th>run</th><th>quest</th><th>balance</th><th>clients</th><th>threads</th><th>ticks</th><th>mean</th><th>p50</th><th>p{:g}</th><th>max</th><th>% over SLO</th><th>moving avg max</th><th>requests/tick</th></tr>'.format(args.quantile))
+    runs = list()
+    for quest_noquest in sorted(database):
+        for static_spread in sorted(database[quest_noquest]):
+            for summary in database[quest_noquest][static_spread]:
+                stats = summary['stats']
+                body.append('<tr{}><td><a href="#{}">{}</a></td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td>{}</tr>'.format(
+                    ' class="over"' if stats['tail'] > args.slo else '',
+                    html.escape(run_anchor(summary['name'])), html.escape(summary['name']), html.escape(quest_noquest), html.escape(static_spread), summary['label'][2],
+                    int(stats['nthread']), int(stats['ntick']),
+                    ''.join('<td>{}</td>'.format(number_fmt(stats[key])) for key in ['mean', 'p50', 'tail', 'max', 'over_slo']) + '<td>{}</td><td>{}</td>'.format(number_fmt(summary['largest_update_interval']), number_fmt(stats['request_number']))))
+                runs.append(summary)
+    body.append('</table>')
+
+    body.append('<h2>Runs</h2>')
+    for summary in runs:
+        body.append('<details id="{}" class="run"><summary>{} &mdash; {}</summary><div class="trajectory"></div></details>'.format(
+            html.escape(run_anchor(summary['name'])), html.escape(summary['name']), html.escape(utility.genereate_run_name(*summary['label']).replace('_', ' '))))
+    # Index in RUNS of every run by the id of its details element
+    index = {run_anchor(summary['name']): idx for idx, summary in enumerate(runs)}
+    payload = [{'name': summary['name'], 'nticks': summary['nticks'], 'lengths': summary['lengths'], 'scales': summary['scales'], 'data': summary['data']} for summary in runs]
+
+    script = 'const SERIES = {};\nconst COLORS = {};\nconst RUN_INDEX = {};\nconst RUNS = {};\n'.format(
+        json.dumps(SERIES), json.dumps(THREAD_COLORS), json.dumps(index), json.dumps(payload, separators=(',', ':')))
+    return TEMPLATE.replace('{{BODY}}', '\n'.join(body)).replace('{{DATA}}', script.replace('</', '<\\/'))
+
+
+TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>SimMud run report</title>
+<style>
+body { font-family: sans-serif; margin: 24px; color: #222; }
+table { border-collapse: collapse; margin-bottom: 24px; font-size: 13px; }
+th, td { border: 1px solid #ccc; padding: 3px 8px; text-align: right; }
+th { background: #f0f0f0; cursor: pointer; }
+td:first-child, th:first-child { text-align: left; }
+tr.over td { background: #fdecea; }
+.charts { display: flex; flex-wrap: wrap; gap: 16px; }
+.chart text { font-size: 11px; }
+.chart .title { font-size: 14px; text-anchor: middle; }
+.chart .ytick { text-anchor: end; }
+.chart .xtick, .chart .xlabel, .chart .ylabel { text-anchor: middle; }
+.chart .legend { text-anchor: end; font-size: 12px; }
+.chart .grid { stroke: #e4e4e4; }
+.chart .slo { stroke: #000; stroke-dasharray: 6 4; }
+.chart .line { fill: none; stroke-width: 1.5; }
+.chart .fit { fill: none; stroke-width: 1; stroke-dasharray: 3 3; }
+.chart circle { cursor: pointer; }
+details { margin: 4px 0; }
+details[open] { border: 1px solid #ddd; padding: 8px; }
+.trajectory { display: grid; grid-template-columns: repeat(3, 1fr); gap: 8px; }
+.trajectory canvas { width: 100%; height: 220px; }
+</style>
+</head>
+<body>
+{{BODY}}
+<script>
+{{DATA}}
+// Trajectory panels in the same places as the analyzer trajectory figure
+const PANELS = [
+  {title: 'Number of client requests', series: 0, ylabel: 'Number'},
+  {title: 'Time spent processing client requests', series: 1, ylabel: 'Time (ms)'},
+  {title: 'Update interval', series: 4, band: [5, 6], ylabel: 'Time (ms)'},
+  {title: 'Number of updates sent to clients', series: 2, ylabel: 'Number'},
+  {title: 'Time spent sending client updates', series: 3, ylabel: 'Time (ms)'},
+];
+
+function decode(run) {
+  if (!run.values) {
+    const bytes = Uint8Array.from(atob(run.data), c => c.charCodeAt(0));
+    const floats = new Float32Array(bytes.buffer);
+    run.values = [];
+    let offset = 0;
+    for (const length of run.lengths) {
+      const thread = [];
+      for (let s = 0; s < SERIES.length; s++) {
+        thread.push(floats.subarray(offset, offset + length));
+        offset += length;
+      }
+      run.values.push(thread);
+    }
+  }
+  return run.values;
+}
+
+function drawPanel(canvas, run, panel) {
+  const ratio = window.devicePixelRatio || 1;
+  const width = canvas.clientWidth, height = canvas.clientHeight;
+  canvas.width = width * ratio;
+  canvas.height = height * ratio;
+  const ctx = canvas.getContext('2d');
+  ctx.scale(ratio, ratio);
+  const values = decode(run);
+  const left = 48, right = 8, top = 20, bottom = 24;
+  let yMax = 0, xMax = 1;
+  values.forEach((thread, t) => {
+    const series = thread[panel.band ? panel.band[1] : panel.series];
+    for (const v of series) yMax = Math.max(yMax, v);
+    xMax = Math.max(xMax, run.nticks[t]);
+  });
+  yMax = yMax > 0 ? yMax * 1.05 : 1;
+  const sx = x => left + x / xMax * (width - left - right);
+  const sy = y => height - bottom - y / yMax * (height - top - bottom);
+
+  ctx.font = '11px sans-serif';
+  ctx.fillStyle = '#222';
+  ctx.textAlign = 'center';
+  ctx.fillText(panel.title, width / 2, 12);
+  ctx.strokeStyle = '#e4e4e4';
+  ctx.textAlign = 'right';
+  for (let i = 0; i < 5; i++) {
+    const y = yMax * i / 5;
+    ctx.beginPath(); ctx.moveTo(left, sy(y)); ctx.lineTo(width - right, sy(y)); ctx.stroke();
+    ctx.fillText(y.toPrecision(3), left - 4, sy(y) + 4);
+  }
+  ctx.textAlign = 'center';
+  ctx.fillText('0', sx(0), height - 8);
+  ctx.fillText(String(xMax) + ' iterations', sx(xMax) - 40, height - 8);
+
+  values.forEach((thread, t) => {
+    const n = thread[panel.series].length;
+    const x = i => sx((i + 0.5) * run.scales[t]);
+    const color = COLORS[t % COLORS.length];
+    if (panel.band) {
+      const low = thread[panel.band[0]], high = thread[panel.band[1]];
+      ctx.globalAlpha = 0.2;
+      ctx.fillStyle = color;
+      ctx.beginPath();
+      for (let i = 0; i < n; i++) ctx.lineTo(x(i), sy(high[i]));
+      for (let i = n - 1; i >= 0; i--) ctx.lineTo(x(i), sy(low[i]));
+      ctx.fill();
+      ctx.globalAlpha = 1;
+    }
+    const series = thread[panel.series];
+    ctx.strokeStyle = color;
+    ctx.beginPath();
+    for (let i = 0; i < n; i++) ctx.lineTo(x(i), sy(series[i]));
+    ctx.stroke();
+  });
+}
+
+function openRun(details) {
+  const container = details.querySelector('.trajectory');
+  if (container.childElementCount) return;
+  const run = RUNS[RUN_INDEX[details.id]];
+  for (const panel of PANELS) {
+    const canvas = document.createElement('canvas');
+    container.appendChild(canvas);
+    drawPanel(canvas, run, panel);
+  }
+}
+
+document.querySelectorAll('details.run').forEach(details => details.addEventListener('toggle', () => { if (details.open) openRun(details); }));
+
+function followHash() {
+  const details = document.getElementById(decodeURIComponent(location.hash.slice(1)));
+  if (details && details.tagName === 'DETAILS') {
+    details.open = true;
+    details.scrollIntoView();
+  }
+}
+window.addEventListener('hashchange', followHash);
+followHash();
+
+// Click a header of the tail stats table to sort by that column
+document.querySelectorAll('table.sortable').forEach(table => {
+  table.querySelectorAll('th').forEach((th, col) => th.addEventListener('click', () => {
+    const rows = Array.from(table.rows).slice(1);
+    const key = row => { const text = row.cells[col].textContent; const num = parseFloat(text); return isNaN(num) ? text : num; };
+    const descending = table.dataset.sorted === String(col);
+    rows.sort((a, b) => { const ka = key(a), kb = key(b); return (ka < kb ? -1 : ka > kb ? 1 : 0) * (descending ? -1 : 1); });
+    table.dataset.sorted = descending ? '' : String(col);
+    rows.forEach(row => table.tBodies[0].appendChild(row));
+  }));
+});
+</script>
+</body>
+</html>
+'''
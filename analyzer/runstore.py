@@ -0,0 +1,202 @@
+import os
+
+from . import archive
+from . import cache
+from . import lazy
+from . import regions
+from . import timeline
+from . import utility
+
+np = lazy.lazy_import('numpy')
+
+
+# Label fields of a run, in label.txt order
+LABEL_FIELDS = ['balance', 'quest', 'nclient']
+
+
+class Run:
+    '''
+    One run directory or archive. Label, groups, columns and summaries are read on first use and kept
+    '''
+    def __init__(self, path, cache_dir=None):
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self.__cache_dir = cache_dir
+        self.__label = None
+        self.__groups = None
+        self.__columns = None
+        self.__summaries = dict()
+
+    def __repr__(self):
+        return 'Run(' + repr(self.name) + ', ' + (','.join(self.label) if self.label else 'unlabelled') + ')'
+
+    def is_archive(self):
+        return archive.is_archive(self.path)
+
+    @property
+    def label(self):
+        '''
+        (static/spread, quest/noquest, nclient) or None if the run has no label.txt
+        '''
+        if self.__label is None:
+            label = utility.parse_label_file(self.path)
+            self.__label = tuple(label) if label else ()
+        return self.__label if self.__label else None
+
+    @property
+    def balance(self):
+        return self.label[0] if self.label else None
+
+    @property
+    def quest(self):
+        return self.label[1] if self.label else None
+
+    @property
+    def nclient(self):
+        return int(self.label[2]) if self.label else None
+
+    @property
+    def groups(self):
+        '''
+        [group_str] of group.txt, empty if there is none
+        '''
+        if self.__groups is None:
+            self.__groups = utility.parse_group_file(self.path) or []
+        return self.__groups
+
+    @property
+    def threads(self):
+        return len(utility.list_thread_csvs(self.path))
+
+    def columns(self, max_row=None):
+        '''
+        [{column_name: np.array}] indexed by thread id, times in ms
+        '''
+        if self.__columns is None:
+            self.__columns = cache.load_run_columns(self.path, self.__cache_dir)
+        if max_row is None:
+            return self.__columns
+        return [{name: values[:max_row] for name, values in columns.items()} for columns in self.__columns]
+
+    def pyramids(self):
+        '''
+        [{column_name: pyramid.Pyramid}] indexed by thread id, for reading any tick range at a given resolution
+            x, mean, low, high = run.pyramids()[0]['update_interval'].query(start, stop, npixel=800)
+        '''
+        return cache.load_run_pyramids(self.path, self.__cache_dir)
+
+    def regions(self):
+        '''
+        {timestamp, balanced, migrations, layout, players} of the region log as regions.parse_regions, None if the run has none
+        '''
+        return regions.load_run_regions(self.path, self.__cache_dir)
+
+    def averages(self, iter_num=100, raw=False, max_row=None):
+        '''
+        [[np.array] indexed by col] indexed by thread id, as utility.columns_to_avg
+        '''
+        return [utility.columns_to_avg(columns, iter_num, raw) for columns in self.columns(max_row)]
+
+    def tick_times(self, regular_update_interval=50, max_row=None):
+        '''
+        (np.array of tick start times in ms from the first tick, 'server'/'reconstructed')
+        '''
+        return timeline.tick_times(self.columns(max_row), regular_update_interval)
+
+    def update_intervals(self, warmup=0, max_row=None):
+        '''
+        np.array of the per-tick update interval (request_time + update_time) of all threads together
+        '''
+        return np.concatenate([(columns['request_time'] + columns['update_time'])[warmup:] for columns in self.columns(max_row)] or [np.zeros(0)])
+
+    def summary(self, quantile=99., warmup=0, max_row=None):
+        '''
+        {'nthread', 'ntick', 'update_interval_mean', 'update_interval_p50', 'update_interval_tail', 'update_interval_max',
+         'request_time_mean', 'update_time_mean', 'request_number_mean', 'update_number_mean'}
+        '''
+        key = (quantile, warmup, max_row)
+        if key not in self.__summaries:
+            columns_per_thread = self.columns(max_row)
+            intervals = self.update_intervals(warmup, max_row)
+            summary = {
+                'nthread': len(columns_per_thread),
+                'ntick': min((len(columns['request_time']) for columns in columns_per_thread), default=0),
+            }
+            for name, statistic in [('mean', np.mean), ('p50', np.median), ('tail', lambda values: np.percentile(values, quantile)), ('max', np.max)]:
+                summary['update_interval_' + name] = float(statistic(intervals)) if len(intervals) else float('nan')
+            for name in utility.COLUMN_NAMES:
+                values = np.concatenate([columns[name][warmup:] for columns in columns_per_thread] or [np.zeros(0)])
+                summary[name + '_mean'] = float(np.mean(values)) if len(values) else float('nan')
+            self.__summaries[key] = summary
+        return self.__summaries[key]
+
+    def drop(self):
+        '''
+        Forget the loaded columns and summaries to free memory, they are read again when needed
+        '''
+        self.__columns = None
+        self.__summaries = dict()
+
+
+class RunStore:
+    '''
+    The runs of a metrics directory, listed once and each loaded on first use
+
+        store = RunStore('./metrics')
+        for run in store.filter(balance='spread', quest='quest'):
+            print(run.nclient, run.summary()['update_interval_mean'])
+    '''
+    def __init__(self, path='./metrics', cache_dir='./.analyzer_cache'):
+        '''
+        cache_dir is where parsed columns are cached as in the subcommands, None to always parse
+        '''
+        self.path = path
+        self.__runs = [Run(os.path.join(path, run_name), cache_dir) for run_name in utility.list_runs(path)]
+        self.__by_name = {run.name: run for run in self.__runs}
+
+    def __repr__(self):
+        return 'RunStore(' + repr(self.path) + ', ' + str(len(self.__runs)) + ' runs)'
+
+    def __len__(self):
+        return len(self.__runs)
+
+    def __iter__(self):
+        return iter(self.__runs)
+
+    def __getitem__(self, name):
+        return self.__by_name[name]
+
+    def names(self):
+        return [run.name for run in self.__runs]
+
+    def filter(self, balance=None, quest=None, nclient=None, whitelist=None, blacklist=None):
+        '''
+        [Run] with a label matching every given field, like --whitelist/--blacklist for groups
+        Unlabelled runs are left out
+        '''
+        runs = list()
+        for run in self.__runs:
+            if run.label is None:
+                continue
+            if balance is not None and run.balance != balance:
+                continue
+            if quest is not None and run.quest != quest:
+                continue
+            if nclient is not None and run.nclient != int(nclient):
+                continue
+            if whitelist and not any(group in run.groups for group in whitelist):
+                continue
+            if blacklist and any(group in run.groups for group in blacklist):
+                continue
+            runs.append(run)
+        return runs
+
+    def by_label(self, **kwargs):
+        '''
+        {(static/spread, quest/noquest, nclient): [Run]} of the replicate runs of every configuration
+        kwargs are passed to filter
+        '''
+        replicates = dict()
+        for run in self.filter(**kwargs):
+            replicates.setdefault(run.label, list()).append(run)
+        return replicates
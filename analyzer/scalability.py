@@ -6,18 +6,15 @@ import multiprocessing
 import os
 import time
 
-try:
-    import matplotlib.pyplot as plt
-except:
-    print('Please pip install matplotlib')
-try:
-    import numpy as np
-except:
-    print('Please pip install numpy')
+from . import archive
+from . import arguments
+from . import confidence
+from . import lazy
+from . import trajectory
+from . import utility
 
-import arguments
-import trajectory
-import utility
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
+np = lazy.lazy_import('numpy')
 
 
 def float_fmt(num):
@@ -26,20 +23,26 @@ def float_fmt(num):
 
 def init(parser):
     parser.description='Plot # client vs update interval with and without quest for spread and static'
-    parser.add_argument('--path', type=str, default='./metrics', help='Path to the metrics directory')
-    black_white_group = parser.add_mutually_exclusive_group(required=False)
-    black_white_group.add_argument('--whitelist', type=str, nargs='+', help='List of groups to include. Check comma separated group_strs inside group.txt')
-    black_white_group.add_argument('--blacklist', type=str, nargs='+', help='List of groups to exclude. Check comma separated group_strs inside group.txt')
+    arguments.load_run_set_argument(parser)
+    parser.add_argument('--aggregate', type=str, default='mean', choices=['none'] + list(confidence.STATISTICS), help='Reduce replicate runs of the same configuration and client count. none plots every run')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='Number of bootstrap resamples for the confidence interval of --aggregate')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the --aggregate error bands')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the bootstrap resampling')
     arguments.load_argument(parser)
 
 
-def main(args):
-    run_names = [o for o in os.listdir(args.path) if os.path.isdir(os.path.join(args.path, o))]
+def load_database(pool, args):
+    '''
+    (dataset, database) parsed from every run under args.path
+    dataset = [(largest_update_interval, static/spread, quest/noquest, nclient, run_name, avgs5db)]
+    database = {quest_noquest: {static_spread: sorted [(nclient, largest_update_interval, run_name, avgs5db)]}}
+    '''
+    run_names = utility.list_runs(args.path)
     print('Info:', 'Found metric data of', len(run_names), 'runs')
 
     print('Info:', 'Parsing in parallel...')
     start = time.time()
-    dataset = multiprocessing.Pool().map(parse_run_metric_wrapper, map(lambda run_name: (run_name, args), run_names))
+    dataset = pool.map(parse_run_metric_wrapper, map(lambda run_name: (run_name, args), run_names))
     end = time.time()
     print('Info:')
     print('Info:', 'Parsing took', float_fmt(end - start), 'seconds')
@@ -58,6 +61,18 @@ def main(args):
     for datachart in database.values():
         for dataline in datachart.values():
             dataline.sort(key=lambda x: (x[0], x[1]))
+    return dataset, database
+
+
+def main(args):
+    pool = multiprocessing.Pool()
+    dataset, database = load_database(pool, args)
+
+    if args.aggregate != 'none':
+        start = time.time()
+        database = aggregate_replicates(pool, database, args)
+        print('Info:', 'Bootstrapping', args.aggregate, 'took', float_fmt(time.time() - start), 'seconds')
+    pool.close()
     
     # Printing Stats
     print('Info:')
@@ -114,13 +129,50 @@ def main(args):
         plt.show()
 
 
+def aggregate_replicates(pool, database, args):
+    '''
+    database = {quest_noquest: {static_spread: sorted [(nclient, largest_update_interval, run_name, avgs5db)]}}
+    Returns the same layout with one entry per nclient
+        {quest_noquest: {static_spread: sorted [(nclient, statistic, run_name, avgs5db, ci_low, ci_high, nrun)]}}
+    where run_name and avgs5db are the replicate closest to the statistic
+    '''
+    groups = list()
+    for quest_noquest, chart_database in database.items():
+        for static_spread, dataline in chart_database.items():
+            replicates = collections.defaultdict(list)
+            for row in dataline:
+                replicates[row[0]].append(row)
+            for nclient, rows in replicates.items():
+                groups.append((quest_noquest, static_spread, nclient, rows))
+
+    cis = pool.map(confidence.bootstrap_ci_wrapper, [([row[1] for row in rows], args.aggregate, args.bootstrap, args.confidence, args.seed + idx) for idx, (_, _, _, rows) in enumerate(groups)])
+
+    aggregated = collections.defaultdict(lambda:collections.defaultdict(list))
+    for (quest_noquest, static_spread, nclient, rows), (estimate, ci_low, ci_high) in zip(groups, cis):
+        representative = min(rows, key=lambda row: abs(row[1] - estimate))
+        aggregated[quest_noquest][static_spread].append((nclient, estimate, representative[2], representative[3], ci_low, ci_high, len(rows)))
+        if len(rows) > 1:
+            print('Info:', '(' + quest_noquest + ', ' + static_spread + ', ' + str(nclient) + ')', len(rows), 'runs', args.aggregate + '=' + float_fmt(estimate), 'CI=[' + float_fmt(ci_low) + ', ' + float_fmt(ci_high) + ']')
+    for datachart in aggregated.values():
+        for dataline in datachart.values():
+            dataline.sort(key=lambda x: x[0])
+    return aggregated
+
+
 def plot_chart(ax, quest_noquest, single_chart_database):
     '''
     single_chart_database = {static_spread: sorted [(nclient, largest_update_interval, run_name, avgs5db)]}
+    Aggregated entries carry (..., ci_low, ci_high, nrun) and are drawn with an error band
     '''
     ax.set_title(quest_noquest)
     for static_spread, dataline in single_chart_database.items():
         x, y, run_name = list(zip(*dataline))[0:3]
+
+        if len(dataline[0]) > 4:
+            _, _, _, _, ci_low, ci_high, _ = zip(*dataline)
+            line, = ax.plot(x, y, label=static_spread, marker='o', picker=True, pickradius=2)
+            ax.fill_between(x, ci_low, ci_high, color=line.get_color(), alpha=0.2)
+            continue
         
         conflicts = sorted([(x[idx], run_name[idx], y[idx]) for idx in range(len(x)) if x.count(x[idx]) > 1])
         for xx, rr, yy in conflicts:
@@ -192,14 +244,14 @@ def parse_run_metric(run_name, args):
         return None
 
     # CSV files
-    csv_filenames = [o for o in os.listdir(run_metric_dir) if os.path.isfile(os.path.join(run_metric_dir, o)) and o[-4:] == '.csv']
-    csv_filenames.sort()
+    csv_filenames = utility.list_thread_csvs(run_metric_dir)
+    if archive.is_archive(run_metric_dir):
+        avgs5db = [utility.columns_to_avg(columns, args.iter_num) for columns in utility.load_run_columns(run_metric_dir, args.max_row)]
+    else:
+        avgs5db = [utility.calculate_avg(filename=os.path.join(run_metric_dir, csv_filename), iter_num=args.iter_num, debug=args.debug, max_row=args.max_row) for csv_filename in csv_filenames]
 
     largest_update_intervals = list()
-    avgs5db = list()
-    for csv_filename in csv_filenames:
-        avg = utility.calculate_avg(filename=os.path.join(run_metric_dir, csv_filename), iter_num=args.iter_num, debug=args.debug, max_row=args.max_row)
-        avgs5db.append(avg)
+    for csv_filename, avg in zip(csv_filenames, avgs5db):
         update_interval = avg[4]
         large_ui = max(update_interval)
         if args.debug:
@@ -0,0 +1,356 @@
+import configparser
+import functools
+import multiprocessing
+import os
+import time
+
+from . import arguments
+from . import cache
+from . import lazy
+from . import utility
+
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
+np = lazy.lazy_import('numpy')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Same as src/Constants.h
+MAX_CLIENT_VIEW = 8
+CLIENT_MATRIX_SIZE = 2 * MAX_CLIENT_VIEW + 1
+
+# Directions as in WorldMap::movePlayer: DOWN, RIGHT, UP, LEFT
+DIRECTIONS = [[0, 1], [1, 0], [0, -1], [-1, 0]]
+
+# Used when no recorded run is available to calibrate from
+DEFAULT_COST_MODEL = {'request_rate': 0.5, 'request_cost': 0.005, 'update_cost': 0.02, 'update_base': 0.}
+
+
+def init(parser):
+    parser.description='Simulate region to thread load balancing offline from a server config file'
+    parser.add_argument('--config', type=str, required=True, help='Server config file, e.g. config_spread_quest.ini')
+    parser.add_argument('--count', type=int, required=True, help='Number of simulated players')
+    parser.add_argument('--policy', type=str, nargs='+', choices=sorted(POLICIES), help='Balance policies to compare. server.balance of the config by default')
+    parser.add_argument('--duration', type=float, default=600., help='Simulated time in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the map, players and quests, shared by every policy')
+    parser.add_argument('--quest_share', type=float, default=1.0, help='Fraction of players that head for an active quest')
+    parser.add_argument('--metrics', type=str, default='./metrics', help='Recorded runs used to calibrate the tick cost model. Defaults are used if missing')
+    parser.add_argument('--calibration_runs', type=int, default=16, help='Number of recorded runs to calibrate from')
+    parser.add_argument('--gui', action='store_true', help='Open charts on GUI')
+    parser.add_argument('--output', type=str, help='Location to dump chart')
+    arguments.load_cache_argument(parser)
+
+
+def load_config(path):
+    '''
+    {key: value} of a server config file, value converted to int or float when possible
+    Mirrors the attributes read by ServerData::dataFromConfigurator
+    '''
+    parser = configparser.ConfigParser(inline_comment_prefixes=('//', '#'))
+    parser.read(path)
+    config = dict()
+    for section in parser.sections():
+        for key, value in parser.items(section):
+            for convert in (int, float, str):
+                try:
+                    config[key] = convert(value)
+                    break
+                except ValueError:
+                    continue
+    return config
+
+
+def initial_layout(n_regs, num_threads):
+    '''
+    np.array [n_regs.x * n_regs.y] of the thread owning each region, as in WorldMap::generate
+    '''
+    regions_per_thread = (n_regs[0] * n_regs[1] - 1) // num_threads + 1
+    return np.arange(n_regs[0] * n_regs[1]) // regions_per_thread
+
+
+def thread_loads(region_counts, layout, num_threads):
+    return np.bincount(layout, weights=region_counts, minlength=num_threads)
+
+
+def balance_static(region_counts, layout, config):
+    return layout
+
+
+def balance_spread(region_counts, layout, config):
+    '''
+    WorldMap::balance_spread: heaviest region first into the currently lightest thread
+    '''
+    num_threads = config['server.number_of_threads']
+    new_layout = layout.copy()
+    bins = np.zeros(num_threads)
+    # std::sort is ascending and regions are popped from the back
+    for region in np.argsort(region_counts, kind='stable')[::-1]:
+        lightest = np.argmin(bins)
+        new_layout[region] = lightest
+        bins[lightest] += region_counts[region]
+    return new_layout
+
+
+def balance_lightest(region_counts, layout, config):
+    '''
+    Lightest from the README: an overloaded thread sheds regions, scanned in order,
+    to the lightest thread as long as that thread stays under the light level
+    '''
+    num_threads = config['server.number_of_threads']
+    new_layout = layout.copy()
+    loads = thread_loads(region_counts, new_layout, num_threads)
+    average = loads.sum() / num_threads
+    if average == 0:
+        return new_layout
+    overloaded = average * config.get('server.overloaded_level', 1.2)
+    light = average * config.get('server.light_level', 1.0)
+
+    for thread in np.argsort(loads)[::-1]:
+        if loads[thread] <= overloaded:
+            break
+        lightest = np.argmin(loads)
+        for region in np.flatnonzero(new_layout == thread):
+            if loads[thread] <= average:
+                break
+            if region_counts[region] == 0 or loads[lightest] + region_counts[region] > light:
+                continue
+            new_layout[region] = lightest
+            loads[thread] -= region_counts[region]
+            loads[lightest] += region_counts[region]
+    return new_layout
+
+
+# Pluggable balance policies: new_layout = policy(players per region, layout, config)
+POLICIES = {
+    'static': balance_static,
+    'spread': balance_spread,
+    'lightest': balance_lightest,
+}
+
+
+def calibrate_run(run_metric_dir, cache_dir):
+    '''
+    Sums used for the least-squares fit of the tick cost model, None if the run is empty
+    '''
+    columns_per_thread = cache.load_run_columns(run_metric_dir, cache_dir)
+    requests = np.concatenate([columns['request_number'] for columns in columns_per_thread])
+    request_time = np.concatenate([columns['request_time'] for columns in columns_per_thread])
+    updates = np.concatenate([columns['update_number'] for columns in columns_per_thread])
+    update_time = np.concatenate([columns['update_time'] for columns in columns_per_thread])
+    active = updates > 0
+    if not active.any():
+        return None
+    requests, request_time, updates, update_time = requests[active], request_time[active], updates[active], update_time[active]
+    return {
+        'requests': requests.sum(), 'updates': updates.sum(),
+        'rr': np.dot(requests, requests), 'rt': np.dot(requests, request_time),
+        'uu': np.dot(updates, updates), 'u': updates.sum(), 'n': len(updates),
+        'ut': np.dot(updates, update_time), 't': update_time.sum(),
+    }
+
+
+def calibrate(pool, args):
+    '''
+    {request_rate, request_cost, update_cost, update_base}
+        request_rate: requests per player per tick
+        request_cost: ms of request processing per request
+        update_cost, update_base: ms of update sending per player and per tick
+    '''
+    if not os.path.isdir(args.metrics):
+        print('Warning:', 'No recorded runs in', args.metrics + '.', 'Using the default cost model')
+        return dict(DEFAULT_COST_MODEL)
+
+    run_names = utility.list_runs(args.metrics)[-args.calibration_runs:]
+    sums = list(filter(None, pool.map(functools.partial(calibrate_run, cache_dir=arguments.get_cache_dir(args)), [os.path.join(args.metrics, run_name) for run_name in run_names])))
+    if len(sums) == 0:
+        return dict(DEFAULT_COST_MODEL)
+    total = {key: sum(s[key] for s in sums) for key in sums[0]}
+
+    # update_time = update_cost * updates + update_base
+    gram = np.array([[total['uu'], total['u']], [total['u'], total['n']]])
+    update_cost, update_base = np.linalg.solve(gram, [total['ut'], total['t']])
+    model = {
+        'request_rate': total['requests'] / total['updates'],
+        'request_cost': total['rt'] / total['rr'] if total['rr'] else 0.,
+        'update_cost': update_cost,
+        'update_base': max(0., update_base),
+    }
+    print('Info:', 'Calibrated from', len(sums), 'runs:', ', '.join(key + '=' + '{:.4g}'.format(value) for key, value in model.items()))
+    return model
+
+
+class World:
+    '''
+    Map, regions and players of WorldMap as NumPy arrays
+    '''
+    def __init__(self, config, count, rng):
+        self.size = np.array([config['map.width'], config['map.height']]) * CLIENT_MATRIX_SIZE
+        self.regmin = np.array([config['map.region_min_width'], config['map.region_min_height']]) * CLIENT_MATRIX_SIZE
+        self.n_regs = self.size // self.regmin
+        self.terrain = rng.random(self.size) * 1000 < config['map.blocks']
+
+        free = np.flatnonzero(~self.terrain.ravel())
+        cells = rng.choice(free, size=count, replace=len(free) < count)
+        self.pos = np.stack(np.unravel_index(cells, self.size), axis=1)
+
+    def regions(self):
+        '''
+        np.array of the flattened region index of every player, regions[i][j] is i * n_regs.y + j
+        '''
+        reg = self.pos // self.regmin
+        return reg[:, 0] * self.n_regs[1] + reg[:, 1]
+
+    def move(self, moving, directions):
+        '''
+        Moves the players in mask moving one cell, rejected at the map edge or on blocked cells
+        '''
+        new_pos = self.pos[moving] + np.array(DIRECTIONS)[directions]
+        inside = np.all((new_pos >= 0) & (new_pos < self.size), axis=1)
+        clipped = np.clip(new_pos, 0, self.size - 1)
+        allowed = inside & ~self.terrain[clipped[:, 0], clipped[:, 1]]
+        index = np.flatnonzero(moving)[allowed]
+        self.pos[index] = new_pos[allowed]
+
+
+def quest_schedule(config, duration, rng):
+    '''
+    [(start_ms, end_ms, (x, y))] as scheduled by WorldUpdateModule::run
+    '''
+    between = config['quest.between'] * 1000
+    quests = list()
+    start = between
+    n_regs = np.array([config['map.width'], config['map.height']]) * CLIENT_MATRIX_SIZE // (np.array([config['map.region_min_width'], config['map.region_min_height']]) * CLIENT_MATRIX_SIZE)
+    while start < duration:
+        end = start + (config['quest.min'] + rng.integers(0, config['quest.max'] - config['quest.min'] + 1)) * 1000
+        pos = rng.integers(0, n_regs) * CLIENT_MATRIX_SIZE + MAX_CLIENT_VIEW
+        quests.append((start, end, pos))
+        start = end + between
+    return quests
+
+
+def simulate(config, policy, count, cost_model, args):
+    '''
+    {times [tick], thread_loads [tick][thread], cost [tick], interval [tick], balances, migrated_regions, migrated_players}
+    balances = [(time_ms, migrated regions, migrated players)] for every balance invocation
+    '''
+    rng = np.random.default_rng(args.seed)
+    world = World(config, count, rng)
+    num_threads = config['server.number_of_threads']
+    tick_ms = config['server.regular_update_interval']
+    balance_ms = config['server.load_balance_limit'] * 1000
+    quests = quest_schedule(config, args.duration * 1000, rng)
+
+    layout = initial_layout(world.n_regs, num_threads)
+    nregion = len(layout)
+    seekers = rng.random(count) < args.quest_share
+
+    nticks = int(args.duration * 1000 / tick_ms)
+    loads = np.zeros((nticks, num_threads))
+    times = np.zeros(nticks)
+    balances = list()
+    now = 0.
+    last_balance = 0.
+    quest_idx = 0
+    for tick in range(nticks):
+        times[tick] = now
+        while quest_idx < len(quests) and quests[quest_idx][1] < now:
+            quest_idx += 1
+        quest = quests[quest_idx] if quest_idx < len(quests) and quests[quest_idx][0] <= now else None
+
+        # Random walk, players far from an active quest head for it along the longer axis
+        moving = rng.random(count) < cost_model['request_rate']
+        directions = rng.integers(0, 4, size=count)
+        if quest is not None:
+            delta = quest[2] - world.pos
+            far = seekers & np.any(np.abs(delta) > MAX_CLIENT_VIEW, axis=1)
+            along_x = np.abs(delta[:, 0]) >= np.abs(delta[:, 1])
+            toward = np.where(along_x, np.where(delta[:, 0] > 0, 1, 3), np.where(delta[:, 1] > 0, 0, 2))
+            directions = np.where(far, toward, directions)
+        world.move(moving, directions[moving])
+
+        region_counts = np.bincount(world.regions(), minlength=nregion).astype(float)
+        loads[tick] = thread_loads(region_counts, layout, num_threads)
+
+        if now - last_balance >= balance_ms:
+            last_balance = now
+            new_layout = POLICIES[policy](region_counts, layout, config)
+            changed = new_layout != layout
+            balances.append((now, int(changed.sum()), int(region_counts[changed].sum())))
+            layout = new_layout
+
+        # Tick length as in timeline.tick_durations
+        request_time = loads[tick] * cost_model['request_rate'] * cost_model['request_cost']
+        update_time = loads[tick] * cost_model['update_cost'] + cost_model['update_base']
+        now += max(tick_ms, request_time.max()) + update_time.max()
+
+    request_times = loads * cost_model['request_rate'] * cost_model['request_cost']
+    update_times = loads * cost_model['update_cost'] + cost_model['update_base']
+    return {
+        'times': times,
+        'thread_loads': loads,
+        'interval': (request_times + update_times).max(axis=1),
+        'cost': np.maximum(tick_ms, request_times).max(axis=1) + update_times.max(axis=1),
+        'balances': balances,
+        'migrated_regions': sum(balance[1] for balance in balances),
+        'migrated_players': sum(balance[2] for balance in balances),
+    }
+
+
+def main(args):
+    config = load_config(args.config)
+    policies = args.policy if args.policy else [config['server.balance']]
+    pool = multiprocessing.Pool()
+    cost_model = calibrate(pool, args)
+    pool.close()
+
+    results = dict()
+    for policy in policies:
+        start = time.time()
+        results[policy] = simulate(config, policy, args.count, cost_model, args)
+        print('Info:', 'Simulated', policy, 'in', float_fmt(time.time() - start), 'seconds')
+
+    print('Info:')
+    print('Info:', args.count, 'players,', config['server.number_of_threads'], 'threads,', float_fmt(args.duration), 'seconds of', os.path.basename(args.config))
+    for policy, result in results.items():
+        loads = result['thread_loads']
+        imbalance = loads.max(axis=1) / np.maximum(loads.mean(axis=1), 1e-9)
+        print('Info:', '    [' + policy + ']')
+        print('Info:', '        players per thread     mean', *map(float_fmt, loads.mean(axis=0)))
+        print('Info:', '        players per thread     max ', *map(float_fmt, loads.max(axis=0)))
+        print('Info:', '        imbalance (max/mean)   mean', float_fmt(imbalance.mean()), 'p99', float_fmt(np.percentile(imbalance, 99)))
+        print('Info:', '        balances', len(result['balances']), 'migrated regions', result['migrated_regions'], 'migrated players', result['migrated_players'])
+        print('Info:', '        predicted update interval (ms) mean', float_fmt(result['interval'].mean()), 'p99', float_fmt(np.percentile(result['interval'], 99)), 'max', float_fmt(result['interval'].max()))
+        print('Info:', '        predicted tick length (ms)     mean', float_fmt(result['cost'].mean()), 'p99', float_fmt(np.percentile(result['cost'], 99)))
+
+    if args.gui or args.output:
+        show_fig(args, config, results)
+
+
+def show_fig(args, config, results):
+    figname = 'simulation_' + os.path.splitext(os.path.basename(args.config))[0] + '_' + str(args.count)
+    fig = plt.figure(figname, figsize=(16, 8))
+    fig.suptitle('Simulated ' + str(args.count) + ' players with ' + os.path.basename(args.config), fontsize=16)
+    for idx, (policy, result) in enumerate(results.items()):
+        loads = result['thread_loads']
+        x = result['times'] / 1000.
+        ax = fig.add_subplot(2, len(results), idx + 1)
+        ax.set_title(policy + ': players per thread')
+        ax.plot(x, loads)
+        for balance_ms, nregion, _ in result['balances']:
+            if nregion > 0:
+                ax.axvline(balance_ms / 1000., color='k', alpha=0.1)
+        ax.set(xlabel='Simulated time (s)', ylabel='Number')
+        ax = fig.add_subplot(2, len(results), len(results) + idx + 1)
+        ax.set_title(policy + ': predicted update interval')
+        ax.plot(x, result['interval'], 'r')
+        ax.set(xlabel='Simulated time (s)', ylabel='Time (ms)')
+    plt.tight_layout()
+
+    if args.output:
+        filename = os.path.join(args.output, figname)
+        plt.savefig(filename)
+        print('Info:', 'Chart is dumped to', filename)
+    if args.gui:
+        plt.show()
@@ -0,0 +1,156 @@
+import collections
+import os
+
+from . import arguments
+from . import lazy
+from . import utility
+
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+# Written by profiler.py (super.py --profile) and moved into the run directory by the server, one stack per line:
+#     thread;outermost frame;...;innermost frame samples
+FOLDED_FILENAME = 'profile.folded'
+
+
+def init(parser):
+    parser.description='Where the server spent its time in a profiled run, or which functions grew against a baseline run'
+    parser.add_argument('--path', type=str, required=True, help='Path to the run directory or archive to show')
+    parser.add_argument('--base', type=str, help='Path to the run directory or archive to compare against')
+    parser.add_argument('--threads', type=str, default=None, help='Only count the threads whose name starts with this, e.g. wu for the world update threads')
+    parser.add_argument('--top', type=int, default=20, help='Number of functions to show')
+    parser.add_argument('--inclusive', action='store_true', help='Rank functions by the samples spent in them and their callees instead of in them alone')
+    arguments.load_argument(parser)
+
+
+def parse_folded(text):
+    '''
+    collections.Counter of 'thread;outermost frame;...;innermost frame' -> number of samples
+    '''
+    stacks = collections.Counter()
+    for line in text.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if stack and count.isdigit():
+            stacks[stack] += int(count)
+    return stacks
+
+
+def load_run_profile(run_metric_dir):
+    '''
+    parse_folded of the profile of a run, None if it was not profiled
+    '''
+    text = utility.read_run_file(run_metric_dir, FOLDED_FILENAME)
+    return parse_folded(text) if text is not None else None
+
+
+def function_costs(stacks, threads=None):
+    '''
+    (self, inclusive, thread_samples, total) where self and inclusive are {function: samples}
+    self counts the samples a function was on top of the stack, inclusive the samples it was anywhere on it
+    '''
+    self_samples = collections.Counter()
+    inclusive_samples = collections.Counter()
+    thread_samples = collections.Counter()
+    total = 0
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        if threads is not None and not frames[0].startswith(threads):
+            continue
+        total += count
+        thread_samples[frames[0]] += count
+        functions = frames[1:] or ['[' + frames[0] + ']']
+        self_samples[functions[-1]] += count
+        # Recursive functions count once per sample
+        for function in set(functions):
+            inclusive_samples[function] += count
+    return self_samples, inclusive_samples, thread_samples, total
+
+
+def shares(samples, total):
+    return {name: count / max(total, 1) * 100. for name, count in samples.items()}
+
+
+def diff(base_costs, costs):
+    '''
+    [(function, base self %, self %, base inclusive %, inclusive %)] of every function of either profile
+    Shares are in % of the samples of their own profile, so runs of different lengths compare
+    '''
+    base_self, base_inclusive = shares(base_costs[0], base_costs[3]), shares(base_costs[1], base_costs[3])
+    run_self, run_inclusive = shares(costs[0], costs[3]), shares(costs[1], costs[3])
+    functions = set(base_inclusive) | set(run_inclusive)
+    return [(function, base_self.get(function, 0.), run_self.get(function, 0.), base_inclusive.get(function, 0.), run_inclusive.get(function, 0.)) for function in functions]
+
+
+def shorten(function, width=70):
+    return function if len(function) <= width else function[:width - 2] + '..'
+
+
+def main(args):
+    stacks = load_run_profile(args.path)
+    if stacks is None:
+        print('Error:', args.path, 'does not have', FOLDED_FILENAME + '. Profile the run with super.py --profile')
+        return
+    costs = function_costs(stacks, args.threads)
+    print('Info:', args.path + ':', costs[3], 'samples')
+    print('Info:', '    ', 'threads:', ' '.join(name + '=' + float_fmt(share) + '%' for name, share in sorted(shares(costs[2], costs[3]).items())))
+
+    if args.base is None:
+        ranking = costs[1] if args.inclusive else costs[0]
+        print('Info:')
+        print('Info:', '{:<70} {:>8} {:>8}'.format('function', 'self%', 'incl%'))
+        self_shares, inclusive_shares = shares(costs[0], costs[3]), shares(costs[1], costs[3])
+        for function, _ in ranking.most_common(args.top):
+            print('Info:', '{:<70} {:>8} {:>8}'.format(shorten(function), float_fmt(self_shares.get(function, 0.)), float_fmt(inclusive_shares.get(function, 0.))))
+        return
+
+    base_stacks = load_run_profile(args.base)
+    if base_stacks is None:
+        print('Error:', args.base, 'does not have', FOLDED_FILENAME + '. Profile the run with super.py --profile')
+        return
+    base_costs = function_costs(base_stacks, args.threads)
+    print('Info:', args.base + ':', base_costs[3], 'samples (base)')
+    print('Info:', '    ', 'threads:', ' '.join(name + '=' + float_fmt(share) + '%' for name, share in sorted(shares(base_costs[2], base_costs[3]).items())))
+
+    rows = diff(base_costs, costs)
+    key = (lambda row: row[4] - row[3]) if args.inclusive else (lambda row: row[2] - row[1])
+    rows.sort(key=key, reverse=True)
+    grown = [row for row in rows if key(row) > 0][:args.top]
+    shrunk = [row for row in rows[::-1] if key(row) < 0][:args.top]
+    for title, selected in [('Grown', grown), ('Shrunk', shrunk)]:
+        print('Info:')
+        print('Info:', '{:<70} {:>8} {:>8} {:>8} | {:>8} {:>8} {:>8}'.format(title, 'self%', 'base', 'delta', 'incl%', 'base', 'delta'))
+        for function, base_self, run_self, base_inclusive, run_inclusive in selected:
+            print('Info:', '{:<70} {:>8} {:>8} {:>+8.2f} | {:>8} {:>8} {:>+8.2f}'.format(
+                shorten(function), float_fmt(run_self), float_fmt(base_self), run_self - base_self, float_fmt(run_inclusive), float_fmt(base_inclusive), run_inclusive - base_inclusive))
+
+    if args.gui or args.output:
+        show_fig(args, grown + shrunk[::-1], key)
+
+
+def show_fig(args, rows, key):
+    '''
+    Change in share of the samples of the functions that grew and shrank the most
+    '''
+    figname = 'stacks_' + os.path.basename(os.path.normpath(args.path)) + '_vs_' + os.path.basename(os.path.normpath(args.base))
+    fig = plt.figure(figname, figsize=(14, max(4, 0.3 * len(rows) + 1)))
+    ax = fig.add_subplot(1, 1, 1)
+    deltas = [key(row) for row in rows]
+    ax.barh(range(len(rows)), deltas, color=['r' if delta > 0 else 'b' for delta in deltas])
+    ax.set_yticks(range(len(rows)))
+    ax.set_yticklabels([shorten(row[0], 60) for row in rows], fontsize=8)
+    ax.invert_yaxis()
+    ax.axvline(0., color='k', linewidth=0.5)
+    ax.set(title=('Inclusive' if args.inclusive else 'Self') + ' samples against ' + os.path.basename(os.path.normpath(args.base)), xlabel='Change in share of samples (percentage points)')
+    ax.grid(axis='x', linestyle='--')
+
+    plt.tight_layout()
+    if args.output:
+        filename = os.path.join(args.output, figname)
+        plt.savefig(filename)
+        print('Info:', 'Chart is dumped to', filename)
+    if args.gui:
+        plt.show()
@@ -0,0 +1,84 @@
+from . import lazy
+
+np = lazy.lazy_import('numpy')
+
+
+# Column holding the wall-clock (epoch ms) start of every tick when the server records it
+TIMESTAMP_COLUMN = 'tick_start'
+
+RESAMPLE_METHODS = ['mean', 'max', 'min', 'sum']
+
+
+def has_timestamps(columns_per_thread):
+    return len(columns_per_thread) > 0 and all(TIMESTAMP_COLUMN in columns for columns in columns_per_thread)
+
+
+def tick_durations(columns_per_thread, regular_update_interval=50):
+    '''
+    np.array of the reconstructed wall-clock duration (ms) of every tick
+
+    Threads meet at barriers every tick, so the slowest thread sets the pace.
+    A thread keeps receiving requests for at least regular_update_interval ms,
+    longer if processing overruns it, then serializes and sends the updates
+    '''
+    nrow = min(len(columns['request_time']) for columns in columns_per_thread)
+    request_times = np.stack([columns['request_time'][:nrow] for columns in columns_per_thread])
+    update_times = np.stack([columns['update_time'][:nrow] for columns in columns_per_thread])
+    return (np.maximum(request_times, regular_update_interval) + update_times).max(axis=0)
+
+
+def tick_times(columns_per_thread, regular_update_interval=50):
+    '''
+    (np.array of tick start times in ms relative to the first tick, 'server'/'reconstructed')
+    Server timestamps are used when every thread recorded them
+    '''
+    nrow = min(len(columns['request_time']) for columns in columns_per_thread)
+    if has_timestamps(columns_per_thread):
+        stamps = np.stack([columns[TIMESTAMP_COLUMN][:nrow] for columns in columns_per_thread]).min(axis=0)
+        return stamps - stamps[0], 'server'
+
+    durations = tick_durations(columns_per_thread, regular_update_interval)
+    times = np.zeros(nrow)
+    np.cumsum(durations[:-1], out=times[1:])
+    return times, 'reconstructed'
+
+
+def resample(times, values, bin_size=1000., method='mean'):
+    '''
+    (bin start times, aggregated values) of values grouped into bins of bin_size
+    times must be sorted and share their unit with bin_size. Empty bins are nan (0 for sum)
+    '''
+    assert method in RESAMPLE_METHODS
+    if len(times) == 0:
+        return np.zeros(0), np.zeros(0)
+
+    bins = ((times - times[0]) // bin_size).astype(np.intp)
+    nbin = bins[-1] + 1
+    bin_starts = times[0] + np.arange(nbin) * bin_size
+
+    if method == 'sum':
+        return bin_starts, np.bincount(bins, weights=values, minlength=nbin)
+
+    if method == 'mean':
+        counts = np.bincount(bins, minlength=nbin)
+        sums = np.bincount(bins, weights=values, minlength=nbin)
+        result = np.full(nbin, np.nan)
+        np.divide(sums, counts, out=result, where=counts > 0)
+        return bin_starts, result
+
+    # bins is sorted, so each non-empty bin is one contiguous segment
+    segment_starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    ufunc = np.maximum if method == 'max' else np.minimum
+    result = np.full(nbin, np.nan)
+    result[bins[segment_starts]] = ufunc.reduceat(values, segment_starts)
+    return bin_starts, result
+
+
+def align_avg(times, avg, iter_num, raw=False):
+    '''
+    Tick times matching the points of a columns_to_avg/calculate_avg output
+    A moving average point is stamped with the last tick of its window
+    '''
+    offset = 0 if raw else iter_num - 1
+    length = min(len(avg[0]), len(times) - offset)
+    return times[offset:offset + length]
@@ -1,41 +1,142 @@
 import argparse
 import os
 
-try:
-    import matplotlib.pyplot as plt
-except:
-    print('Please pip install matplotlib')
+from . import archive
+from . import arguments
+from . import cache
+from . import chunked
+from . import lazy
+from . import phases
+from . import pyramid
+from . import timeline
+from . import utility
 
-import arguments
-import utility
+plt = lazy.lazy_import('matplotlib.pyplot', 'matplotlib')
 
 
 def init(parser):
     parser.description='draw graph based on .csv data'
-    parser.add_argument('--path', type=str, required=True, help='Path to the directory of .csv files')
+    parser.add_argument('--path', type=str, required=True, help='Path to the directory of .csv files or to its archive')
     parser.add_argument('--raw', action='store_true', help='Raw data')
     parser.add_argument('--title', type=str, help='Graph title: Type - N clients, e.g. Static - 100 clients')
+    parser.add_argument('--time', action='store_true', help='Plot against reconstructed wall-clock time instead of iteration')
+    parser.add_argument('--resample', type=float, help='Aggregate raw data into bins of this many seconds. Implies --time')
+    parser.add_argument('--resample_method', type=str, default='mean', choices=timeline.RESAMPLE_METHODS, help='Aggregation used by --resample')
+    parser.add_argument('--interval', type=int, default=50, help='server.regular_update_interval of the run in ms, used when the server did not record timestamps')
+    parser.add_argument('--zoom', action='store_true', help='Plot every tick as min/max/mean from the cached pyramids, refined to the visible range on zoom and pan')
+    parser.add_argument('--phases', action='store_true', help='Shade the quest phases, from ' + phases.QUESTS_FILENAME + ' or inferred')
+    phases.load_phase_argument(parser)
+    arguments.load_cache_argument(parser)
     arguments.load_argument(parser)
 
 
 def main(args):
-    server_threads = []
-    for file in os.listdir(args.path):
-        if file.endswith('.csv') and 'avg' not in file:
-            server_threads.append(file)
-    server_threads.sort()
-    
+    if args.title is None:
+        args.title = utility.genereate_run_name(*utility.parse_label_file(args.path))
+
+    quest_spans = load_phase_spans(args) if args.phases else None
+
+    if args.zoom:
+        pyramids = cache.load_run_pyramids(args.path, arguments.get_cache_dir(args))
+        show_fig(args.gui, args.output, args.title, None, pyramids=pyramids, phases=quest_spans)
+        return
+
+    if args.time or args.resample:
+        avgs5db, xs = load_timeline(args)
+        show_fig(args.gui, args.output, args.title, avgs5db, xs=xs, xlabel='Time (s)', phases=quest_spans)
+        return
+
     # read one .csv, and add its data to all subplots using the same style
     # avgs5db[thread_id][dataline][avged_point]
-    avgs5db = [utility.calculate_avg(filename=os.path.join(args.path, thread_file), iter_num=args.iter_num, debug=args.debug, max_row=args.max_row, raw=args.raw) for thread_file in server_threads]
+    if archive.is_archive(args.path):
+        avgs5db = [utility.columns_to_avg(columns, args.iter_num, raw=args.raw) for columns in utility.load_run_columns(args.path, args.max_row)]
+    else:
+        avgs5db = chunked.load_run_avgs(args.path, args.iter_num, max_row=args.max_row, raw=args.raw)
+
+    show_fig(args.gui, args.output, args.title, avgs5db, phases=quest_spans)
 
-    if args.title is None:
-        args.title = utility.genereate_run_name(*utility.parse_label_file(args.path))
 
-    show_fig(args.gui, args.output, args.title, avgs5db)
+def load_phase_spans(args):
+    '''
+    [(start, stop)] of the quest phases in the x units of the chart main draws
+    '''
+    columns_per_thread = cache.load_run_columns(args.path, arguments.get_cache_dir(args), args.max_row)
+    labels, source = phases.run_labels(args.path, columns_per_thread, args)
+    if labels is None:
+        print('Warning:', 'No quest phases found in', args.path + ', none are shaded')
+        return list()
+    quest_spans = phases.spans(labels)
+    print('Info:', len(quest_spans), 'quest phases', 'from ' + phases.QUESTS_FILENAME if source == 'events' else source)
 
+    if args.zoom:
+        return quest_spans
+    if args.time or args.resample:
+        times, _ = timeline.tick_times(columns_per_thread, args.interval)
+        return [(times[start] / 1000., times[stop - 1] / 1000.) for start, stop in quest_spans]
+    # Moving average points are stamped with the last tick of their window
+    offset = 0 if args.raw else args.iter_num - 1
+    return [(start - offset, stop - offset) for start, stop in quest_spans]
 
-def show_fig(gui, output, figtitle, avgs5db, figname=None, figsize=(16, 8)):
+
+def load_timeline(args):
+    '''
+    (avgs5db, xs) where xs[thread_id] holds the time in seconds of every point of avgs5db[thread_id]
+    '''
+    columns_per_thread = utility.load_run_columns(args.path, max_row=args.max_row) if archive.is_archive(args.path) else chunked.load_run_columns(args.path, max_row=args.max_row)
+    times, source = timeline.tick_times(columns_per_thread, args.interval)
+    print('Info:', 'Timeline', 'from server timestamps' if source == 'server' else 'reconstructed from request and update time', 'spans', '{:.2f}'.format(times[-1] / 1000. if len(times) else 0.), 'seconds')
+
+    avgs5db = list()
+    xs = list()
+    for columns in columns_per_thread:
+        if args.resample:
+            avg = utility.columns_to_avg(columns, args.iter_num, raw=True)
+            avg = [timeline.resample(times, col[:len(times)], args.resample * 1000., args.resample_method) for col in avg]
+            x = avg[0][0]
+            avg = [values for _, values in avg]
+        else:
+            avg = utility.columns_to_avg(columns, args.iter_num, raw=args.raw)
+            x = timeline.align_avg(times, avg, args.iter_num, raw=args.raw)
+            avg = [col[:len(x)] for col in avg]
+        avgs5db.append(avg)
+        xs.append(x / 1000.)
+    return avgs5db, xs
+
+
+class PyramidLines:
+    '''
+    The lines of one column of every thread on a subplot, drawn from pyramids at the resolution of the axes
+    Only the visible tick range is read again whenever zoom or pan changes the x range
+    '''
+    def __init__(self, ax, pyramids, column, styles):
+        self.__ax = ax
+        self.__pyramids = [pyramids_of_thread[column] for pyramids_of_thread in pyramids]
+        self.__styles = styles
+        self.__lines = [ax.plot([], [], style, linewidth=0.8)[0] for style in styles]
+        self.__bands = [None] * len(self.__pyramids)
+        self.__refresh(0, max(map(len, self.__pyramids), default=0))
+        ax.set_xlim(0, max(1, max(map(len, self.__pyramids), default=0)))
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+        ax.callbacks.connect('xlim_changed', lambda ax: self.__refresh(*ax.get_xlim()))
+
+    def __refresh(self, start, stop):
+        npixel = max(1, int(self.__ax.bbox.width))
+        for idx, (column_pyramid, line, style) in enumerate(zip(self.__pyramids, self.__lines, self.__styles)):
+            x, mean, low, high = column_pyramid.query(int(max(0, start)), int(stop) + 1, npixel)
+            line.set_data(x, mean)
+            if self.__bands[idx] is not None:
+                self.__bands[idx].remove()
+            self.__bands[idx] = self.__ax.fill_between(x, low, high, color=style, alpha=0.2, linewidth=0)
+        self.__ax.figure.canvas.draw_idle()
+
+
+def show_fig(gui, output, figtitle, avgs5db, figname=None, figsize=(16, 8), xs=None, xlabel='Iteration', pyramids=None, phases=None):
+    '''
+    xs[thread_id] is the x-axis of avgs5db[thread_id], the point index when None
+    pyramids[thread_id] from cache.load_run_pyramids replaces avgs5db with every tick at the resolution on screen
+    phases is [(start, stop)] in x-axis units shaded on every subplot
+    '''
     fig = plt.figure(figname, figsize=figsize)
     suptitle = figtitle.split('_')
     suptitle = ' '.join(suptitle)
@@ -54,13 +155,25 @@ def show_fig(gui, output, figtitle, avgs5db, figname=None, figsize=(16, 8)):
 
     for i in range(5):
         subfig[pos[i]].title.set_text(title[i])
-        subfig[pos[i]].set(xlabel='Iteration',ylabel=ylabel[i])
+        subfig[pos[i]].set(xlabel=xlabel,ylabel=ylabel[i])
     
+    if pyramids is not None:
+        # Keep the zoomed views alive as long as the figure
+        fig.pyramid_lines = [PyramidLines(subfig[pos[i]], pyramids, column, style[:len(pyramids)]) for i, column in enumerate(pyramid.PYRAMID_COLUMNS)]
+        avgs5db = list()
+
     # read one .csv, and add its data to all subplots using the same style
     for num, avg in enumerate(avgs5db):
         # avg (2D) - [col] [avg index]
         for i in range(len(avg)):
-            subfig[pos[i]].plot(avg[i], style[num])
+            if xs is None:
+                subfig[pos[i]].plot(avg[i], style[num])
+            else:
+                subfig[pos[i]].plot(xs[num], avg[i], style[num])
+
+    for start, stop in phases or []:
+        for ax in subfig:
+            ax.axvspan(start, stop, color='orange', alpha=0.15, linewidth=0)
 
     plt.tight_layout()
 
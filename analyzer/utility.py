@@ -1,6 +1,20 @@
 import csv
+import itertools
 import os
 
+from . import archive
+from . import lazy
+
+np = lazy.lazy_import('numpy')
+
+
+# Columns written by the server for every thread, in order. Extra columns may follow
+COLUMN_NAMES = ['request_number', 'request_time', 'update_number', 'update_time']
+# Durations of the other phases of a tick that may follow, see breakdown.py
+PHASE_COLUMNS = ['request_wait', 'barrier1_wait', 'balance_time', 'barrier2_wait', 'send_time', 'barrier3_wait']
+# Columns recorded in microseconds by the server
+MICROSECOND_COLUMNS = ['request_time', 'update_time'] + PHASE_COLUMNS
+
 
 def genereate_run_name(spread_static, quest_noquest, nclient):
     return quest_noquest + '_' + spread_static + '_' + str(nclient) + '_clients'
@@ -12,6 +26,15 @@ def parse_label_file(run_metric_dir):
     None if not
     '''
     label_file_name = 'label.txt'
+    if archive.is_archive(run_metric_dir):
+        with archive.ArchiveReader(run_metric_dir) as reader:
+            text = reader.read_text(label_file_name)
+        if text is None:
+            return None
+        row = next(iter(csv.reader(text.splitlines(), delimiter=',')))
+        assert len(row) == 3
+        return row
+
     label_file_path = os.path.join(run_metric_dir, label_file_name)
     
     if not os.path.isfile(label_file_path):
@@ -30,6 +53,14 @@ def parse_group_file(run_metric_dir):
     [group_str] or None
     '''
     group_file_name = 'group.txt'
+    if archive.is_archive(run_metric_dir):
+        with archive.ArchiveReader(run_metric_dir) as reader:
+            text = reader.read_text(group_file_name)
+        if not text:
+            return None
+        row = next(iter(csv.reader(text.splitlines(), delimiter=',')), [])
+        return row if len(row) > 0 else None
+
     group_file_path = os.path.join(run_metric_dir, group_file_name)
 
     if not os.path.isfile(group_file_path):
@@ -63,6 +94,9 @@ def calculate_avg(filename, iter_num, debug, max_row, raw=False):
                 first_line = False
                 continue
 
+            # Only the base columns take part in the averages
+            row = row[:len(COLUMN_NAMES)]
+
             if line_num == 0:
                 col_num = len(row)+1
                 for j in range(col_num):
@@ -134,3 +168,122 @@ def calculate_avg(filename, iter_num, debug, max_row, raw=False):
         for j in range(len(avg[0])):
             avg[i][j] = avg[i][j]/float(1000)
     return avg
+
+
+def list_runs(path):
+    '''
+    Sorted [run_name] under a metrics directory, both run directories and archives
+    A run kept in both forms, e.g. compacted without --remove, is listed once as its directory
+    '''
+    names = os.listdir(path)
+    run_dirs = set(o for o in names if os.path.isdir(os.path.join(path, o)))
+    archives = [o for o in names if archive.is_archive(os.path.join(path, o)) and o[:-len(archive.EXTENSION)] not in run_dirs]
+    return sorted(run_dirs.union(archives))
+
+
+def list_thread_csvs(run_metric_dir):
+    '''
+    Sorted [csv_filename] of the per-thread metrics of a run
+    '''
+    if archive.is_archive(run_metric_dir):
+        with archive.ArchiveReader(run_metric_dir) as reader:
+            csv_filenames = [o for o in reader.names() if o.endswith('.csv') and 'avg' not in o]
+    else:
+        csv_filenames = [o for o in os.listdir(run_metric_dir) if os.path.isfile(os.path.join(run_metric_dir, o)) and o.endswith('.csv') and 'avg' not in o]
+    csv_filenames.sort()
+    return csv_filenames
+
+
+def read_run_file(run_metric_dir, filename):
+    '''
+    Text of one file of a run directory or archive, None if the run does not have it
+    '''
+    if archive.is_archive(run_metric_dir):
+        with archive.ArchiveReader(run_metric_dir) as reader:
+            return reader.read_text(filename) if filename in reader.names() else None
+    path = os.path.join(run_metric_dir, filename)
+    if not os.path.isfile(path):
+        return None
+    with open(path, mode='r') as f:
+        return f.read()
+
+
+def load_columns(filename, max_row=None):
+    '''
+    {column_name: np.array} of the raw per-tick values, times converted to ms
+    Trailing rows that were cut short by the server shutting down are dropped
+    '''
+    with open(filename, mode='r') as f:
+        header_line = f.readline()
+        lines = f.readlines() if max_row is None else list(itertools.islice(f, max_row))
+    return parse_lines(header_line, lines)
+
+
+def parse_lines(header_line, lines):
+    '''
+    load_columns on the already read header and data lines of a .csv
+    '''
+    header = header_line.replace(',', ' ').split()
+
+    # Only the last rows can be partially written
+    while len(lines) > 0 and lines[-1].count(',') != len(header) - 1:
+        lines.pop()
+
+    if len(lines) == 0:
+        return {name: np.zeros(0) for name in header}
+
+    data = np.loadtxt(lines, delimiter=',', ndmin=2)
+    return to_ms({name: data[:, idx] for idx, name in enumerate(header)})
+
+
+def to_ms(columns):
+    for name in MICROSECOND_COLUMNS:
+        if name in columns:
+            columns[name] = columns[name] / 1000.
+    return columns
+
+
+def load_archived_columns(reader, csv_filename, max_row=None):
+    '''
+    Same as load_columns for a .csv inside an open archive.ArchiveReader
+    '''
+    columns = reader.read_columns(csv_filename, max_row=max_row)
+    if columns is not None:
+        return to_ms(columns)
+
+    # Stored as text because it did not fit the columnar layout
+    lines = reader.read_text(csv_filename).splitlines(keepends=True)
+    return parse_lines(lines[0], lines[1:] if max_row is None else lines[1:1 + max_row])
+
+
+def load_run_columns(run_metric_dir, max_row=None):
+    '''
+    [{column_name: np.array}] indexed by thread id, from a run directory or an archive
+    '''
+    if archive.is_archive(run_metric_dir):
+        with archive.ArchiveReader(run_metric_dir) as reader:
+            return [load_archived_columns(reader, csv_filename, max_row) for csv_filename in list_thread_csvs(run_metric_dir)]
+    return [load_columns(os.path.join(run_metric_dir, csv_filename), max_row) for csv_filename in list_thread_csvs(run_metric_dir)]
+
+
+def moving_average(values, iter_num):
+    '''
+    Trailing moving average of window iter_num, same alignment as calculate_avg
+    len(result) == len(values) - iter_num + 1
+    '''
+    if len(values) < iter_num:
+        return np.zeros(0)
+    cumsum = np.cumsum(np.concatenate(([0.], values)))
+    return (cumsum[iter_num:] - cumsum[:-iter_num]) / iter_num
+
+
+def columns_to_avg(columns, iter_num, raw=False):
+    '''
+    Vectorized counterpart of calculate_avg working on load_columns output
+    [np.array] indexed by [col], with the update interval appended as the last col
+    '''
+    avg = [columns[name] for name in COLUMN_NAMES]
+    avg.append(columns['request_time'] + columns['update_time'])
+    if raw:
+        return avg
+    return [moving_average(col, iter_num) for col in avg]
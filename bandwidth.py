@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+
+import argparse
+import collections
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import bench_server
+import client_trace
+import protocol
+
+
+# Where the bytes of a regular update go
+SECTIONS = ['header', 'terrain', 'players', 'objects']
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def num_fmt(num):
+    return f'{num:,}'
+
+
+def sizeof_fmt(num, suffix='B'):
+    for unit in ['', 'Ki', 'Mi']:
+        if abs(num) < 1024.0:
+            return '%3.2f%s%s' % (num, unit, suffix)
+        num /= 1024.0
+    return '%.2f%s%s' % (num, 'Gi', suffix)
+
+
+def unchanged_cells(previous, current):
+    '''
+    Number of terrain cells of current the client already got with the same value in previous
+    Both are (view, terrain) of regular updates, the terrain is laid out column by column
+    '''
+    (px1, py1, px2, py2), pterrain = previous
+    (x1, y1, x2, y2), terrain = current
+    if (px1, py1, px2, py2) == (x1, y1, x2, y2) and pterrain == terrain:
+        return len(terrain)
+
+    ox1, ox2 = max(x1, px1), min(x2, px2)
+    oy1, oy2 = max(y1, py1), min(y2, py2)
+    if ox1 >= ox2 or oy1 >= oy2:
+        return 0
+    height, pheight = y2 - y1, py2 - py1
+    count = 0
+    for x in range(ox1, ox2):
+        column = terrain[(x - x1) * height + oy1 - y1:(x - x1) * height + oy2 - y1]
+        pcolumn = pterrain[(x - px1) * pheight + oy1 - py1:(x - px1) * pheight + oy2 - py1]
+        if column == pcolumn:
+            count += len(column)
+        else:
+            count += sum(a == b for a, b in zip(column, pcolumn))
+    return count
+
+
+class BandwidthAccount:
+    '''
+    Byte accounting of the messages the server sends, fed one packet at a time from any number of clients
+    '''
+    def __init__(self, compressed=False):
+        self.__compressed = compressed
+        self.__lock = threading.Lock()
+        self.__last_terrain = dict()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.start = time.time()
+            self.clients = set()
+            self.update_sizes = list()
+            self.sections = collections.Counter()
+            self.unchanged_terrain = 0
+            self.message_bytes = collections.Counter()
+            self.malformed = 0
+
+    def add(self, client, data):
+        message_type, _ = protocol.unpack_header(data)
+        with self.__lock:
+            self.clients.add(client)
+            self.message_bytes[message_type] += len(data)
+            if message_type != protocol.MESSAGE_SC_REGULAR_UPDATE:
+                return
+            try:
+                update = protocol.decode_regular_update(protocol.decompress_message(data) if self.__compressed else data)
+            except Exception:
+                self.malformed += 1
+                return
+
+            self.update_sizes.append(len(data))
+            terrain = update['terrain']
+            players = len(update['players']) * (1 + protocol.UPDATE_PLAYER.size)
+            objects = len(update['objects']) * (1 + protocol.UPDATE_OBJECT.size)
+            if self.__compressed:
+                # Attribute the compressed size proportionally, the split only makes sense uncompressed
+                raw = protocol.HEADER.size + protocol.UPDATE_STATE.size + len(terrain) + players + objects + 1
+                scale = len(data) / raw
+            else:
+                scale = 1.
+            self.sections['terrain'] += len(terrain) * scale
+            self.sections['players'] += players * scale
+            self.sections['objects'] += objects * scale
+            self.sections['header'] += len(data) - (len(terrain) + players + objects) * scale
+
+            current = (update['view'], terrain)
+            previous = self.__last_terrain.get(client)
+            if previous is not None:
+                self.unchanged_terrain += unchanged_cells(previous, current) * scale
+            self.__last_terrain[client] = current
+
+    def summary(self, update_interval):
+        '''
+        {'clients', 'seconds', 'updates', 'bytes_per_second', 'bytes_per_tick', 'bytes_per_update' percentiles, section shares %, 'unchanged_terrain_pct'}
+        '''
+        with self.__lock:
+            seconds = time.time() - self.start
+            sizes = sorted(self.update_sizes)
+            total = sum(self.message_bytes.values())
+            update_bytes = sum(sizes)
+            percentile = lambda p: sizes[min(len(sizes) - 1, int(p / 100. * len(sizes)))] if sizes else 0
+            summary = {
+                'clients': len(self.clients),
+                'seconds': seconds,
+                'updates': len(sizes),
+                'bytes_per_second': total / seconds if seconds else 0.,
+                'bytes_per_tick': total / seconds * update_interval / 1000. if seconds else 0.,
+                'update_p50': percentile(50),
+                'update_p99': percentile(99),
+                'update_max': sizes[-1] if sizes else 0,
+                'unchanged_terrain_pct': self.unchanged_terrain / update_bytes * 100. if update_bytes else 0.,
+                'malformed': self.malformed,
+            }
+            for section in SECTIONS:
+                summary[section + '_pct'] = self.sections[section] / update_bytes * 100. if update_bytes else 0.
+            return summary
+
+
+def print_summary(summary):
+    print('Info:', summary['clients'], 'clients,', num_fmt(summary['updates']), 'regular updates in', float_fmt(summary['seconds']), 'seconds')
+    print('Info:', '    ' + sizeof_fmt(summary['bytes_per_second']) + '/s,', sizeof_fmt(summary['bytes_per_tick']) + '/tick')
+    print('Info:', '    Update size p50', num_fmt(summary['update_p50']), 'B, p99', num_fmt(summary['update_p99']), 'B, max', num_fmt(summary['update_max']), 'B')
+    print('Info:', '    Bytes of updates:', ', '.join(section + ' ' + float_fmt(summary[section + '_pct']) + '%' for section in SECTIONS))
+    print('Info:', '    Unchanged terrain cells resent:', float_fmt(summary['unchanged_terrain_pct']) + '% of update bytes')
+    if summary['malformed']:
+        print('Warning:', '    ' + num_fmt(summary['malformed']), 'regular updates could not be decoded. Is the server built with -D__COMPRESSED_MESSAGES__?')
+
+
+def capture(args):
+    server_address = protocol.parse_address(args.server)
+    listen_address = protocol.parse_address(args.listen, default_host='0.0.0.0')
+    protocol.raise_fd_limit(4096)
+
+    account = BandwidthAccount(args.compressed)
+    relay = client_trace.UDPRelay(listen_address, server_address, on_server_packet=lambda flow, data: account.add(flow.client_id, data))
+    print('Info:', 'Relaying', args.listen, '->', args.server + '. Point the clients at', args.listen)
+    print('Info:', 'Accounting', 'until Ctrl-C' if args.duration is None else 'for ' + str(args.duration) + ' seconds')
+
+    deadline = None if args.duration is None else time.time() + args.duration
+    last_report = time.time()
+    try:
+        while deadline is None or time.time() < deadline:
+            relay.poll(0.1)
+            if args.report_interval and time.time() - last_report >= args.report_interval:
+                last_report = time.time()
+                print_summary(account.summary(args.update_interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        relay.close()
+    print('Info:')
+    print_summary(account.summary(args.update_interval))
+
+
+def sweep(args):
+    work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix='simmud_bandwidth_')
+    os.makedirs(work_dir, exist_ok=True)
+    server = bench_server.start_server(args, work_dir)
+    time.sleep(1.)
+    if server.poll() is not None:
+        print('Error:', 'The server exited, see', os.path.join(work_dir, 'server.log'))
+        sys.exit(1)
+
+    results = list()
+    for count in sorted(args.players):
+        players = bench_server.SyntheticPlayers(count, ('127.0.0.1', args.port))
+        joined = players.join(args.join_timeout)
+        print('Info:')
+        print('Info:', joined, 'of', count, 'players joined')
+
+        # Players wander so their views and regions change like in a game
+        account = BandwidthAccount(args.compressed)
+        players.set_on_packet(account.add)
+        bench_server.blast(players, [('move', 1.)], joined * args.moves_per_second, args.warmup, 1, 10., args.seed)
+        account.reset()
+        bench_server.blast(players, [('move', 1.)], joined * args.moves_per_second, args.duration, 1, 10., args.seed)
+        summary = account.summary(args.update_interval)
+        summary['players'] = joined
+        players.close()
+
+        print_summary(summary)
+        results.append(summary)
+
+    bench_server.stop_server(server, work_dir)
+
+    columns = ['players', 'bytes_per_tick', 'bytes_per_second', 'update_p50', 'update_p99', 'update_max'] + [section + '_pct' for section in SECTIONS] + ['unchanged_terrain_pct']
+    row_fmt = '{:>8} {:>14} {:>16} {:>10} {:>10} {:>10} {:>10} {:>11} {:>11} {:>11} {:>21}'
+    print('Info:')
+    print('Info:', row_fmt.format(*columns))
+    for summary in results:
+        print('Info:', row_fmt.format(*[num_fmt(summary[column]) if isinstance(summary[column], int) else float_fmt(summary[column]) for column in columns]))
+    if args.output:
+        with open(args.output, mode='w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for summary in results:
+                writer.writerow([summary[column] for column in columns])
+        print('Info:', 'Bytes per tick against player count written to', args.output)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='bandwidth.py')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_capture = subparsers.add_parser('capture', description='Relay real clients to the server and account every byte the server sends them')
+    parser_capture.add_argument('--server', type=str, default=':1747', help='Server @<IP>:<PORT>')
+    parser_capture.add_argument('--listen', type=str, default=':1748', help='Relay @<IP>:<PORT> the clients are pointed at')
+    parser_capture.add_argument('--duration', type=float, default=None, help='Seconds to capture. Until Ctrl-C by default')
+    parser_capture.add_argument('--report_interval', type=float, default=10., help='Seconds between intermediate reports, 0 for none')
+    parser_capture.set_defaults(func=capture)
+
+    parser_sweep = subparsers.add_parser('sweep', description='Start a local server and measure bytes per tick against player count with synthetic players')
+    parser_sweep.add_argument('--server', type=str, default='./server', help='Server binary')
+    parser_sweep.add_argument('--config', type=str, default='config_static_no_quest.ini', help='Template config, the sweep overrides threads, interval and balance')
+    parser_sweep.add_argument('--port', type=int, default=1747, help='Local port of the server')
+    parser_sweep.add_argument('--threads', type=int, default=4, help='Number of WorldUpdateModule threads')
+    parser_sweep.add_argument('--balance', type=str, default='static', help='Load balancing algorithm of the server')
+    parser_sweep.add_argument('--players', type=int, nargs='+', default=[16, 32, 64, 128, 256], help='Player counts to measure')
+    parser_sweep.add_argument('--join_timeout', type=float, default=10., help='Seconds to wait for the players to join')
+    parser_sweep.add_argument('--moves_per_second', type=float, default=4., help='Moves every player makes per second')
+    parser_sweep.add_argument('--warmup', type=float, default=2., help='Seconds after joining not measured')
+    parser_sweep.add_argument('--duration', type=float, default=10., help='Seconds measured per player count')
+    parser_sweep.add_argument('--seed', type=int, default=0, help='Seed of the moves')
+    parser_sweep.add_argument('--work_dir', type=str, help='Directory for the generated config, server log and metrics. A temporary one by default')
+    parser_sweep.add_argument('--output', type=str, help='CSV file to write the bytes per tick curve into')
+    parser_sweep.set_defaults(func=sweep)
+
+    for subparser in (parser_capture, parser_sweep):
+        subparser.add_argument('--update_interval', type=int, default=50, help='Regular update interval of the server in ms')
+        subparser.add_argument('--compressed', action='store_true', help='The server is built with -D__COMPRESSED_MESSAGES__')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    args.func(args)
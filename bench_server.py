@@ -0,0 +1,410 @@
+#!/usr/bin/python3
+
+import argparse
+import configparser
+import csv
+import os
+import random
+import selectors
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import protocol
+
+
+# Message kinds of a mix and the MESSAGE_CS_* they are drawn from
+MESSAGE_KINDS = {
+    'move': protocol.MOVE_MESSAGES,
+    'attack': protocol.ATTACK_MESSAGES,
+    'use': [protocol.MESSAGE_CS_USE],
+}
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def num_fmt(num):
+    return f'{num:,}'
+
+
+def parse_mix(spec):
+    '''
+    'move=0.7,attack=0.2,use=0.1' or 'move' -> [(kind, weight)]
+    '''
+    mix = list()
+    for part in spec.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in MESSAGE_KINDS:
+            raise argparse.ArgumentTypeError('Unknown message kind ' + kind + '. Choose from ' + ', '.join(MESSAGE_KINDS))
+        mix.append((kind, float(weight) if weight else 1.))
+    return mix
+
+
+def write_config(args, path):
+    '''
+    The template config with the benchmark overrides, quests and per-action output turned off
+    '''
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    config['Server']['server.number_of_threads'] = str(args.threads)
+    config['Server']['server.regular_update_interval'] = str(args.update_interval)
+    config['Server']['server.balance'] = args.balance
+    for key in config['ServerOutput']:
+        config['ServerOutput'][key] = '0'
+    config['Quest']['quest.between'] = '100000'
+    with open(path, mode='w') as f:
+        config.write(f)
+
+
+def udp_errors():
+    '''
+    (RcvbufErrors, InErrors) of the host from /proc/net/snmp, (0, 0) where not available
+    '''
+    try:
+        with open('/proc/net/snmp') as f:
+            lines = [line.split() for line in f if line.startswith('Udp:')]
+        stats = dict(zip(lines[0][1:], map(int, lines[1][1:])))
+        return stats.get('RcvbufErrors', 0), stats.get('InErrors', 0)
+    except (OSError, IndexError, ValueError):
+        return 0, 0
+
+
+class SyntheticPlayers:
+    '''
+    N joined players, one socket each, with a background thread draining server messages
+    '''
+    def __init__(self, count, server_address):
+        protocol.raise_fd_limit(count + 64)
+        self.__sockets = [protocol.open_udp_socket(buffer_size=1 << 16) for _ in range(count)]
+        # Every player follows the address of the server thread that answered last, like the client
+        self.__server_addresses = [server_address] * count
+        self.__joined = [False] * count
+        self.__received = 0
+        self.__received_bytes = 0
+        self.__on_packet = None
+        self.__selector = selectors.DefaultSelector()
+        for idx, sock in enumerate(self.__sockets):
+            self.__selector.register(sock, selectors.EVENT_READ, idx)
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__drain, daemon=True)
+        self.__thread.start()
+
+    def __drain(self):
+        while self.__running:
+            for key, _ in self.__selector.select(0.1):
+                while True:
+                    try:
+                        data, address = key.fileobj.recvfrom(protocol.MAX_UDP_PACKET_SIZE)
+                    except (BlockingIOError, ConnectionRefusedError):
+                        break
+                    except OSError:
+                        return
+                    self.__server_addresses[key.data] = address
+                    self.__received += 1
+                    self.__received_bytes += len(data)
+                    if protocol.unpack_header(data)[0] == protocol.MESSAGE_SC_OK_JOIN:
+                        self.__joined[key.data] = True
+                    if self.__on_packet is not None:
+                        self.__on_packet(key.data, data)
+
+    def get_count(self):
+        return len(self.__sockets)
+
+    def get_joined(self):
+        return sum(self.__joined)
+
+    def set_on_packet(self, on_packet):
+        '''
+        on_packet(idx, data) is called from the draining thread on every server message
+        '''
+        self.__on_packet = on_packet
+
+    def get_received(self):
+        return self.__received, self.__received_bytes
+
+    def join(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline and not all(self.__joined):
+            for idx, sock in enumerate(self.__sockets):
+                if not self.__joined[idx]:
+                    self.send(idx, protocol.MESSAGE_CS_JOIN)
+            time.sleep(0.5)
+        return self.get_joined()
+
+    def send(self, idx, message_type):
+        try:
+            self.__sockets[idx].sendto(protocol.pack_message(message_type), self.__server_addresses[idx])
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        for idx in range(len(self.__sockets)):
+            if self.__joined[idx]:
+                self.send(idx, protocol.MESSAGE_CS_LEAVE)
+        time.sleep(0.5)
+        self.__running = False
+        self.__thread.join()
+        for sock in self.__sockets:
+            sock.close()
+        self.__selector.close()
+
+
+def blast(players, mix, rate, duration, senders, batch_ms, seed):
+    '''
+    Open-loop send at rate messages/s for duration seconds from senders threads
+    Each thread wakes every batch_ms and sends everything that fell due since, regardless of the server
+    (sent, send errors) over all threads
+    '''
+    kinds = [kind for kind, _ in mix]
+    weights = [weight for _, weight in mix]
+    results = [None] * senders
+
+    def sender(sender_id):
+        rng = random.Random(seed * 1000 + sender_id)
+        own = list(range(sender_id, players.get_count(), senders))
+        thread_rate = rate / senders
+        sent = errors = 0
+        start = time.perf_counter()
+        while True:
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration:
+                break
+            due = int(elapsed * thread_rate)
+            for kind in rng.choices(kinds, weights, k=due - sent - errors):
+                if players.send(rng.choice(own), rng.choice(MESSAGE_KINDS[kind])):
+                    sent += 1
+                else:
+                    errors += 1
+            time.sleep(batch_ms / 1000.)
+        results[sender_id] = (sent, errors)
+
+    threads = [threading.Thread(target=sender, args=(sender_id,)) for sender_id in range(senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(result[0] for result in results), sum(result[1] for result in results)
+
+
+def load_ticks(run_dir):
+    '''
+    [(tick_start ms, request_number, request_time us, update_time us)] of every thread, keyed by thread id
+    '''
+    ticks = dict()
+    for filename in sorted(os.listdir(run_dir)):
+        if not filename.endswith('.csv'):
+            continue
+        with open(os.path.join(run_dir, filename)) as f:
+            header = f.readline().split()
+            rows = [line.strip().split(',') for line in f if line.strip()]
+        if 'tick_start' not in header:
+            print('Error:', run_dir, 'has no tick_start column. Rebuild the server')
+            sys.exit(1)
+        idx = [header.index(name) for name in ('tick_start', 'request_number', 'request_time', 'update_time')]
+        ticks[int(filename[:-len('.csv')])] = [tuple(float(row[i]) for i in idx) for row in rows if len(row) == len(header)]
+    return ticks
+
+
+def summarize_step(ticks, step, update_interval):
+    '''
+    Server side view of a step from the ticks that started and ended inside its measurement window
+    A tick lasts until the next one starts, so handled messages are divided by the time the ticks actually cover
+    '''
+    begin_ms, end_ms = step['window'][0] * 1000., step['window'][1] * 1000.
+    handled_rate = 0.
+    handled = 0
+    request_us = 0.
+    busiest = 0.
+    overruns = 0
+    nticks = 0
+    for thread_ticks in ticks.values():
+        window = [(tick, following[0] - tick[0]) for tick, following in zip(thread_ticks, thread_ticks[1:]) if begin_ms <= tick[0] and following[0] <= end_ms]
+        covered_ms = sum(duration for _, duration in window)
+        if covered_ms <= 0:
+            continue
+        thread_handled = sum(tick[1] for tick, _ in window)
+        thread_request_us = sum(tick[2] for tick, _ in window)
+        handled_rate += thread_handled / covered_ms * 1000.
+        handled += thread_handled
+        request_us += thread_request_us
+        # Share of the time a thread spent handling requests
+        busiest = max(busiest, thread_request_us / (covered_ms * 1000.) * 100.)
+        overruns += sum(1 for tick, duration in window if duration > update_interval * 1.5)
+        nticks += len(window)
+    return {
+        'handled_rate': handled_rate,
+        'request_us': request_us / handled if handled else 0.,
+        'busy_pct': busiest,
+        'overrun_pct': overruns / nticks * 100. if nticks else 0.,
+    }
+
+
+def start_server(args, work_dir):
+    config_path = os.path.join(work_dir, 'config_bench.ini')
+    write_config(args, config_path)
+    os.makedirs(os.path.join(work_dir, 'metrics'), exist_ok=True)
+    log = open(os.path.join(work_dir, 'server.log'), mode='w')
+    print('Info:', 'Starting', args.server, 'with', args.threads, 'threads on port', args.port)
+    return subprocess.Popen([os.path.abspath(args.server), config_path, str(args.port)], cwd=work_dir, stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_server(server, work_dir):
+    '''
+    Quit the server so it dumps its metrics, return the run directory it wrote
+    '''
+    metrics_dir = os.path.join(work_dir, 'metrics')
+    before = set(os.listdir(metrics_dir))
+    try:
+        server.communicate(b'q\n', timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        print('Error:', 'The server did not quit, see', os.path.join(work_dir, 'server.log'))
+        sys.exit(1)
+    new_runs = sorted(set(os.listdir(metrics_dir)).difference(before))
+    if not new_runs:
+        print('Error:', 'The server wrote no metrics, see', os.path.join(work_dir, 'server.log'))
+        sys.exit(1)
+    return os.path.join(metrics_dir, new_runs[-1])
+
+
+def sweep_rates(args):
+    if args.rates:
+        return sorted(args.rates)
+    rates = list()
+    rate = args.start_rate
+    while rate <= args.stop_rate:
+        rates.append(int(rate))
+        rate *= args.factor
+    return rates
+
+
+def main(args):
+    print('Info:', args)
+    print('Info:')
+    mixes = [(spec, parse_mix(spec)) for spec in args.mixes]
+    rates = sweep_rates(args)
+    work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix='simmud_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    server = start_server(args, work_dir)
+    time.sleep(1.)
+    if server.poll() is not None:
+        print('Error:', 'The server exited, see', os.path.join(work_dir, 'server.log'))
+        sys.exit(1)
+
+    players = SyntheticPlayers(args.players, ('127.0.0.1', args.port))
+    joined = players.join(args.join_timeout)
+    print('Info:', joined, 'of', args.players, 'players joined')
+    if joined == 0:
+        players.close()
+        stop_server(server, work_dir)
+        print('Error:', 'No player could join')
+        sys.exit(1)
+
+    steps = list()
+    for spec, mix in mixes:
+        print('Info:')
+        print('Info:', 'Mix', spec)
+        for rate in rates:
+            rcvbuf_before, _ = udp_errors()
+            start = time.time()
+            sent, errors = blast(players, mix, rate, args.step_duration, args.senders, args.batch_ms, args.seed)
+            end = time.time()
+            rcvbuf_after, _ = udp_errors()
+            steps.append({
+                'mix': spec,
+                'rate': rate,
+                'sent_rate': sent / (end - start),
+                'send_errors': errors,
+                'rcvbuf_errors': rcvbuf_after - rcvbuf_before,
+                # Skip the ticks still draining the previous step
+                'window': (start + args.warmup, end),
+            })
+            print('Info:', '    ' + num_fmt(rate), 'msg/s requested,', float_fmt(sent / (end - start)), 'msg/s sent,', num_fmt(rcvbuf_after - rcvbuf_before), 'UDP receive buffer drops')
+            time.sleep(args.cooldown)
+
+    players.close()
+    run_dir = stop_server(server, work_dir)
+    print('Info:')
+    print('Info:', 'Server metrics in', run_dir)
+
+    ticks = load_ticks(run_dir)
+    for step in steps:
+        step.update(summarize_step(ticks, step, args.update_interval))
+        step['drop_pct'] = max(0., (1. - step['handled_rate'] / step['sent_rate']) * 100.) if step['sent_rate'] else 0.
+    report(steps, mixes, args)
+
+
+def report(steps, mixes, args):
+    columns = ['mix', 'rate', 'sent_rate', 'handled_rate', 'drop_pct', 'rcvbuf_errors', 'request_us', 'busy_pct', 'overrun_pct']
+    row_fmt = '{:<28} {:>9} {:>11} {:>11} {:>7} {:>9} {:>11} {:>7} {:>8}'
+    print('Info:')
+    print('Info:', row_fmt.format(*columns))
+    for step in steps:
+        print('Info:', row_fmt.format(step['mix'], num_fmt(step['rate']), float_fmt(step['sent_rate']), float_fmt(step['handled_rate']), float_fmt(step['drop_pct']), num_fmt(step['rcvbuf_errors']), float_fmt(step['request_us']), float_fmt(step['busy_pct']), float_fmt(step['overrun_pct'])))
+
+    # Cost of a message is taken from the steps below saturation, the knee is the first saturated step
+    print('Info:')
+    print('Info:', 'Per mix cost and saturation:')
+    summary = list()
+    for spec, _ in mixes:
+        mix_steps = [step for step in steps if step['mix'] == spec]
+        saturated = [step for step in mix_steps if step['drop_pct'] > args.drop_threshold or step['busy_pct'] > args.busy_threshold]
+        knee = saturated[0]['rate'] if saturated else None
+        healthy = [step for step in mix_steps if knee is None or step['rate'] < knee]
+        handled = sum(step['handled_rate'] for step in healthy)
+        cost = sum(step['request_us'] * step['handled_rate'] for step in healthy) / handled if handled else float('nan')
+        summary.append((spec, cost, knee))
+        print('Info:', '    {:<28} {:>8} us/request, saturates at {}'.format(spec, float_fmt(cost), num_fmt(knee) + ' msg/s' if knee else 'none of the rates'))
+
+    if args.output:
+        with open(args.output, mode='w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for step in steps:
+                writer.writerow([step[column] for column in columns])
+            writer.writerow([])
+            writer.writerow(['mix', 'request_us', 'saturation_rate'])
+            for spec, cost, knee in summary:
+                writer.writerow([spec, cost, knee if knee else ''])
+        print('Info:', 'Sweep report written to', args.output)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='bench_server.py')
+    parser.add_argument('--server', type=str, default='./server', help='Server binary')
+    parser.add_argument('--config', type=str, default='config_static_no_quest.ini', help='Template config, the benchmark overrides threads, interval and balance')
+    parser.add_argument('--port', type=int, default=1747, help='Local port of the server')
+    parser.add_argument('--threads', type=int, default=1, help='Number of WorldUpdateModule threads')
+    parser.add_argument('--update_interval', type=int, default=50, help='Regular update interval in ms')
+    parser.add_argument('--balance', type=str, default='static', help='Load balancing algorithm of the server')
+    parser.add_argument('--players', type=int, default=64, help='Number of synthetic players')
+    parser.add_argument('--join_timeout', type=float, default=10., help='Seconds to wait for the players to join')
+
+    parser.add_argument('--mixes', type=str, nargs='+', default=['move', 'attack', 'use', 'move=0.7,attack=0.2,use=0.1'], help='Message mixes to sweep, e.g. move=0.7,attack=0.2,use=0.1')
+    parser.add_argument('--rates', type=int, nargs='+', help='Offered rates in messages/s. Geometric --start_rate to --stop_rate by default')
+    parser.add_argument('--start_rate', type=int, default=1000, help='First offered rate in messages/s')
+    parser.add_argument('--stop_rate', type=int, default=256000, help='Last offered rate in messages/s')
+    parser.add_argument('--factor', type=float, default=2., help='Ratio between consecutive rates')
+    parser.add_argument('--step_duration', type=float, default=5., help='Seconds per rate')
+    parser.add_argument('--warmup', type=float, default=1., help='Leading seconds of every step not measured')
+    parser.add_argument('--cooldown', type=float, default=1., help='Seconds of idle between steps')
+    parser.add_argument('--senders', type=int, default=2, help='Number of sending threads')
+    parser.add_argument('--batch_ms', type=float, default=1., help='Milliseconds between send batches of a sending thread')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the message mix')
+
+    parser.add_argument('--drop_threshold', type=float, default=1., help='Percentage of unhandled messages that marks saturation')
+    parser.add_argument('--busy_threshold', type=float, default=80., help='Percentage of the update interval spent on requests that marks saturation')
+    parser.add_argument('--work_dir', type=str, help='Directory for the generated config, server log and metrics. A temporary one by default')
+    parser.add_argument('--output', type=str, help='CSV file to write the sweep report into')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
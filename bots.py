@@ -0,0 +1,574 @@
+#!/usr/bin/python3
+
+import argparse
+import csv
+import random
+import threading
+import time
+
+import numpy as np
+
+import bench_server
+import protocol
+
+
+# From src/Constants.h
+MAX_CLIENT_VIEW = 8
+CLIENT_AI_DELAY = 200
+AI_RETRY_COUNT = 3
+
+# PlayerAI_Purpose of src/client/PlayerAI.h
+BASIC, EXPLORING, SEEKING_QUEST, SEEKING_FOOD, CHASING_PLAYER, RUNNING_AWAY = range(6)
+PURPOSE_NAMES = ['basic', 'exploring', 'seeking_quest', 'seeking_food', 'chasing_player', 'running_away']
+
+# What a bot walks towards instead of a path: nothing, a shared distance field, or a cell it heads for directly
+GOAL_NONE, GOAL_QUEST, GOAL_FOOD, GOAL_WAYPOINT, GOAL_CELL = range(5)
+
+NO_ACTION = protocol.MESSAGE_DEFAULT
+# (dx, dy) of the moves, y grows downwards
+LEFT, UP, RIGHT, DOWN = (-1, 0), (0, -1), (1, 0), (0, 1)
+NEIGHBOURS = np.array([LEFT, UP, RIGHT, DOWN], dtype=np.int32)
+
+
+def step_index(dx, dy):
+    return (dx + 1) * 3 + dy + 1
+
+
+# MESSAGE_CS_MOVE_* and MESSAGE_CS_ATTACK_* indexed by step_index
+MOVES = np.zeros(9, dtype=np.int32)
+ATTACKS = np.zeros(9, dtype=np.int32)
+for step, move, attack in [(LEFT, protocol.MESSAGE_CS_MOVE_LEFT, protocol.MESSAGE_CS_ATTACK_LEFT), (UP, protocol.MESSAGE_CS_MOVE_UP, protocol.MESSAGE_CS_ATTACK_UP),
+                           (RIGHT, protocol.MESSAGE_CS_MOVE_RIGHT, protocol.MESSAGE_CS_ATTACK_RIGHT), (DOWN, protocol.MESSAGE_CS_MOVE_DOWN, protocol.MESSAGE_CS_ATTACK_DOWN)]:
+    MOVES[step_index(*step)] = move
+    ATTACKS[step_index(*step)] = attack
+
+UNREACHED = np.iinfo(np.int32).max
+# Seconds between rebuilds of the quest and food fields for terrain seen since, and between new exploration waypoints
+FIELD_PERIOD = 5.
+WAYPOINT_PERIOD = 30.
+# Percentage of the time spent deciding above which bots act less often than --ai_delay
+BUSY_THRESHOLD = 90.
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def num_fmt(num):
+    return f'{num:,}'
+
+
+def ring_offsets(distance):
+    '''
+    [(dx, dy)] in the order PlayerAI::findNearObject visits the cells around the player, nearest ring first
+    '''
+    offsets = list()
+    for d in range(1, distance):
+        for dx in range(-d, d + 1):
+            offsets += [(dx, -d), (dx, d)]
+        for dy in range(-d + 1, d):
+            offsets += [(-d, dy), (d, dy)]
+    return np.array(offsets, dtype=np.int32)
+
+
+RING = ring_offsets(MAX_CLIENT_VIEW)
+
+
+def distance_field(terrain, sources):
+    '''
+    Moves from the nearest of the flat indices sources to every cell of terrain, UNREACHED for blocked and unreachable cells
+    Sources count even when blocked, like the target of PathFinder::findPathNear
+    terrain must have a blocked border, so neighbours of a cell are at flat offsets +-1 and +-height
+    '''
+    free = terrain.ravel() == 0
+    dist = np.full(terrain.size, UNREACHED, dtype=np.int32)
+    steps = np.array([1, -1, terrain.shape[1], -terrain.shape[1]])
+    frontier = np.unique(sources)
+    dist[frontier] = 0
+    d = 0
+    while len(frontier):
+        d += 1
+        cells = (frontier[:, None] + steps).ravel()
+        frontier = np.unique(cells[free[cells] & (dist[cells] == UNREACHED)])
+        dist[frontier] = d
+    return dist.reshape(terrain.shape)
+
+
+class World:
+    '''
+    What the swarm has seen of the map, shared by every bot, in grids padded with MAX_CLIENT_VIEW blocked cells on every side
+    terrain is the map terrain with unseen cells free, as the client starts with, objects the quantity of every object, players the life of every player, -1 where there is none
+    Every view of a regular update replaces what was known of its cells
+    '''
+    def __init__(self, mapx, mapy):
+        self.mapx = mapx
+        self.mapy = mapy
+        pad = MAX_CLIENT_VIEW
+        self.terrain = np.ones((mapx + 2 * pad, mapy + 2 * pad), dtype=np.int8)
+        self.terrain[pad:-pad, pad:-pad] = 0
+        self.objects = np.zeros(self.terrain.shape, dtype=np.int32)
+        self.players = np.full(self.terrain.shape, -1, dtype=np.int32)
+        self.terrain_version = 0
+        self.food_version = 0
+        self.quest = None
+
+    def absorb(self, update):
+        x1, y1, x2, y2 = update['view']
+        if x1 < 0 or y1 < 0 or x2 > self.mapx or y2 > self.mapy or x2 <= x1 or y2 <= y1:
+            return
+        pad = MAX_CLIENT_VIEW
+        view = (slice(x1 + pad, x2 + pad), slice(y1 + pad, y2 + pad))
+        # Terrain comes column by column
+        terrain = np.frombuffer(update['terrain'], dtype=np.int8).reshape(x2 - x1, y2 - y1)
+        if not np.array_equal(self.terrain[view], terrain):
+            self.terrain[view] = terrain
+            self.terrain_version += 1
+
+        food = self.objects[view] > 0
+        self.objects[view] = 0
+        self.players[view] = -1
+        for x, y, _, quantity in update['objects']:
+            self.objects[x + pad, y + pad] = quantity
+        for x, y, life, _, _ in update['players']:
+            self.players[x + pad, y + pad] = life
+        if not np.array_equal(food, self.objects[view] > 0):
+            self.food_version += 1
+
+    def random_free_cell(self, rng):
+        pad = MAX_CLIENT_VIEW
+        while True:
+            x, y = rng.randrange(self.mapx), rng.randrange(self.mapy)
+            if self.terrain[x + pad, y + pad] == 0:
+                return x, y
+
+
+class Fields:
+    '''
+    Distance fields over World.terrain every bot walks down instead of running A* on its own:
+    to the quest, to the nearest food and to each of a few exploration waypoints
+    '''
+    def __init__(self, world, waypoints, rng):
+        self.__world = world
+        self.__rng = rng
+        self.__nwaypoint = waypoints
+        self.quest = None
+        self.food = None
+        self.waypoints = None
+        self.__quest_key = None
+        self.__food_key = None
+        self.__terrain_version = -1
+        self.__next_rebuild = 0.
+        self.__next_waypoints = 0.
+        self.build_seconds = 0.
+
+    def get_waypoint_count(self):
+        return self.__nwaypoint
+
+    def __sources(self, cells):
+        pad = MAX_CLIENT_VIEW
+        height = self.__world.terrain.shape[1]
+        return np.array([(x + pad) * height + y + pad for x, y in cells], dtype=np.int64)
+
+    def refresh(self, now):
+        world = self.__world
+        start = time.perf_counter()
+        # Terrain is learnt bit by bit, rebuilding on every new cell would take all the time
+        terrain_changed = world.terrain_version != self.__terrain_version and now >= self.__next_rebuild
+        if terrain_changed:
+            self.__terrain_version = world.terrain_version
+            self.__next_rebuild = now + FIELD_PERIOD
+
+        if world.quest != self.__quest_key or terrain_changed:
+            self.__quest_key = world.quest
+            self.quest = distance_field(world.terrain, self.__sources([world.quest])) if world.quest else None
+
+        if world.food_version != self.__food_key or terrain_changed:
+            self.__food_key = world.food_version
+            self.food = distance_field(world.terrain, np.flatnonzero(world.objects.ravel() > 0))
+
+        if now >= self.__next_waypoints:
+            self.__next_waypoints = now + WAYPOINT_PERIOD
+            cells = [world.random_free_cell(self.__rng) for _ in range(self.__nwaypoint)]
+            self.waypoints = np.stack([distance_field(world.terrain, self.__sources([cell])) for cell in cells])
+        self.build_seconds += time.perf_counter() - start
+
+    def at(self, goal, waypoint, px, py):
+        '''
+        Distance left at the padded cells (px, py) towards the field goals of their bots, UNREACHED for other goals
+        '''
+        values = np.full(len(px), UNREACHED, dtype=np.int32)
+        for kind, field in [(GOAL_QUEST, self.quest), (GOAL_FOOD, self.food)]:
+            mask = goal == kind
+            if field is not None and mask.any():
+                values[mask] = field[px[mask], py[mask]]
+        mask = goal == GOAL_WAYPOINT
+        if mask.any():
+            values[mask] = self.waypoints[waypoint[mask], px[mask], py[mask]]
+        return values
+
+
+class BotEngine:
+    '''
+    PlayerAI::takeAction of many bots at once, the state of bot i at index i of every array
+    Bots keep a goal instead of a path: the quest, food and exploring follow the shared Fields, chasing and running away head straight for a cell
+    '''
+    def __init__(self, count, world, fields, rng):
+        self.__world = world
+        self.__fields = fields
+        self.__rng = np.random.default_rng(rng.randrange(1 << 32))
+        self.x = np.zeros(count, dtype=np.int32)
+        self.y = np.zeros(count, dtype=np.int32)
+        self.life = np.zeros(count, dtype=np.int32)
+        self.purpose = np.full(count, BASIC, dtype=np.int8)
+        self.sbx = np.zeros(count, dtype=np.int32)
+        self.sby = np.zeros(count, dtype=np.int32)
+        self.sb_wait = np.zeros(count, dtype=np.int32)
+        self.goal = np.full(count, GOAL_NONE, dtype=np.int8)
+        self.waypoint = np.zeros(count, dtype=np.int32)
+        self.tx = np.zeros(count, dtype=np.int32)
+        self.ty = np.zeros(count, dtype=np.int32)
+
+    def __find_near(self, cells, x, y):
+        '''
+        (found, x, y) of the first cell in PlayerAI::findNearObject order where cells[bot][ring cell] holds
+        '''
+        first = np.argmax(cells, axis=1)
+        found = cells[np.arange(len(first)), first]
+        return found, x + RING[first, 0], y + RING[first, 1]
+
+    def __next_cells(self, goal, waypoint, x, y, tx, ty):
+        '''
+        (has_next, nx, ny, left) of the next cell of every bot towards its goal and the moves left after it
+        '''
+        world = self.__world
+        pad = MAX_CLIENT_VIEW
+        px, py = x + pad, y + pad
+
+        # Down a field: the neighbour nearest to the goal, stepping aside around a player in the way as A* over the client's second matrix does
+        cols = np.arange(len(x))
+        here = self.__fields.at(goal, waypoint, px, py).astype(np.int64)
+        around = np.stack([self.__fields.at(goal, waypoint, px + dx, py + dy) for dx, dy in NEIGHBOURS]).astype(np.int64)
+        occupied = np.stack([world.players[px + dx, py + dy] >= 0 for dx, dy in NEIGHBOURS])
+        best = np.argmin(around, axis=0)
+        aside = np.argmin(np.where(occupied, UNREACHED, around), axis=0)
+        best = np.where(occupied[best, cols] & ~occupied[aside, cols] & (around[aside, cols] <= here + 1), aside, best)
+        on_field = (here > 0) & (here != UNREACHED)
+        nx = x + NEIGHBOURS[best, 0]
+        ny = y + NEIGHBOURS[best, 1]
+        left = here - 1
+
+        # Straight for a cell: along the longer axis, along the other one if the terrain is in the way
+        dx, dy = tx - x, ty - y
+        along_x = np.abs(dx) >= np.abs(dy)
+        cx = np.where(along_x, x + np.sign(dx), x)
+        cy = np.where(along_x, y, y + np.sign(dy))
+        detour = (world.terrain[cx + pad, cy + pad] != 0) & np.where(along_x, dy != 0, dx != 0)
+        cx = np.where(detour, np.where(along_x, x, x + np.sign(dx)), cx)
+        cy = np.where(detour, np.where(along_x, y + np.sign(dy), y), cy)
+        to_cell = goal == GOAL_CELL
+        on_cell = to_cell & ((dx != 0) | (dy != 0))
+
+        has_next = np.where(to_cell, on_cell, on_field)
+        nx = np.where(to_cell, cx, nx)
+        ny = np.where(to_cell, cy, ny)
+        left = np.where(to_cell, np.abs(dx) + np.abs(dy) - 1, left)
+        return has_next, nx, ny, left
+
+    def decide(self, idx):
+        '''
+        Action, NO_ACTION or a MESSAGE_CS_*, of the bots idx with their state updated as the client does
+        '''
+        world = self.__world
+        fields = self.__fields
+        pad = MAX_CLIENT_VIEW
+        x, y, life = self.x[idx], self.y[idx], self.life[idx]
+        purpose, goal, sb_wait = self.purpose[idx], self.goal[idx], self.sb_wait[idx]
+        waypoint, tx, ty = self.waypoint[idx], self.tx[idx], self.ty[idx]
+        actions = np.full(len(idx), NO_ACTION, dtype=np.int32)
+
+        # Wait for the server to move the bot where its last move should have, up to AI_RETRY_COUNT decisions
+        waiting = (purpose != BASIC) & ((self.sbx[idx] != x) | (self.sby[idx] != y))
+        sb_wait[waiting] += 1
+        expired = waiting & (sb_wait == AI_RETRY_COUNT)
+        purpose[expired] = BASIC
+        goal[expired] = GOAL_NONE
+        acting = ~waiting | expired
+
+        # What each bot sees around it, the cells of CLIENT_MATRIX_SIZE where an object and a player share a cell are neither
+        px, py = x + pad, y + pad
+        wx, wy = px[:, None] + RING[:, 0], py[:, None] + RING[:, 1]
+        objects, players = world.objects[wx, wy], world.players[wx, wy]
+        food_here = world.objects[px, py] > 0
+        food_seen, _, _ = self.__find_near((objects > 0) & (players < 0), x, y)
+        player_cells = (players >= 0) & (objects == 0)
+        strong, strong_x, strong_y = self.__find_near(player_cells & (players >= life[:, None] + 1), x, y)
+        weak, weak_x, weak_y = self.__find_near(player_cells & (players >= 10) & (players <= life[:, None] - 1), x, y)
+        if world.quest:
+            qx, qy = world.quest
+            quest_far = (np.abs(x - qx) > MAX_CLIENT_VIEW) | (np.abs(y - qy) > MAX_CLIENT_VIEW)
+            quest_path = fields.quest[px, py] != UNREACHED
+        else:
+            quest_far = quest_path = np.zeros(len(idx), dtype=bool)
+        food_path = fields.food[px, py] != UNREACHED
+
+        def take(mask, new_purpose, new_goal):
+            purpose[mask] = new_purpose
+            goal[mask] = new_goal
+            pending[mask] = False
+
+        # The checks of every purpose in PlayerAI::takeAction, each bot stops at the first that succeeds
+        basic = acting & (purpose == BASIC)
+        seeking_quest = acting & (purpose == SEEKING_QUEST)
+        chasing = acting & (purpose == CHASING_PLAYER)
+        exploring = acting & (purpose == EXPLORING)
+        if not world.quest:
+            purpose[seeking_quest] = BASIC
+        pending = basic | seeking_quest | chasing | exploring
+        amount = np.select([basic, seeking_quest, chasing, exploring], [100, 20, 40, 90], 0)
+
+        # checkFood
+        hungry = pending & (life < amount)
+        take(hungry & food_here, SEEKING_FOOD, GOAL_NONE)
+        take(hungry & food_seen & food_path, SEEKING_FOOD, GOAL_FOOD)
+        pending &= ~seeking_quest
+
+        # checkQuest
+        take(pending & quest_far & quest_path, SEEKING_QUEST, GOAL_QUEST)
+
+        # checkStrongPlayer, to the cell opposite the stronger player or anywhere when it is blocked
+        running = pending & ~chasing & strong
+        ax = np.clip(2 * x - strong_x, 0, world.mapx - 1)
+        ay = np.clip(2 * y - strong_y, 0, world.mapy - 1)
+        blocked = world.terrain[ax + pad, ay + pad] != 0
+        tx[running], ty[running] = ax[running], ay[running]
+        waypoint[running & blocked] = self.__rng.integers(fields.get_waypoint_count(), size=int((running & blocked).sum()))
+        take(running & ~blocked, RUNNING_AWAY, GOAL_CELL)
+        take(running & blocked, RUNNING_AWAY, GOAL_WAYPOINT)
+
+        # checkWeakPlayer
+        hunting = pending & weak
+        tx[hunting], ty[hunting] = weak_x[hunting], weak_y[hunting]
+        take(hunting, CHASING_PLAYER, GOAL_CELL)
+
+        # tryToExplore
+        wandering = pending & basic
+        waypoint[wandering] = self.__rng.integers(fields.get_waypoint_count(), size=int(wandering.sum()))
+        goal[wandering] = GOAL_WAYPOINT
+        distance = fields.at(goal, waypoint, px, py)
+        reachable = wandering & (distance != UNREACHED) & (distance > 0)
+        goal[wandering & ~reachable] = GOAL_NONE
+        take(reachable, EXPLORING, GOAL_WAYPOINT)
+
+        # moveAlongThePath
+        has_next, nx, ny, left = self.__next_cells(goal, waypoint, x, y, tx, ty)
+        # The padding is blocked, so cells off the map are invalid too
+        moving = acting & has_next
+        invalid = moving & (world.terrain[nx + pad, ny + pad] != 0)
+        purpose[invalid] = BASIC
+        stepping = moving & ~invalid
+        step = step_index(nx - x, ny - y)
+        empty = world.players[nx + pad, ny + pad] < 0
+        actions[stepping & empty] = MOVES[step[stepping & empty]]
+        self.sbx[idx[stepping]] = nx[stepping]
+        self.sby[idx[stepping]] = ny[stepping]
+        sb_wait[stepping] = 0
+        path_size = np.where(stepping, left, np.where(has_next, left + 1, 0))
+
+        # Attack once next to the chased player, ATTACK_UP when the path is gone as the client does
+        idle = acting & ~invalid & (actions == NO_ACTION)
+        attack = idle & (purpose == CHASING_PLAYER) & (path_size <= 1)
+        purpose[attack] = BASIC
+        adjacent = path_size == 1
+        side = np.select([tx == x + 1, tx == x - 1, ty == y + 1, ty == y - 1], [step_index(*RIGHT), step_index(*LEFT), step_index(*DOWN), step_index(*UP)], step_index(*UP))
+        actions[attack] = np.where(adjacent[attack], ATTACKS[side[attack]], protocol.MESSAGE_CS_ATTACK_UP)
+
+        # The purpose is over at the end of the path, eating if it was food
+        over = idle & ~attack & (path_size == 0) & (purpose != BASIC)
+        actions[over & (purpose == SEEKING_FOOD) & food_here] = protocol.MESSAGE_CS_USE
+        purpose[over] = BASIC
+        goal[over] = GOAL_NONE
+
+        self.purpose[idx], self.goal[idx], self.sb_wait[idx] = purpose, goal, sb_wait
+        self.waypoint[idx], self.tx[idx], self.ty[idx] = waypoint, tx, ty
+        return actions
+
+
+class BotSwarm:
+    '''
+    Bots on SyntheticPlayers, the last regular update of every bot kept until its next decision
+    '''
+    def __init__(self, count, server_address, compressed):
+        self.__compressed = compressed
+        self.__joins = [None] * count
+        self.__updates = [None] * count
+        self.__quest = None
+        self.__updates_received = 0
+        self.__lock = threading.Lock()
+        self.players = bench_server.SyntheticPlayers(count, server_address)
+        self.players.set_on_packet(self.__on_packet)
+
+    def __on_packet(self, idx, data):
+        message_type = protocol.unpack_header(data)[0]
+        if message_type == protocol.MESSAGE_SC_REGULAR_UPDATE:
+            self.__updates[idx] = data
+            self.__updates_received += 1
+        elif message_type == protocol.MESSAGE_SC_OK_JOIN:
+            self.__joins[idx] = protocol.unpack_ok_join(data)
+        elif message_type == protocol.MESSAGE_SC_NEW_QUEST:
+            with self.__lock:
+                self.__quest = protocol.unpack_xy(data)
+        elif message_type == protocol.MESSAGE_SC_QUEST_OVER:
+            with self.__lock:
+                self.__quest = None
+
+    def get_joins(self):
+        return self.__joins
+
+    def get_quest(self):
+        with self.__lock:
+            return self.__quest
+
+    def get_updates_received(self):
+        return self.__updates_received
+
+    def take_update(self, idx):
+        '''
+        Decoded last regular update of bot idx not taken yet, or None
+        '''
+        data, self.__updates[idx] = self.__updates[idx], None
+        if data is None:
+            return None
+        try:
+            return protocol.decode_regular_update(protocol.decompress_message(data) if self.__compressed else data)
+        except ValueError:
+            return None
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    swarm = BotSwarm(args.players, protocol.parse_address(args.server), args.compressed)
+    joined = swarm.players.join(args.join_timeout)
+    print('Info:', joined, 'of', args.players, 'bots joined')
+    joins = swarm.get_joins()
+    bots = np.array([idx for idx, join in enumerate(joins) if join is not None], dtype=np.int64)
+    if len(bots) == 0:
+        print('Error:', 'No bot joined', args.server)
+        swarm.players.close()
+        return None
+
+    _, (mapx, mapy), _, _ = joins[bots[0]]
+    print('Info:', 'Map', mapx, 'x', mapy)
+    world = World(mapx, mapy)
+    fields = Fields(world, args.waypoints, rng)
+    engine = BotEngine(args.players, world, fields, rng)
+    for idx in bots:
+        _, _, (engine.x[idx], engine.y[idx]), _ = joins[idx]
+    engine.sbx[:], engine.sby[:] = engine.x, engine.y
+    seen = np.zeros(args.players, dtype=bool)
+
+    # Bots decide once they know where they are, in turns of args.slices, so their actions spread over CLIENT_AI_DELAY like independent clients
+    slices = [bots[part::args.slices] for part in range(args.slices)]
+    slice_interval = args.ai_delay / 1000. / args.slices
+    columns = ['time', 'bots', 'updates_per_second', 'actions_per_second', 'moves_per_second', 'attacks_per_second', 'uses_per_second'] + PURPOSE_NAMES + ['decide_ms', 'decide_max_ms', 'busy_pct', 'fields_ms', 'late_max_ms']
+    rows = list()
+    counts = dict.fromkeys(['actions', 'moves', 'attacks', 'uses'], 0)
+    decide_seconds = list()
+    late_max = 0.
+    last_updates = swarm.get_updates_received()
+    last_fields = 0.
+
+    start = last_report = time.perf_counter()
+    turn = 0
+    try:
+        while True:
+            due = start + turn * slice_interval
+            now = time.perf_counter()
+            if due - start >= args.duration:
+                break
+            if due > now:
+                time.sleep(due - now)
+            late_max = max(late_max, time.perf_counter() - due)
+
+            begin = time.perf_counter()
+            idx = slices[turn % args.slices]
+            for bot in idx:
+                update = swarm.take_update(bot)
+                if update is not None:
+                    world.absorb(update)
+                    engine.x[bot], engine.y[bot] = update['position']
+                    engine.life[bot] = update['life']
+                    seen[bot] = True
+            idx = idx[seen[idx]]
+            world.quest = swarm.get_quest()
+            fields.refresh(begin - start)
+            actions = engine.decide(idx)
+            for bot, action in zip(idx[actions != NO_ACTION].tolist(), actions[actions != NO_ACTION].tolist()):
+                swarm.players.send(bot, action)
+            decide_seconds.append(time.perf_counter() - begin)
+            counts['actions'] += int((actions != NO_ACTION).sum())
+            counts['moves'] += int(np.isin(actions, protocol.MOVE_MESSAGES).sum())
+            counts['attacks'] += int(np.isin(actions, protocol.ATTACK_MESSAGES).sum())
+            counts['uses'] += int((actions == protocol.MESSAGE_CS_USE).sum())
+            turn += 1
+
+            now = time.perf_counter()
+            if now - last_report >= args.report or due + slice_interval - start >= args.duration:
+                elapsed = now - last_report
+                updates = swarm.get_updates_received()
+                purposes = np.bincount(engine.purpose[bots], minlength=len(PURPOSE_NAMES))
+                row = {'time': now - start, 'bots': len(bots), 'updates_per_second': (updates - last_updates) / elapsed}
+                row.update({kind + '_per_second': count / elapsed for kind, count in counts.items()})
+                row.update(zip(PURPOSE_NAMES, purposes.tolist()))
+                row.update({'decide_ms': np.mean(decide_seconds) * 1000. if decide_seconds else 0., 'decide_max_ms': max(decide_seconds, default=0.) * 1000.,
+                    'busy_pct': sum(decide_seconds) * 100. / elapsed, 'fields_ms': (fields.build_seconds - last_fields) * 1000. / elapsed, 'late_max_ms': late_max * 1000.})
+                rows.append(row)
+                print('Info:', '{:>7} s {:>10} updates/s {:>9} actions/s'.format(float_fmt(row['time']), float_fmt(row['updates_per_second']), float_fmt(row['actions_per_second'])),
+                    ' '.join(name + '=' + num_fmt(row[name]) for name in PURPOSE_NAMES),
+                    ' decide {} ms (max {}), busy {}%, fields {} ms/s, late {} ms'.format(float_fmt(row['decide_ms']), float_fmt(row['decide_max_ms']), float_fmt(row['busy_pct']), float_fmt(row['fields_ms']), float_fmt(row['late_max_ms'])))
+                counts = dict.fromkeys(counts, 0)
+                decide_seconds = list()
+                late_max = 0.
+                last_updates = updates
+                last_fields = fields.build_seconds
+                last_report = now
+    except KeyboardInterrupt:
+        print('Info:', 'Interrupted')
+
+    swarm.players.close()
+    # Decisions that take all the time of the loop mean this host cannot drive that many bots every --ai_delay
+    if rows:
+        busy = np.mean([row['busy_pct'] for row in rows])
+        print('Info:')
+        print('Info:', len(bots), 'bots took', float_fmt(busy) + '% of the time to decide, at most', float_fmt(max(row['late_max_ms'] for row in rows)), 'ms late')
+        if busy > BUSY_THRESHOLD:
+            print('Warning:', 'Decisions fall behind --ai_delay, use fewer bots per host')
+    if args.output:
+        with open(args.output, mode='w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        print('Info:', 'Bot report written to', args.output)
+    return rows
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='bots.py')
+    parser.add_argument('--server', type=str, default=':1747', help='Server @<IP>:<PORT>')
+    parser.add_argument('--players', type=int, default=1000, help='Number of bots')
+    parser.add_argument('--duration', type=float, default=60., help='Seconds to play after joining')
+    parser.add_argument('--join_timeout', type=float, default=30., help='Seconds to wait for the bots to join')
+    parser.add_argument('--ai_delay', type=float, default=CLIENT_AI_DELAY, help='Milliseconds between two decisions of a bot, CLIENT_AI_DELAY of the client')
+    parser.add_argument('--slices', type=int, default=10, help='Groups of bots deciding in turn over --ai_delay')
+    parser.add_argument('--waypoints', type=int, default=16, help='Exploration targets shared by the bots, each costs a distance field')
+    parser.add_argument('--compressed', action='store_true', help='The server was built with -D__COMPRESSED_MESSAGES__')
+    parser.add_argument('--report', type=float, default=5., help='Seconds between reports')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the exploration waypoints and of the bot choices')
+    parser.add_argument('--output', type=str, help='CSV file to write the reports into')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    print('Info:', args)
+    print('Info:')
+    run(args)
@@ -0,0 +1,434 @@
+#!/usr/bin/python3
+
+import argparse
+import csv
+import os
+import random
+import selectors
+import sys
+import tempfile
+import threading
+import time
+
+import bench_server
+import protocol
+
+
+ARRIVALS = ['poisson', 'constant', 'pareto']
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def num_fmt(num):
+    return f'{num:,}'
+
+
+def interarrival(arrival, rate, rng, shape):
+    '''
+    Seconds to the next churn event of an arrival process with rate events/s on average
+    pareto is heavy tailed: mostly short gaps with the odd long one, so events come in bursts
+    '''
+    if arrival == 'poisson':
+        return rng.expovariate(rate)
+    if arrival == 'pareto':
+        return (shape - 1.) / (shape * rate) * rng.paretovariate(shape)
+    return 1. / rate
+
+
+def percentile(values, q):
+    '''
+    Nearest rank percentile q of values, nan if empty
+    '''
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100. * len(values)))]
+
+
+class ChurnSwarm:
+    '''
+    Synthetic players that come and go, one socket each so every join is a new player to the server
+    A background thread drains server messages and records the time from the first JOIN or LEAVE to its answer
+    A JOIN that timed out keeps its socket: the server may still add the player, who then sends LEAVE right away
+    '''
+    def __init__(self, server_address):
+        self.__server_address = server_address
+        self.__lock = threading.Lock()
+        self.__selector = selectors.DefaultSelector()
+        # Players that sent JOIN without an answer yet, joined players that can leave, players that sent LEAVE
+        self.__pending = list()
+        self.__active = list()
+        self.__leaving = list()
+        # Players whose JOIN timed out, kept until the server's late answer is handled or timeout passes again
+        self.__abandoned = list()
+        # One record per join or leave: {'kind', 'sent', 'latency', 'retries', 'outcome'}
+        self.__records = list()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__drain, daemon=True)
+        self.__thread.start()
+
+    def __drain(self):
+        while self.__running:
+            for key, _ in self.__selector.select(0.1):
+                player = key.data
+                while True:
+                    try:
+                        data, address = key.fileobj.recvfrom(protocol.MAX_UDP_PACKET_SIZE)
+                    except (BlockingIOError, ConnectionRefusedError):
+                        break
+                    except OSError:
+                        break
+                    now = time.time()
+                    player['server_address'] = address
+                    message_type = protocol.unpack_header(data)[0]
+                    with self.__lock:
+                        if message_type == protocol.MESSAGE_SC_OK_JOIN and player['state'] == 'pending':
+                            self.__finish(player, 'ok', now)
+                            self.__pending.remove(player)
+                            player['state'] = 'active'
+                            self.__active.append(player)
+                        elif message_type == protocol.MESSAGE_SC_NOK_JOIN and player['state'] == 'pending':
+                            self.__finish(player, 'nok', now)
+                            self.__pending.remove(player)
+                            self.__close(player)
+                        elif message_type == protocol.MESSAGE_SC_OK_LEAVE and player['state'] == 'leaving':
+                            self.__finish(player, 'ok', now)
+                            self.__leaving.remove(player)
+                            self.__close(player)
+                        elif message_type == protocol.MESSAGE_SC_OK_JOIN and player['state'] == 'abandoned':
+                            # Late join of a timed out player, take it out of the world again
+                            player['state'] = 'draining'
+                            player['last_sent'] = now
+                            self.__send(player, protocol.MESSAGE_CS_LEAVE)
+                        elif (message_type == protocol.MESSAGE_SC_NOK_JOIN and player['state'] == 'abandoned') or \
+                             (message_type == protocol.MESSAGE_SC_OK_LEAVE and player['state'] == 'draining'):
+                            self.__abandoned.remove(player)
+                            self.__close(player)
+                    if player['state'] == 'closed':
+                        break
+
+    def __finish(self, player, outcome, now):
+        record = player['record']
+        record['latency'] = now - record['sent']
+        record['outcome'] = outcome
+
+    def __close(self, player):
+        player['state'] = 'closed'
+        self.__selector.unregister(player['sock'])
+        player['sock'].close()
+
+    def __send(self, player, message_type):
+        try:
+            player['sock'].sendto(protocol.pack_message(message_type), player['server_address'])
+        except OSError:
+            pass
+
+    def join(self):
+        '''
+        A new player sends JOIN
+        '''
+        sock = protocol.open_udp_socket(buffer_size=1 << 16)
+        now = time.time()
+        player = {'sock': sock, 'server_address': self.__server_address, 'state': 'pending', 'last_sent': now,
+                  'record': {'kind': 'join', 'sent': now, 'latency': None, 'retries': 0, 'outcome': None}}
+        with self.__lock:
+            self.__records.append(player['record'])
+            self.__pending.append(player)
+            self.__selector.register(sock, selectors.EVENT_READ, player)
+        self.__send(player, protocol.MESSAGE_CS_JOIN)
+
+    def leave(self, rng):
+        '''
+        A random joined player sends LEAVE, False if no player is joined
+        '''
+        with self.__lock:
+            if not self.__active:
+                return False
+            idx = rng.randrange(len(self.__active))
+            self.__active[idx], self.__active[-1] = self.__active[-1], self.__active[idx]
+            player = self.__active.pop()
+            now = time.time()
+            player['state'] = 'leaving'
+            player['last_sent'] = now
+            player['record'] = {'kind': 'leave', 'sent': now, 'latency': None, 'retries': 0, 'outcome': None}
+            self.__records.append(player['record'])
+            self.__leaving.append(player)
+        self.__send(player, protocol.MESSAGE_CS_LEAVE)
+        return True
+
+    def move(self, rng, count):
+        '''
+        count random joined players send a random move
+        '''
+        with self.__lock:
+            players = [rng.choice(self.__active) for _ in range(count)] if self.__active else list()
+        for player in players:
+            self.__send(player, rng.choice(protocol.MOVE_MESSAGES))
+
+    def retry(self, interval, timeout):
+        '''
+        Resends JOIN unanswered for interval seconds, gives up on JOIN and LEAVE after timeout seconds
+        LEAVE is never resent, the server only knows the address until the first one is handled
+        '''
+        now = time.time()
+        resend = list()
+        with self.__lock:
+            for player in list(self.__pending):
+                if now - player['record']['sent'] > timeout:
+                    player['record']['outcome'] = 'timeout'
+                    self.__pending.remove(player)
+                    player['state'] = 'abandoned'
+                    player['last_sent'] = now
+                    self.__abandoned.append(player)
+                elif now - player['last_sent'] > interval:
+                    player['last_sent'] = now
+                    player['record']['retries'] += 1
+                    resend.append(player)
+            for player in list(self.__leaving):
+                if now - player['record']['sent'] > timeout:
+                    player['record']['outcome'] = 'timeout'
+                    self.__leaving.remove(player)
+                    self.__close(player)
+            for player in list(self.__abandoned):
+                if now - player['last_sent'] > timeout:
+                    self.__abandoned.remove(player)
+                    self.__close(player)
+        for player in resend:
+            self.__send(player, protocol.MESSAGE_CS_JOIN)
+
+    def get_population(self):
+        '''
+        (joined, pending joins, pending leaves)
+        '''
+        with self.__lock:
+            return len(self.__active), len(self.__pending), len(self.__leaving)
+
+    def get_records(self):
+        with self.__lock:
+            return list(self.__records)
+
+    def close(self):
+        with self.__lock:
+            players = list(self.__active)
+        for player in players:
+            self.__send(player, protocol.MESSAGE_CS_LEAVE)
+        time.sleep(0.5)
+        self.__running = False
+        self.__thread.join()
+        with self.__lock:
+            for player in self.__pending + self.__active + self.__leaving + self.__abandoned:
+                self.__close(player)
+        self.__selector.close()
+
+
+def hold(swarm, args, rng, target, rate, duration):
+    '''
+    Keeps target players joined for duration seconds while rate players/s leave and as many new ones join
+    rate 0 only tops the population up
+    '''
+    start = time.time()
+    next_event = start + (interarrival(args.arrival, rate, rng, args.pareto_shape) if rate > 0 else duration)
+    last_move = start
+    while True:
+        now = time.time()
+        if now >= start + duration:
+            break
+        joined, pending, _ = swarm.get_population()
+        # Failed joins are replaced right away, the churn events only swap players
+        for _ in range(max(0, min(target - joined - pending, args.batch))):
+            swarm.join()
+        while now >= next_event:
+            if swarm.leave(rng):
+                swarm.join()
+            next_event += interarrival(args.arrival, rate, rng, args.pareto_shape)
+        if args.move_rate > 0:
+            swarm.move(rng, int(joined * args.move_rate * (now - last_move) + rng.random()))
+            last_move = now
+        swarm.retry(args.retry, args.join_timeout)
+        time.sleep(args.batch_ms / 1000.)
+
+
+def summarize_records(records, begin, end):
+    '''
+    Join and leave stats of the requests sent in [begin, end)
+    '''
+    summary = dict()
+    for kind in ['join', 'leave']:
+        selected = [record for record in records if record['kind'] == kind and begin <= record['sent'] < end and record['outcome'] is not None]
+        latencies = [record['latency'] * 1000. for record in selected if record['outcome'] == 'ok']
+        summary[kind + '_count'] = len(selected)
+        summary[kind + '_rate'] = len(latencies) / (end - begin)
+        summary[kind + '_failed_pct'] = (len(selected) - len(latencies)) / len(selected) * 100. if selected else 0.
+        summary[kind + '_retries'] = sum(record['retries'] for record in selected)
+        for q in [50, 90, 99]:
+            summary[kind + '_p' + str(q)] = percentile(latencies, q)
+        summary[kind + '_max'] = max(latencies) if latencies else float('nan')
+    return summary
+
+
+def sweep_rates(args):
+    if args.rates:
+        return sorted(args.rates)
+    rates = list()
+    rate = args.start_rate
+    while rate <= args.stop_rate:
+        rates.append(rate)
+        rate *= args.factor
+    return rates
+
+
+def run_threads(args, threads, rates, work_dir):
+    '''
+    (steps, records) of the churn sweep against a server with threads world update threads
+    '''
+    server_args = argparse.Namespace(**vars(args))
+    server_args.threads = threads
+    server = bench_server.start_server(server_args, work_dir)
+    time.sleep(1.)
+    if server.poll() is not None:
+        print('Error:', 'The server exited, see', os.path.join(work_dir, 'server.log'))
+        sys.exit(1)
+
+    rng = random.Random(args.seed)
+    swarm = ChurnSwarm(('127.0.0.1', args.port))
+    print('Info:', 'Joining', args.players, 'players')
+    hold(swarm, args, rng, args.players, 0., args.ramp)
+    joined, pending, _ = swarm.get_population()
+    print('Info:', joined, 'of', args.players, 'players joined,', pending, 'still pending')
+    if joined == 0:
+        swarm.close()
+        bench_server.stop_server(server, work_dir)
+        print('Error:', 'No player could join')
+        sys.exit(1)
+
+    steps = list()
+    for rate in rates:
+        start = time.time()
+        hold(swarm, args, rng, args.players, rate, args.step_duration)
+        end = time.time()
+        step = {'threads': threads, 'rate': rate, 'window': (start + args.warmup, end)}
+        # Joins still unanswered are left out until the sweep is over
+        step.update(summarize_records(swarm.get_records(), *step['window']))
+        step['population'] = swarm.get_population()[0]
+        steps.append(step)
+        print('Info:', '    ' + float_fmt(rate), 'leaves+joins/s requested,', float_fmt(step['join_rate']), 'joins/s answered, join p50/p99', float_fmt(step['join_p50']) + '/' + float_fmt(step['join_p99']), 'ms,', float_fmt(step['join_failed_pct']) + '% failed,', step['population'], 'joined')
+        time.sleep(args.cooldown)
+
+    # Let the joins of the last step be answered or time out, then count every step with all its joins
+    hold(swarm, args, rng, args.players, 0., args.join_timeout)
+    records = swarm.get_records()
+    for step in steps:
+        step.update(summarize_records(records, *step['window']))
+    swarm.close()
+    run_dir = bench_server.stop_server(server, work_dir)
+    print('Info:', 'Server metrics in', run_dir)
+    ticks = bench_server.load_ticks(run_dir)
+    for step in steps:
+        step.update(bench_server.summarize_step(ticks, step, args.update_interval))
+    return steps, records
+
+
+def main(args):
+    print('Info:', args)
+    print('Info:')
+    if args.arrival == 'pareto' and args.pareto_shape <= 1.:
+        print('Error:', '--pareto_shape must be above 1 for the arrivals to have a mean rate')
+        sys.exit(1)
+    protocol.raise_fd_limit(args.players * 2 + 256)
+    rates = sweep_rates(args)
+    work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix='simmud_churn_')
+
+    steps = list()
+    records = list()
+    for threads in args.threads:
+        print('Info:')
+        thread_dir = os.path.join(work_dir, 'threads_' + str(threads))
+        os.makedirs(thread_dir, exist_ok=True)
+        thread_steps, thread_records = run_threads(args, threads, rates, thread_dir)
+        steps.extend(thread_steps)
+        records.extend((threads, record) for record in thread_records)
+    report(steps, records, args)
+
+
+def report(steps, records, args):
+    columns = ['threads', 'rate', 'join_rate', 'join_p50', 'join_p90', 'join_p99', 'join_max', 'join_failed_pct', 'join_retries', 'leave_p99', 'leave_failed_pct', 'population', 'busy_pct', 'overrun_pct']
+    row_fmt = '{:>7} {:>8} {:>9} {:>8} {:>8} {:>8} {:>8} {:>11} {:>12} {:>9} {:>16} {:>10} {:>8} {:>11}'
+    print('Info:')
+    print('Info:', row_fmt.format(*columns))
+    for step in steps:
+        print('Info:', row_fmt.format(step['threads'], float_fmt(step['rate']), *[float_fmt(step[column]) for column in columns[2:8]], num_fmt(step['join_retries']),
+            float_fmt(step['leave_p99']), float_fmt(step['leave_failed_pct']), num_fmt(step['population']), float_fmt(step['busy_pct']), float_fmt(step['overrun_pct'])))
+
+    # Sustainable churn is the highest rate whose joins are answered in time and that does not make ticks overrun
+    print('Info:')
+    print('Info:', 'Sustainable churn with join p99 under', float_fmt(args.latency_slo), 'ms, under', float_fmt(args.failed_threshold) + '% failed joins and', float_fmt(args.overrun_threshold) + '% overrun ticks:')
+    summary = list()
+    for threads in args.threads:
+        healthy = [step for step in steps if step['threads'] == threads and step['join_p99'] <= args.latency_slo and step['join_failed_pct'] <= args.failed_threshold and step['overrun_pct'] <= args.overrun_threshold]
+        sustainable = max([step['rate'] for step in healthy] or [0.])
+        summary.append((threads, sustainable))
+        print('Info:', '    {:>2} threads: {:>10} players/s, {:>10} players/s per thread{}'.format(threads, float_fmt(sustainable), float_fmt(sustainable / threads), '' if healthy else ' (none of the rates)'))
+
+    if args.output:
+        with open(args.output, mode='w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for step in steps:
+                writer.writerow([step[column] for column in columns])
+            writer.writerow([])
+            writer.writerow(['threads', 'sustainable_rate', 'sustainable_rate_per_thread'])
+            for threads, sustainable in summary:
+                writer.writerow([threads, sustainable, sustainable / threads])
+        print('Info:', 'Sweep report written to', args.output)
+
+    if args.latencies:
+        with open(args.latencies, mode='w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['threads', 'kind', 'sent', 'latency_ms', 'retries', 'outcome'])
+            for threads, record in records:
+                writer.writerow([threads, record['kind'], '{:.6f}'.format(record['sent']), '' if record['latency'] is None else '{:.3f}'.format(record['latency'] * 1000.), record['retries'], record['outcome'] or 'unanswered'])
+        print('Info:', 'Every join and leave written to', args.latencies)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='churn.py')
+    parser.add_argument('--server', type=str, default='./server', help='Server binary')
+    parser.add_argument('--config', type=str, default='config_static_no_quest.ini', help='Template config, the benchmark overrides threads, interval and balance')
+    parser.add_argument('--port', type=int, default=1747, help='Local port of the server')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4], help='Numbers of WorldUpdateModule threads, one server and sweep each')
+    parser.add_argument('--update_interval', type=int, default=50, help='Regular update interval in ms')
+    parser.add_argument('--balance', type=str, default='static', help='Load balancing algorithm of the server')
+
+    parser.add_argument('--players', type=int, default=500, help='Population held during the sweep')
+    parser.add_argument('--ramp', type=float, default=10., help='Seconds to join the population before the sweep')
+    parser.add_argument('--arrival', type=str, default='poisson', choices=ARRIVALS, help='Arrival process of the churn events, each is a leave and a join')
+    parser.add_argument('--pareto_shape', type=float, default=1.5, help='Shape of --arrival pareto, burstier towards 1')
+    parser.add_argument('--move_rate', type=float, default=1., help='Moves per second of every joined player, 0 for churn alone')
+
+    parser.add_argument('--rates', type=float, nargs='+', help='Churn rates in players/s. Geometric --start_rate to --stop_rate by default')
+    parser.add_argument('--start_rate', type=float, default=5., help='First churn rate in players/s')
+    parser.add_argument('--stop_rate', type=float, default=1280., help='Last churn rate in players/s')
+    parser.add_argument('--factor', type=float, default=2., help='Ratio between consecutive rates')
+    parser.add_argument('--step_duration', type=float, default=10., help='Seconds per rate')
+    parser.add_argument('--warmup', type=float, default=1., help='Leading seconds of every step not measured')
+    parser.add_argument('--cooldown', type=float, default=1., help='Seconds between steps, still holding the population')
+    parser.add_argument('--retry', type=float, default=1., help='Seconds before resending an unanswered JOIN, LEAVE is sent once')
+    parser.add_argument('--join_timeout', type=float, default=5., help='Seconds before an unanswered JOIN or LEAVE counts as failed')
+    parser.add_argument('--batch', type=int, default=200, help='Most players joined at once while topping up the population')
+    parser.add_argument('--batch_ms', type=float, default=5., help='Milliseconds between scheduling rounds')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the arrivals and of the players chosen to leave')
+
+    parser.add_argument('--latency_slo', type=float, default=200., help='Join p99 in ms above which a churn rate is not sustainable')
+    parser.add_argument('--failed_threshold', type=float, default=1., help='Percentage of failed joins above which a churn rate is not sustainable')
+    parser.add_argument('--overrun_threshold', type=float, default=5., help='Percentage of ticks longer than 1.5 update intervals above which a churn rate is not sustainable')
+    parser.add_argument('--work_dir', type=str, help='Directory for the generated configs, server logs and metrics. A temporary one by default')
+    parser.add_argument('--output', type=str, help='CSV file to write the sweep report into')
+    parser.add_argument('--latencies', type=str, help='CSV file to write every join and leave into, with its latency')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
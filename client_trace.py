@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+
+import argparse
+import collections
+import selectors
+import struct
+import sys
+import time
+
+import protocol
+
+
+TRACE_MAGIC = b'SMTR\x01'
+# (client id, microseconds since the trace started, message type, payload length), then the payload
+# The payload is the packet past its message type, i.e. message_target for every MESSAGE_CS_*
+RECORD = struct.Struct('<IQBH')
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def num_fmt(num):
+    return f'{num:,}'
+
+
+class TraceWriter:
+    def __init__(self, path):
+        self.__file = open(path, mode='wb')
+        self.__file.write(TRACE_MAGIC)
+        self.__count = 0
+
+    def write(self, client_id, offset_us, message_type, payload):
+        self.__file.write(RECORD.pack(client_id, offset_us, message_type, len(payload)))
+        self.__file.write(payload)
+        self.__count += 1
+
+    def get_count(self):
+        return self.__count
+
+    def close(self):
+        self.__file.close()
+
+
+def read_trace(path):
+    '''
+    [(client id, offset in seconds, message type, payload)] in recording order
+    '''
+    with open(path, mode='rb') as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(path + ' is not a client trace')
+
+    records = list()
+    pos = len(TRACE_MAGIC)
+    while pos + RECORD.size <= len(data):
+        client_id, offset_us, message_type, length = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        if pos + length > len(data):
+            break
+        records.append((client_id, offset_us / 1e6, message_type, data[pos:pos+length]))
+        pos += length
+    if pos != len(data):
+        print('Warning:', path, 'is cut short. Dropped the incomplete last record')
+    return records
+
+
+class Flow:
+    '''
+    One client seen by the relay, with its own upstream socket so the server still tells clients apart by source port
+    '''
+    def __init__(self, client_id, client_address, upstream, server_address):
+        self.client_id = client_id
+        self.client_address = client_address
+        self.upstream = upstream
+        # Like the client, follow the address of the server thread that answered last
+        self.server_address = server_address
+
+
+class UDPRelay:
+    def __init__(self, listen_address, server_address, on_client_packet=None, on_server_packet=None, forward=None):
+        '''
+        on_client_packet(flow, data) is called on every client to server packet before it is forwarded
+        on_server_packet(flow, data) likewise for every server to client packet
+        forward(flow, to_server, data) takes over forwarding every packet, e.g. to send it later with send
+        '''
+        self.__server_address = server_address
+        self.__on_client_packet = on_client_packet
+        self.__on_server_packet = on_server_packet
+        self.__forward = forward if forward is not None else self.send
+        self.__listen = protocol.open_udp_socket(*listen_address)
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__listen, selectors.EVENT_READ, None)
+        self.__flows = dict()
+
+    def get_flows(self):
+        return list(self.__flows.values())
+
+    def __get_flow(self, client_address):
+        flow = self.__flows.get(client_address)
+        if flow is None:
+            upstream = protocol.open_udp_socket()
+            flow = Flow(len(self.__flows), client_address, upstream, self.__server_address)
+            self.__flows[client_address] = flow
+            self.__selector.register(upstream, selectors.EVENT_READ, flow)
+        return flow
+
+    def poll(self, timeout):
+        '''
+        Forward whatever arrives within timeout seconds in both directions
+        '''
+        for key, _ in self.__selector.select(timeout):
+            while True:
+                try:
+                    data, address = key.fileobj.recvfrom(protocol.MAX_UDP_PACKET_SIZE)
+                except (BlockingIOError, ConnectionRefusedError):
+                    break
+
+                if key.data is None: # client -> server
+                    flow = self.__get_flow(address)
+                    if self.__on_client_packet is not None:
+                        self.__on_client_packet(flow, data)
+                    self.__forward(flow, True, data)
+                else: # server -> client
+                    flow = key.data
+                    flow.server_address = address
+                    if self.__on_server_packet is not None:
+                        self.__on_server_packet(flow, data)
+                    self.__forward(flow, False, data)
+
+    def send(self, flow, to_server, data):
+        if to_server:
+            flow.upstream.sendto(data, flow.server_address)
+        else:
+            self.__listen.sendto(data, flow.client_address)
+
+    def close(self):
+        for flow in self.__flows.values():
+            flow.upstream.close()
+        self.__listen.close()
+        self.__selector.close()
+
+
+def record(args):
+    server_address = protocol.parse_address(args.server)
+    listen_address = protocol.parse_address(args.listen, default_host='0.0.0.0')
+    protocol.raise_fd_limit(4096)
+
+    writer = TraceWriter(args.output)
+    start = [None]
+    counts = collections.Counter()
+
+    def on_client_packet(flow, data):
+        message_type, _ = protocol.unpack_header(data)
+        if message_type not in protocol.CS_MESSAGES:
+            return
+        now = time.perf_counter()
+        if start[0] is None:
+            start[0] = now
+        writer.write(flow.client_id, int((now - start[0]) * 1e6), message_type, data[4:])
+        counts[message_type] += 1
+
+    relay = UDPRelay(listen_address, server_address, on_client_packet)
+    print('Info:', 'Relaying', args.listen, '->', args.server + '. Point the clients at', args.listen)
+    print('Info:', 'Recording into', args.output, 'until Ctrl-C' if args.duration is None else 'for ' + str(args.duration) + ' seconds')
+
+    deadline = None if args.duration is None else time.perf_counter() + args.duration
+    try:
+        while deadline is None or time.perf_counter() < deadline:
+            relay.poll(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        relay.close()
+        writer.close()
+
+    print('Info:')
+    print('Info:', 'Recorded', num_fmt(writer.get_count()), 'messages of', len(relay.get_flows()), 'clients')
+    for message_type, count in sorted(counts.items()):
+        print('Info:', '    ' + protocol.MESSAGE_NAMES[message_type], num_fmt(count))
+
+
+def info(args):
+    records = read_trace(args.trace)
+    if len(records) == 0:
+        print('Info:', args.trace, 'is empty')
+        return
+    duration = records[-1][1]
+    clients = set(record[0] for record in records)
+    counts = collections.Counter(record[2] for record in records)
+
+    print('Info:', args.trace)
+    print('Info:', len(clients), 'clients,', num_fmt(len(records)), 'messages over', float_fmt(duration), 'seconds,', float_fmt(len(records) / duration if duration else 0.), 'messages/s')
+    for message_type, count in sorted(counts.items()):
+        print('Info:', '    ' + protocol.MESSAGE_NAMES.get(message_type, str(message_type)), num_fmt(count))
+
+
+def schedule(records, speed, multiply, stagger):
+    '''
+    [(due in seconds, virtual client, packet)] sorted by due time
+    Copy c of client i is virtual client c * nclient + i, shifted by c * stagger seconds
+    '''
+    nclient = max(record[0] for record in records) + 1
+    events = list()
+    for copy in range(multiply):
+        for client_id, offset, message_type, payload in records:
+            events.append(((offset + copy * stagger) / speed, copy * nclient + client_id, struct.pack('<i', message_type) + payload))
+    events.sort(key=lambda event: event[0])
+    return events, nclient * multiply
+
+
+def replay(args):
+    records = read_trace(args.trace)
+    if len(records) == 0:
+        print('Error:', args.trace, 'is empty')
+        sys.exit(1)
+    server_address = protocol.parse_address(args.server)
+    events, nvclient = schedule(records, args.speed, args.multiply, args.stagger / 1000.)
+    print('Info:', 'Replaying', num_fmt(len(events)), 'messages of', nvclient, 'clients at', args.speed, 'x over', float_fmt(events[-1][0]), 'seconds to', args.server)
+
+    protocol.raise_fd_limit(nvclient + 64)
+    selector = selectors.DefaultSelector()
+    sockets = list()
+    for vclient in range(nvclient):
+        sock = protocol.open_udp_socket(buffer_size=args.buffer_size)
+        selector.register(sock, selectors.EVENT_READ, vclient)
+        sockets.append(sock)
+    server_addresses = [server_address] * nvclient
+    joined = [False] * nvclient
+
+    received = collections.Counter()
+    received_bytes = [0]
+    def drain(timeout):
+        for key, _ in selector.select(timeout):
+            while True:
+                try:
+                    data, address = key.fileobj.recvfrom(protocol.MAX_UDP_PACKET_SIZE)
+                except (BlockingIOError, ConnectionRefusedError):
+                    break
+                server_addresses[key.data] = address
+                received[protocol.unpack_header(data)[0]] += 1
+                received_bytes[0] += len(data)
+
+    lateness = list()
+    send_errors = 0
+    start = time.perf_counter()
+    idx = 0
+    try:
+        while idx < len(events):
+            now = time.perf_counter() - start
+            while idx < len(events) and events[idx][0] <= now:
+                due, vclient, packet = events[idx]
+                try:
+                    sockets[vclient].sendto(packet, server_addresses[vclient])
+                except OSError:
+                    send_errors += 1
+                joined[vclient] = packet[0] != protocol.MESSAGE_CS_LEAVE
+                lateness.append(now - due)
+                idx += 1
+            if idx == len(events):
+                break
+
+            # select() only sleeps in whole milliseconds, spin through the last one
+            wait = events[idx][0] - (time.perf_counter() - start)
+            drain(wait - 0.001 if wait > 0.002 else 0)
+    except KeyboardInterrupt:
+        print('Warning:', 'Interrupted after', num_fmt(idx), 'messages')
+
+    if not args.no_leave:
+        still_joined = [vclient for vclient in range(nvclient) if joined[vclient]]
+        print('Info:', 'Sending', protocol.MESSAGE_NAMES[protocol.MESSAGE_CS_LEAVE], 'for', len(still_joined), 'clients')
+        for vclient in still_joined:
+            sockets[vclient].sendto(protocol.pack_message(protocol.MESSAGE_CS_LEAVE), server_addresses[vclient])
+    linger_end = time.perf_counter() + args.linger
+    while time.perf_counter() < linger_end:
+        drain(0.05)
+    for sock in sockets:
+        sock.close()
+
+    lateness.sort()
+    print('Info:')
+    print('Info:', 'Sent', num_fmt(len(lateness)), 'messages,', num_fmt(send_errors), 'send errors')
+    if lateness:
+        percentile = lambda p: lateness[min(len(lateness) - 1, int(p / 100. * len(lateness)))] * 1000.
+        print('Info:', 'Lateness p50', float_fmt(percentile(50)), 'ms, p99', float_fmt(percentile(99)), 'ms, max', float_fmt(lateness[-1] * 1000.), 'ms')
+    print('Info:', 'Received', num_fmt(sum(received.values())), 'messages,', num_fmt(received_bytes[0]), 'bytes')
+    for message_type, count in sorted(received.items(), key=lambda item: (item[0] is None, item[0])):
+        print('Info:', '    ' + protocol.MESSAGE_NAMES.get(message_type, str(message_type)), num_fmt(count))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='client_trace.py')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_record = subparsers.add_parser('record', description='Relay clients to the server and record every MESSAGE_CS_* they send')
+    parser_record.add_argument('--server', type=str, default=':1747', help='Server @<IP>:<PORT>')
+    parser_record.add_argument('--listen', type=str, default=':1748', help='Relay @<IP>:<PORT> the clients are pointed at')
+    parser_record.add_argument('--output', type=str, required=True, help='Trace file to write')
+    parser_record.add_argument('--duration', type=float, default=None, help='Seconds to record. Until Ctrl-C by default')
+    parser_record.set_defaults(func=record)
+
+    parser_info = subparsers.add_parser('info', description='Summarize a trace')
+    parser_info.add_argument('trace', type=str, help='Trace file')
+    parser_info.set_defaults(func=info)
+
+    parser_replay = subparsers.add_parser('replay', description='Replay a trace at the server from this process')
+    parser_replay.add_argument('trace', type=str, help='Trace file')
+    parser_replay.add_argument('--server', type=str, default=':1747', help='Server @<IP>:<PORT>')
+    parser_replay.add_argument('--speed', type=float, default=1., help='Time scale, 2 replays twice as fast')
+    parser_replay.add_argument('--multiply', type=int, default=1, help='Replay every client trace this many times as distinct clients')
+    parser_replay.add_argument('--stagger', type=float, default=0., help='Milliseconds each extra copy of a client trace is shifted by')
+    parser_replay.add_argument('--buffer_size', type=int, default=1 << 18, help='Socket buffer size of every replayed client')
+    parser_replay.add_argument('--linger', type=float, default=1., help='Seconds to keep draining server messages after the trace')
+    parser_replay.add_argument('--no_leave', action='store_true', help='Do not send MESSAGE_CS_LEAVE for clients still in the game at the end')
+    parser_replay.set_defaults(func=replay)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    args.func(args)
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+import concurrent.futures
+import json
+import os
+import socket
+import time
+
+
+# Written by the launcher as metrics/clocks_<port>.json, the server moves it into its run directory on exit
+CLOCKS_FILENAME = 'clocks.json'
+
+# Echoes the wall clock of the host for every line read, one exec per burst of probes
+ECHO_COMMAND = 'python3 -u -c "import sys, time\nwhile sys.stdin.readline(): print(repr(time.time()), flush=True)"'
+
+
+def probe(machine, count=20, timeout=5.):
+    '''
+    [(sent, remote, received)] epoch seconds of count NTP style probes over machine.exec_command
+    sent and received are on the clock of this host, remote on the clock of machine
+    '''
+    stdin, stdout, _ = machine.exec_command(ECHO_COMMAND, get_pty=False)
+    stdout.channel.settimeout(timeout)
+    samples = list()
+    try:
+        for _ in range(count):
+            sent = time.time()
+            stdin.write('\n')
+            stdin.flush()
+            line = next(stdout)
+            received = time.time()
+            try:
+                samples.append((sent, float(line), received))
+            except ValueError:
+                # Login banners and the like
+                continue
+    except (socket.timeout, StopIteration, OSError):
+        pass
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+    return samples
+
+
+def estimate(samples):
+    '''
+    {'time', 'offset', 'uncertainty', 'rtt', 'samples'} in epoch seconds and seconds, None without samples
+    offset is remote clock minus local clock, from the probe with the shortest round trip
+    The true offset at time is within offset +- uncertainty unless the two legs of that round trip were lopsided by more
+    '''
+    if not samples:
+        return None
+    sent, remote, received = min(samples, key=lambda sample: sample[2] - sample[0])
+    middle = (sent + received) / 2.
+    return {'time': middle, 'offset': remote - middle, 'uncertainty': (received - sent) / 2., 'rtt': received - sent, 'samples': len(samples)}
+
+
+class ClockProbe:
+    '''
+    Offset of the clock of every machine of a MachineManager against this host, at the start and the end of a run
+    The drift between the two makes the offset known at any time in between
+    '''
+    def __init__(self, machine_manager, count=20, timeout=5.):
+        self.__machine_manager = machine_manager
+        self.__count = count
+        self.__timeout = timeout
+        # {machine_name: {'start': estimate, 'end': estimate}}
+        self.__estimates = dict()
+
+    def __probe_all(self):
+        def probe_machine(idx):
+            try:
+                return estimate(probe(self.__machine_manager.get_machine(idx), self.__count, self.__timeout))
+            except Exception as e:
+                print('Warning:', 'Could not probe the clock of', self.__machine_manager.get_machine_name(idx) + ':', e)
+                return None
+        indices = range(self.__machine_manager.get_num_machines())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            return dict(zip([self.__machine_manager.get_machine_name(idx) for idx in indices], executor.map(probe_machine, indices)))
+
+    def __record(self, when):
+        if self.__machine_manager.is_closed():
+            print('Warning:', 'The connections to the machines are closed, their clocks are not probed at the', when)
+            return
+        for machine_name, machine_estimate in self.__probe_all().items():
+            if machine_estimate is None:
+                print('Warning:', 'No clock probe of', machine_name, 'came back')
+                continue
+            self.__estimates.setdefault(machine_name, dict())[when] = machine_estimate
+
+    def start(self):
+        self.__record('start')
+
+    def end(self):
+        self.__record('end')
+
+    def get_clocks(self):
+        '''
+        {machine_name: {'offset', 'drift', 'time', 'uncertainty', 'start', 'end'}}
+        offset is at time, drift in seconds per second, 0 with a single estimate
+        '''
+        clocks = dict()
+        for machine_name, estimates in self.__estimates.items():
+            first = estimates.get('start', estimates.get('end'))
+            last = estimates.get('end', first)
+            span = last['time'] - first['time']
+            drift = (last['offset'] - first['offset']) / span if span > 0 else 0.
+            clocks[machine_name] = {
+                'offset': first['offset'],
+                'drift': drift,
+                'time': first['time'],
+                'uncertainty': max(first['uncertainty'], last['uncertainty']),
+                'start': estimates.get('start'),
+                'end': estimates.get('end'),
+            }
+        return clocks
+
+    def print_clocks(self):
+        clocks = self.get_clocks()
+        print('Info:', 'Clock offsets against', socket.gethostname())
+        for machine_name, clock in sorted(clocks.items()):
+            print('Info:', '    ', '{:<28} {:>+10.3f} ms +- {:.3f} ms, drift {:>+8.2f} ppm'.format(machine_name, clock['offset'] * 1000., clock['uncertainty'] * 1000., clock['drift'] * 1e6))
+
+    def write(self, port, metrics_dir='metrics'):
+        '''
+        Path of metrics_dir/clocks_<port>.json for the server on port to move into its run directory
+        '''
+        os.makedirs(metrics_dir, exist_ok=True)
+        path = os.path.join(metrics_dir, 'clocks_' + str(port) + '.json')
+        with open(path + '.tmp', mode='w') as f:
+            json.dump({'reference': socket.gethostname(), 'hosts': self.get_clocks()}, f, indent=4, sort_keys=True)
+        os.replace(path + '.tmp', path)
+        return path
@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+
+import atexit
+import collections
+import datetime
+import os
+import shutil
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except:
+    print('psutil is not installed. Try "pip install psutil"')
+
+
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+ESC = '\x1b['
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def sparkline(values, width):
+    '''
+    The last width values as one character each, scaled between their min and max
+    '''
+    values = list(values)[-width:]
+    if not values:
+        return ''
+    low, high = min(values), max(values)
+    span = high - low
+    if span <= 0:
+        return SPARK_CHARS[0] * len(values)
+    return ''.join(SPARK_CHARS[min(len(SPARK_CHARS) - 1, int((value - low) / span * len(SPARK_CHARS)))] for value in values)
+
+
+class LiveServerStats:
+    '''
+    Follows the metrics/live_<port>.csv the server rewrites every server.stats_interval seconds
+    The file is only parsed again when its mtime changes
+    '''
+    def __init__(self, path, history=600):
+        self.__path = path
+        self.__mtime = None
+        self.__rows = list()
+        self.__timestamp = None
+        # Update interval (request_time + update_time) of the slowest thread, one per dump
+        self.__intervals = collections.deque(maxlen=history)
+
+    def get_path(self):
+        return self.__path
+
+    def get_rows(self):
+        '''
+        [{column name: float}] one per thread
+        '''
+        return self.__rows
+
+    def get_intervals(self):
+        return self.__intervals
+
+    def get_age(self):
+        '''
+        Seconds since the server last dumped, None before the first dump
+        '''
+        return time.time() - self.__timestamp / 1000. if self.__timestamp is not None else None
+
+    def poll(self):
+        try:
+            mtime = os.stat(self.__path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self.__mtime:
+            return False
+        self.__mtime = mtime
+
+        try:
+            with open(self.__path) as f:
+                header = f.readline().split()
+                rows = [dict(zip(header, map(float, line.strip().split(',')))) for line in f if line.strip()]
+        except (OSError, ValueError):
+            return False
+        rows = [row for row in rows if len(row) == len(header)]
+        if not rows:
+            return False
+        self.__rows = rows
+        self.__timestamp = rows[0]['timestamp']
+        self.__intervals.append(max(row['request_time'] + row['update_time'] for row in rows) / 1000.)
+        return True
+
+
+class Dashboard:
+    '''
+    Live view pinned to the top of the terminal, redrawn from a background thread
+    The rest of the terminal is an ANSI scrolling region, so the command prompt keeps working below it
+    '''
+    def __init__(self, ssh_manager, time, live_stats_path=None, refresh=1.0):
+        '''
+        time = (launch_time, termination_time=None)
+        '''
+        self.__ssh_manager = ssh_manager
+        self.__time = time
+        self.__live_stats = LiveServerStats(live_stats_path) if live_stats_path else None
+        self.__refresh = refresh
+        self.__height = None
+        self.__size = None
+        self.__running = False
+        self.__thread = None
+        self.__lock = threading.Lock()
+        # The --duration killer exits without leaving the prompt, give the terminal its scrolling back
+        atexit.register(self.stop)
+
+    def is_running(self):
+        return self.__running
+
+    def start(self):
+        if self.__running:
+            return
+        self.__running = True
+        if 'psutil' in globals():
+            psutil.cpu_percent() # The first call only starts the measurement
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        if not self.__running:
+            return
+        self.__running = False
+        self.__thread.join()
+        with self.__lock:
+            columns, rows = shutil.get_terminal_size()
+            sys.stdout.write(ESC + 'r' + ESC + str(rows) + ';1H')
+            sys.stdout.flush()
+        self.__height = None
+
+    def __run(self):
+        while self.__running:
+            if self.__live_stats is not None:
+                self.__live_stats.poll()
+            self.draw(self.render())
+            time.sleep(self.__refresh)
+
+    def render(self):
+        width = shutil.get_terminal_size().columns
+        lines = list()
+
+        now = datetime.datetime.now()
+        launch_time, termination_time = self.__time
+        line = 'SimMud  ' + now.strftime('%H:%M:%S') + '  elapsed ' + str(datetime.timedelta(seconds=int((now - launch_time).total_seconds())))
+        if termination_time is not None:
+            line += '  terminating in ' + str(datetime.timedelta(seconds=max(0, int((termination_time - now).total_seconds()))))
+        lines.append(line)
+
+        if 'psutil' in globals():
+            ram = psutil.virtual_memory()
+            load = os.getloadavg() if hasattr(os, 'getloadavg') else psutil.getloadavg()
+            lines.append('Local   CPU ' + str(psutil.cpu_percent()) + '%  load ' + ' '.join(float_fmt(value) for value in load) + '  RAM ' + str(ram.percent) + '%')
+
+        # refresh_ioe only looks at the local end of the SSH channels
+        self.__ssh_manager.refresh_ioe()
+        states = self.__ssh_manager.get_states()
+        cells = list()
+        for name, running, count in states:
+            cells.append('{:<22}'.format(name.split('.')[0] + (' ' + str(count) if running else ' -')))
+        total = sum(count for _, _, count in states)
+        running_machines = sum(running for _, running, _ in states)
+        lines.append('Clients ' + str(total) + ' on ' + str(running_machines) + '/' + str(len(states)) + ' machines running')
+        per_line = max(1, width // 22)
+        for start in range(0, len(cells), per_line):
+            lines.append('  ' + ''.join(cells[start:start+per_line]))
+
+        if self.__live_stats is not None:
+            rows = self.__live_stats.get_rows()
+            age = self.__live_stats.get_age()
+            if not rows:
+                lines.append('Server  waiting for ' + self.__live_stats.get_path())
+            else:
+                lines.append('Server  ' + str(int(sum(row['players'] for row in rows))) + ' players' + ('  STALE ' + str(int(age)) + 's' if age is not None and age > 5 else ''))
+                lines.append('  {:>6} {:>8} {:>9} {:>10} {:>10} {:>9}'.format('thread', 'players', 'requests', 'request_ms', 'update_ms', 'avg_rui'))
+                for row in rows:
+                    lines.append('  {:>6} {:>8} {:>9} {:>10} {:>10} {:>9}'.format(int(row['thread']), int(row['players']), int(row['request_number']), float_fmt(row['request_time'] / 1000.), float_fmt(row['update_time'] / 1000.), float_fmt(row['avg_rui'])))
+                intervals = self.__live_stats.get_intervals()
+                label = '  interval ' + float_fmt(intervals[-1]) + ' ms (max ' + float_fmt(max(intervals)) + ') '
+                lines.append(label + sparkline(intervals, max(1, width - len(label) - 1)))
+
+        lines.append('-' * width)
+        return [line[:width] for line in lines]
+
+    def draw(self, lines):
+        with self.__lock:
+            size = shutil.get_terminal_size()
+            out = list()
+            if len(lines) != self.__height or size != self.__size:
+                # Everything below the dashboard scrolls, the prompt lives at the bottom
+                out.append(ESC + '2J' + ESC + str(len(lines) + 1) + ';' + str(size.lines) + 'r' + ESC + str(size.lines) + ';1H')
+                self.__height = len(lines)
+                self.__size = size
+            out.append('\x1b7')
+            for row, line in enumerate(lines):
+                out.append(ESC + str(row + 1) + ';1H' + ESC + '2K' + line)
+            out.append('\x1b8')
+            sys.stdout.write(''.join(out))
+            sys.stdout.flush()
@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+
+import argparse
+import collections
+import csv
+import heapq
+import random
+import signal
+import time
+
+import client_trace
+import protocol
+
+
+# Defaults of an impairment spec: delay and jitter in ms, loss and reorder in %, rate in kbit/s (0 for no limit), burst in bytes, queue in ms
+SPEC_DEFAULTS = {'delay': 0., 'jitter': 0., 'dist': 'constant', 'shape': 2.5, 'loss': 0., 'loss_burst': 1., 'reorder': 0., 'rate': 0., 'burst': 16384., 'queue': 200.}
+DISTRIBUTIONS = ['constant', 'uniform', 'normal', 'pareto']
+DIRECTIONS = ['up', 'down']
+COUNTERS = ['packets', 'bytes', 'lost', 'queue_drops', 'reordered', 'forwarded', 'send_errors']
+
+
+def float_fmt(num):
+    return '{:.2f}'.format(num)
+
+
+def num_fmt(num):
+    return f'{num:,}'
+
+
+def parse_spec(spec):
+    '''
+    {key: value} of 'key=value,...' over SPEC_DEFAULTS, e.g. delay=40,jitter=10,dist=normal,loss=1,rate=512
+    '''
+    impairment = dict(SPEC_DEFAULTS)
+    for item in filter(None, spec.split(',')):
+        key, _, value = item.partition('=')
+        if key not in SPEC_DEFAULTS or not value:
+            raise ValueError(item + ' is not one of ' + ', '.join(key + '=' for key in SPEC_DEFAULTS))
+        impairment[key] = value if key == 'dist' else float(value)
+    if impairment['dist'] not in DISTRIBUTIONS:
+        raise ValueError('dist is one of ' + ', '.join(DISTRIBUTIONS))
+    if not 0. <= impairment['loss'] < 100. or not 0. <= impairment['reorder'] <= 100.:
+        raise ValueError('loss and reorder are percentages, loss below 100')
+    if impairment['loss_burst'] < 1. or impairment['shape'] <= 1.:
+        raise ValueError('loss_burst is at least 1 packet and shape above 1')
+    return impairment
+
+
+def is_identity(impairment):
+    return impairment['delay'] == 0. and impairment['jitter'] == 0. and impairment['loss'] == 0. and impairment['reorder'] == 0. and impairment['rate'] == 0.
+
+
+def sample_delay(impairment, rng):
+    '''
+    Seconds a packet spends on the link past the shaper
+    Jitter is the half width of uniform, the standard deviation of normal and the mean excess of pareto
+    '''
+    delay = impairment['delay'] / 1000.
+    jitter = impairment['jitter'] / 1000.
+    if impairment['dist'] == 'uniform':
+        delay += rng.uniform(-jitter, jitter)
+    elif impairment['dist'] == 'normal':
+        delay = rng.gauss(delay, jitter)
+    elif impairment['dist'] == 'pareto':
+        shape = impairment['shape']
+        delay += jitter * (shape - 1) * (rng.paretovariate(shape) - 1)
+    return max(0., delay)
+
+
+class Link:
+    '''
+    One direction of one client flow: losses, a token bucket shaper and the delay of an impairment
+    Losses come in bursts of loss_burst packets on average (Gilbert-Elliott), loss % of the packets overall
+    The token bucket is kept as its theoretical arrival time (GCRA), a packet waits until the bucket holds its bytes
+    and is dropped when that is more than queue ms
+    Reordered packets skip the delay and overtake the ones on the link, as with netem. Jitter reorders packets too
+    '''
+    def __init__(self, impairment, counters, interval):
+        self.__impairment = impairment
+        self.__counters = counters
+        self.__interval = interval
+        loss = impairment['loss'] / 100.
+        self.__loss = loss
+        self.__to_good = 1. / impairment['loss_burst']
+        self.__to_bad = loss * self.__to_good / (1. - loss)
+        self.__bad = False
+        self.__rate = impairment['rate'] * 1000. / 8.
+        self.__tat = 0.
+
+    def schedule(self, now, size, rng):
+        '''
+        Time the packet leaves the link, or None when it is lost or dropped by the shaper
+        '''
+        impairment = self.__impairment
+        counters = self.__counters
+        counters['packets'] += 1
+        counters['bytes'] += size
+
+        if self.__loss > 0.:
+            if impairment['loss_burst'] > 1.:
+                self.__bad = rng.random() >= self.__to_good if self.__bad else rng.random() < self.__to_bad
+                lost = self.__bad
+            else:
+                lost = rng.random() < self.__loss
+            if lost:
+                counters['lost'] += 1
+                return None
+
+        depart = now
+        if self.__rate > 0.:
+            tat = max(self.__tat, now)
+            depart = max(now, tat - impairment['burst'] / self.__rate)
+            if depart - now > impairment['queue'] / 1000.:
+                counters['queue_drops'] += 1
+                return None
+            self.__tat = tat + size / self.__rate
+            self.__interval['wait_sum'] += depart - now
+
+        if impairment['reorder'] > 0. and rng.random() * 100. < impairment['reorder']:
+            counters['reordered'] += 1
+            due = depart
+        else:
+            due = depart + sample_delay(impairment, rng)
+        self.__interval['delay_sum'] += due - now
+        self.__interval['delay_count'] += 1
+        self.__interval['delay_max'] = max(self.__interval['delay_max'], due - now)
+        return due
+
+
+class ImpairmentProxy:
+    '''
+    client_trace.UDPRelay holding every packet back as the impairment of its direction says
+    Packets on the way sit in one heap by due time. Every wake up reads each ready socket until it would block and
+    sends everything that fell due, and the next wake up is set to the next due packet
+    '''
+    def __init__(self, listen_address, server_address, impairments, seed):
+        '''
+        impairments {'up': spec, 'down': spec} from parse_spec, None forwards right away
+        '''
+        self.__impairments = {direction: impairment if impairment is not None and not is_identity(impairment) else None for direction, impairment in impairments.items()}
+        self.__rng = random.Random(seed)
+        self.__links = dict()
+        self.__heap = list()
+        self.__seq = 0
+        self.counters = {direction: collections.Counter() for direction in DIRECTIONS}
+        self.intervals = {direction: collections.Counter() for direction in DIRECTIONS}
+        self.__relay = client_trace.UDPRelay(listen_address, server_address, forward=self.__forward)
+
+    def get_flows(self):
+        return self.__relay.get_flows()
+
+    def get_in_flight(self):
+        return len(self.__heap)
+
+    def __forward(self, flow, to_server, data):
+        direction = DIRECTIONS[0] if to_server else DIRECTIONS[1]
+        impairment = self.__impairments[direction]
+        if impairment is None:
+            self.counters[direction]['packets'] += 1
+            self.counters[direction]['bytes'] += len(data)
+            self.__send(flow, to_server, data, direction)
+            return
+
+        link = self.__links.get((flow.client_id, to_server))
+        if link is None:
+            link = Link(impairment, self.counters[direction], self.intervals[direction])
+            self.__links[(flow.client_id, to_server)] = link
+        due = link.schedule(time.perf_counter(), len(data), self.__rng)
+        if due is not None:
+            # seq keeps packets due at the same time in arrival order
+            heapq.heappush(self.__heap, (due, self.__seq, flow, to_server, data))
+            self.__seq += 1
+
+    def __send(self, flow, to_server, data, direction):
+        try:
+            self.__relay.send(flow, to_server, data)
+            self.counters[direction]['forwarded'] += 1
+        except OSError:
+            self.counters[direction]['send_errors'] += 1
+
+    def poll(self, timeout):
+        '''
+        Relay and send what falls due within timeout seconds
+        '''
+        deadline = time.perf_counter() + timeout
+        while True:
+            now = time.perf_counter()
+            while self.__heap and self.__heap[0][0] <= now:
+                _, _, flow, to_server, data = heapq.heappop(self.__heap)
+                self.__send(flow, to_server, data, DIRECTIONS[0] if to_server else DIRECTIONS[1])
+            if now >= deadline:
+                return
+            wait = deadline - now
+            if self.__heap:
+                wait = min(wait, self.__heap[0][0] - now)
+            # select() only sleeps in whole milliseconds, spin through the last one
+            self.__relay.poll(wait - 0.001 if wait > 0.002 else 0)
+
+    def close(self):
+        self.__relay.close()
+
+
+def take_stats(proxy, elapsed):
+    '''
+    [{column: value}] per direction, counters since the start and delays over the interval, which starts anew
+    '''
+    rows = list()
+    for direction in DIRECTIONS:
+        counters = proxy.counters[direction]
+        interval = proxy.intervals[direction]
+        row = {'time': elapsed, 'direction': direction, 'flows': len(proxy.get_flows()), 'in_flight': proxy.get_in_flight()}
+        row.update({name: counters[name] for name in COUNTERS})
+        row['delay_mean_ms'] = interval['delay_sum'] * 1000. / interval['delay_count'] if interval['delay_count'] else 0.
+        row['delay_max_ms'] = interval['delay_max'] * 1000.
+        row['wait_mean_ms'] = interval['wait_sum'] * 1000. / interval['delay_count'] if interval['delay_count'] else 0.
+        interval.clear()
+        rows.append(row)
+    return rows
+
+
+def print_stats(rows):
+    for row in rows:
+        print('Info:', '{:>8} s {:>4} {:>12} packets {:>10} lost {:>10} queue drops {:>10} reordered {:>8} in flight, delay {:>8} ms (max {:>8}), shaper wait {:>8} ms'.format(
+            float_fmt(row['time']), row['direction'], num_fmt(row['packets']), num_fmt(row['lost']), num_fmt(row['queue_drops']), num_fmt(row['reordered']),
+            num_fmt(row['in_flight']), float_fmt(row['delay_mean_ms']), float_fmt(row['delay_max_ms']), float_fmt(row['wait_mean_ms'])))
+
+
+def main(args):
+    impairments = dict()
+    for direction, spec in zip(DIRECTIONS, [args.up, args.down]):
+        spec = spec if spec is not None else args.both
+        try:
+            impairments[direction] = parse_spec(spec) if spec is not None else None
+        except ValueError as e:
+            print('Error:', direction, 'impairment:', e)
+            return
+        print('Info:', direction, 'impairment:', 'none' if impairments[direction] is None else ', '.join(key + '=' + str(value) for key, value in impairments[direction].items()))
+
+    protocol.raise_fd_limit(4096)
+    proxy = ImpairmentProxy(protocol.parse_address(args.listen, default_host='0.0.0.0'), protocol.parse_address(args.server), impairments, args.seed)
+    print('Info:', 'Relaying', args.listen, '->', args.server + '. Point the clients at', args.listen)
+
+    stats_file = open(args.stats, mode='a', newline='') if args.stats else None
+    writer = None
+    def report(rows):
+        nonlocal writer
+        print_stats(rows)
+        if stats_file is not None:
+            if writer is None:
+                writer = csv.DictWriter(stats_file, fieldnames=list(rows[0].keys()))
+                # Appending to the counters of an earlier proxy, the header is already there
+                if stats_file.tell() == 0:
+                    writer.writeheader()
+            writer.writerows(rows)
+            stats_file.flush()
+
+    # super.py stops the proxy with SIGTERM, it ends like Ctrl-C and writes its last counters
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    start = last_report = time.perf_counter()
+    try:
+        while args.duration is None or time.perf_counter() - start < args.duration:
+            proxy.poll(0.1)
+            now = time.perf_counter()
+            if now - last_report >= args.report:
+                report(take_stats(proxy, now - start))
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.close()
+
+    print('Info:')
+    report(take_stats(proxy, time.perf_counter() - start))
+    if stats_file is not None:
+        stats_file.close()
+        print('Info:', 'Counters written to', args.stats)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='impair.py')
+    parser.add_argument('--server', type=str, default=':1747', help='Server @<IP>:<PORT>')
+    parser.add_argument('--listen', type=str, default=':1748', help='Proxy @<IP>:<PORT> the clients are pointed at')
+    spec_help = 'Comma separated key=value of ' + ', '.join(key + ' (' + str(value) + ')' for key, value in SPEC_DEFAULTS.items()) + '. delay and jitter in ms, dist one of ' + ', '.join(DISTRIBUTIONS) + ', loss and reorder in %%, loss_burst in packets, rate in kbit/s, burst in bytes, queue in ms'
+    parser.add_argument('--up', type=str, default=None, help='Impairment of every client to server flow. ' + spec_help)
+    parser.add_argument('--down', type=str, default=None, help='Impairment of every server to client flow, as --up')
+    parser.add_argument('--both', type=str, default=None, help='Impairment of the directions without --up or --down')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds to relay. Until Ctrl-C or SIGTERM by default')
+    parser.add_argument('--report', type=float, default=10., help='Seconds between counter reports')
+    parser.add_argument('--stats', type=str, default=None, help='CSV file the counters of every report are appended to')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the losses, delays and reordering')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+import configparser
+import json
+import os
+import time
+
+try:
+    import psutil
+except:
+    print('psutil is not installed. Try "pip install psutil"')
+
+
+# The server names its world update threads wu<thread id>
+SERVER_THREAD_PREFIX = 'wu'
+# Written by the launcher as metrics/placement_<port>.json, the server moves it into its run directory on exit
+PLACEMENT_FILENAME = 'placement.json'
+
+
+def parse_cpu_list(text):
+    '''
+    '0-3,8' -> [0, 1, 2, 3, 8], the format of taskset -c and of /sys/devices/system/cpu
+    '''
+    cpus = list()
+    for part in text.strip().split(','):
+        if part:
+            first, _, last = part.partition('-')
+            cpus.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(cpus))
+
+
+def format_cpu_list(cpus):
+    '''
+    [0, 1, 2, 3, 8] -> '0-3,8'
+    '''
+    parts = list()
+    for cpu in sorted(cpus):
+        if parts and parts[-1][1] == cpu - 1:
+            parts[-1][1] = cpu
+        else:
+            parts.append([cpu, cpu])
+    return ','.join(str(first) if first == last else str(first) + '-' + str(last) for first, last in parts)
+
+
+def get_siblings(cpu):
+    '''
+    Logical cpus sharing the physical core of cpu, cpu included
+    '''
+    try:
+        with open('/sys/devices/system/cpu/cpu' + str(cpu) + '/topology/thread_siblings_list') as f:
+            return parse_cpu_list(f.read())
+    except (OSError, ValueError):
+        return [cpu]
+
+
+def split_cpus(cpus, num_machines):
+    '''
+    [cpus of every machine], contiguous sets that are shared round robin when there are more machines than cpus
+    '''
+    if num_machines >= len(cpus):
+        return [[cpus[idx % len(cpus)]] for idx in range(num_machines)]
+    bounds = [int(idx * len(cpus) / num_machines) for idx in range(num_machines + 1)]
+    return [cpus[begin:end] for begin, end in zip(bounds[:-1], bounds[1:])]
+
+
+def get_num_server_threads(config_path):
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return int(config['Server']['server.number_of_threads'])
+
+
+def plan(num_threads, num_machines=0, num_spare=1, cpus=None):
+    '''
+    CPU placement of a server with num_threads world update threads and of the clients of num_machines local virtual hosts
+    Every world update thread gets a physical core of its own, the other threads of the server (main, live statistics) share num_spare more
+    The hyperthread siblings of those cores stay idle and the clients get the rest
+    When there are not enough cores, the server threads and the clients all run everywhere, which is recorded in warnings
+    '''
+    cpus = sorted(os.sched_getaffinity(0)) if cpus is None else sorted(cpus)
+    free = list(cpus)
+    def take_core():
+        cpu = free[0]
+        siblings = [sibling for sibling in get_siblings(cpu) if sibling in free]
+        for sibling in siblings:
+            free.remove(sibling)
+        return cpu, siblings
+
+    placement = {'cpus': cpus, 'server': list(), 'threads': dict(), 'idle': list(), 'clients': list(), 'machines': list(), 'warnings': list()}
+    if len(cpus) > num_threads + num_spare:
+        for _ in range(num_spare):
+            placement['server'].extend(take_core()[1])
+        for idx in range(num_threads):
+            if len(free) <= 1:
+                break
+            cpu, siblings = take_core()
+            placement['threads'][SERVER_THREAD_PREFIX + str(idx)] = [cpu]
+            placement['idle'].extend(sibling for sibling in siblings if sibling != cpu)
+
+    if len(placement['threads']) < num_threads or len(free) == 0:
+        placement['warnings'].append('Only ' + str(len(cpus)) + ' cpus for ' + str(num_threads) + ' server threads, ' + str(num_spare) + ' spare and the clients. Server threads are not pinned and share cpus with everything')
+        placement['server'] = cpus
+        # Pinning each thread to one cpu would stack them on a few, the scheduler spreads them over all
+        placement['threads'] = {SERVER_THREAD_PREFIX + str(idx): list(cpus) for idx in range(num_threads)}
+        placement['idle'] = list()
+        free = list(cpus)
+
+    placement['clients'] = free
+    placement['machines'] = split_cpus(free, num_machines) if num_machines > 0 else list()
+    return placement
+
+
+def get_server_cpus(placement):
+    '''
+    Every cpu the server process may start on, before its threads are pinned
+    '''
+    return sorted(set(placement['server']).union(*placement['threads'].values()))
+
+
+def find_threads(pid, num_threads, timeout=10.):
+    '''
+    {thread name: thread id} of the world update threads of the server process pid
+    Waits up to timeout seconds for all of them to start
+    '''
+    names = {SERVER_THREAD_PREFIX + str(idx) for idx in range(num_threads)}
+    deadline = time.time() + timeout
+    while True:
+        found = dict()
+        for thread in psutil.Process(pid).threads():
+            try:
+                with open('/proc/' + str(pid) + '/task/' + str(thread.id) + '/comm') as f:
+                    name = f.read().strip()
+            except OSError:
+                continue
+            if name in names:
+                found[name] = thread.id
+        if len(found) == len(names) or time.time() > deadline:
+            return found
+        time.sleep(0.1)
+
+
+def apply(pid, placement, nice=-5, realtime=None):
+    '''
+    Pins the threads of the server process pid as planned and raises the priority of the world update threads
+    realtime is a SCHED_FIFO priority used instead of nice
+    Records the thread ids and the priority in placement, and in its warnings what could not be applied
+    '''
+    warnings = placement['warnings']
+    tids = find_threads(pid, len(placement['threads']))
+    placement['pid'] = pid
+    placement['tids'] = tids
+    placement['nice'] = nice
+    placement['realtime'] = realtime
+
+    # Threads the server starts from now on inherit the spare cpus of its main thread
+    for thread in psutil.Process(pid).threads():
+        if thread.id not in tids.values():
+            os.sched_setaffinity(thread.id, placement['server'])
+
+    for name, cpus in sorted(placement['threads'].items()):
+        if name not in tids:
+            warnings.append(name + ' was not found in server process ' + str(pid) + ', it is not pinned')
+            continue
+        os.sched_setaffinity(tids[name], cpus)
+        try:
+            if realtime is not None:
+                os.sched_setscheduler(tids[name], os.SCHED_FIFO, os.sched_param(realtime))
+            else:
+                os.setpriority(os.PRIO_PROCESS, tids[name], nice)
+        except PermissionError:
+            warnings.append('Not permitted to set the priority of ' + name + ' (needs CAP_SYS_NICE)')
+    return placement
+
+
+def write(port, placement, metrics_dir='metrics'):
+    '''
+    Writes metrics_dir/placement_<port>.json for the server on port to move into its run directory
+    '''
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, 'placement_' + str(port) + '.json')
+    placement['timestamp'] = time.time()
+    with open(path + '.tmp', mode='w') as f:
+        json.dump(placement, f, indent=1)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def print_placement(placement):
+    print('Info:', 'CPU placement of', len(placement['cpus']), 'cpus:')
+    for name, cpus in sorted(placement['threads'].items()):
+        print('Info:', '    ', name, ':', format_cpu_list(cpus), *([] if name in placement.get('tids', {name: None}) else ['(not found)']))
+    print('Info:', '    ', 'other server threads :', format_cpu_list(placement['server']))
+    if placement['idle']:
+        print('Info:', '    ', 'idle hyperthreads    :', format_cpu_list(placement['idle']))
+    print('Info:', '    ', 'clients              :', format_cpu_list(placement['clients']))
+    for warning in placement['warnings']:
+        print('Warning:', warning)
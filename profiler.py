@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+import collections
+import hashlib
+import html
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+
+# Written by the launcher as metrics/profile_<port>.folded and .svg, the server moves them into its run directory on exit
+FOLDED_FILENAME = 'profile.folded'
+SVG_FILENAME = 'profile.svg'
+
+
+def is_available():
+    return shutil.which('perf') is not None
+
+
+def record(pid, duration, frequency=99, call_graph='fp'):
+    '''
+    Output of perf script for duration seconds of stack samples of every thread of process pid, None if perf failed
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = os.path.join(tmp_dir, 'perf.data')
+        cmd = ['perf', 'record', '-F', str(frequency), '--call-graph', call_graph, '-p', str(pid), '-o', data_path, '--', 'sleep', str(duration)]
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0 or not os.path.isfile(data_path):
+            print('Error:', 'perf record failed:', (result.stderr.strip().splitlines() or ['unknown error'])[-1])
+            print('Error:', '    ', 'Check /proc/sys/kernel/perf_event_paranoid')
+            return None
+        result = subprocess.run(['perf', 'script', '-i', data_path, '-F', 'comm,ip,sym'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        return result.stdout
+
+
+def fold(script):
+    '''
+    collections.Counter of 'thread;outermost frame;...;innermost frame' -> number of samples, from the output of perf script -F comm,ip,sym
+    Threads are roots, so the world update threads wu<i> show up side by side
+    '''
+    stacks = collections.Counter()
+    comm = None
+    frames = list()
+    for line in script.splitlines() + ['']:
+        if not line.strip():
+            if comm is not None:
+                stacks[';'.join([comm] + frames[::-1])] += 1
+            comm = None
+            frames = list()
+        elif line[0] in ' \t':
+            parts = line.split(None, 1)
+            frames.append(parts[1].strip().replace(';', ':') if len(parts) > 1 else '[unknown]')
+        else:
+            comm = line.strip().replace(' ', '_').replace(';', ':') or '[unknown]'
+    return stacks
+
+
+def write_folded(stacks, path):
+    with open(path, mode='w') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(stack + ' ' + str(count) + '\n')
+
+
+def frame_color(name):
+    '''
+    Warm color that stays the same for a function across flamegraphs
+    '''
+    value = int(hashlib.md5(name.encode()).hexdigest()[:6], 16)
+    return 'rgb({},{},{})'.format(205 + value % 50, 80 + (value >> 8) % 150, (value >> 16) % 55)
+
+
+def render_svg(stacks, title, width=1200, frame_height=16):
+    '''
+    Flamegraph of folded stacks as a self-contained SVG, the outermost frames at the bottom
+    Hovering a frame shows its number of samples
+    '''
+    # node = [samples, {frame: node}]
+    root = [0, dict()]
+    for stack, count in stacks.items():
+        node = root
+        node[0] += count
+        for frame in stack.split(';'):
+            node = node[1].setdefault(frame, [0, dict()])
+            node[0] += count
+    total = max(root[0], 1)
+    scale = (width - 20) / total
+
+    rects = list()
+    def layout(node, x, depth):
+        for frame, child in sorted(node[1].items()):
+            if child[0] * scale >= 0.1:
+                rects.append((frame, child[0], x, depth))
+                layout(child, x, depth + 1)
+            x += child[0]
+    layout(root, 0, 0)
+
+    max_depth = max([depth for _, _, _, depth in rects] or [0]) + 1
+    height = (max_depth + 3) * frame_height
+    body = list()
+    for frame, count, x, depth in rects:
+        rect_x = 10 + x * scale
+        rect_width = count * scale
+        y = height - (depth + 2) * frame_height
+        nchar = int(rect_width / 7)
+        label = frame if len(frame) <= nchar else (frame[:nchar - 2] + '..' if nchar > 3 else '')
+        body.append('<g><title>{} ({} samples, {:.2f}%)</title><rect x="{:.1f}" y="{}" width="{:.1f}" height="{}" fill="{}" rx="2"/><text x="{:.1f}" y="{}">{}</text></g>'.format(
+            html.escape(frame), count, count / total * 100., rect_x, y, rect_width, frame_height - 1, frame_color(frame), rect_x + 3, y + frame_height - 4, html.escape(label)))
+
+    return '\n'.join([
+        '<?xml version="1.0" standalone="no"?>',
+        '<svg version="1.1" width="{}" height="{}" xmlns="http://www.w3.org/2000/svg" font-family="monospace" font-size="11">'.format(width, height),
+        '<rect x="0" y="0" width="100%" height="100%" fill="#f8f8f8"/>',
+        '<text x="{}" y="{}" text-anchor="middle" font-size="15">{}</text>'.format(width // 2, frame_height + 2, html.escape(title + ' (' + str(root[0]) + ' samples)')),
+        *body,
+        '</svg>', ''])
+
+
+def capture(pid, port, delay, duration, frequency=99, call_graph='fp', metrics_dir='metrics'):
+    '''
+    Profiles the server process pid for duration seconds after delay seconds
+    Writes metrics_dir/profile_<port>.folded and .svg for the server on port to move into its run directory
+    '''
+    time.sleep(delay)
+    print('Info:', 'Profiling server process', pid, 'for', duration, 'seconds at', frequency, 'Hz')
+    script = record(pid, duration, frequency, call_graph)
+    if script is None:
+        return
+    stacks = fold(script)
+    if len(stacks) == 0:
+        print('Warning:', 'The profile of server process', pid, 'is empty')
+        return
+
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, 'profile_' + str(port))
+    write_folded(stacks, path + '.folded.tmp')
+    with open(path + '.svg.tmp', mode='w') as f:
+        f.write(render_svg(stacks, 'Server on port ' + str(port) + ', ' + str(duration) + ' s from ' + time.strftime('%H:%M:%S', time.localtime(time.time() - duration))))
+    os.replace(path + '.folded.tmp', path + '.folded')
+    os.replace(path + '.svg.tmp', path + '.svg')
+    print('Info:', 'Profile of', sum(stacks.values()), 'samples is written to', path + '.folded', 'and', path + '.svg')
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+import socket
+import struct
+import zlib
+
+
+# Same order as MessageEnum in src/comm/Message.h
+MESSAGE_DEFAULT = 0
+MESSAGE_CS_JOIN = 1
+MESSAGE_SC_OK_JOIN = 2
+MESSAGE_SC_NOK_JOIN = 3
+MESSAGE_CS_LEAVE = 4
+MESSAGE_SC_OK_LEAVE = 5
+MESSAGE_SC_NEW_QUEST = 6
+MESSAGE_SC_QUEST_OVER = 7
+MESSAGE_CS_MOVE_DOWN = 8
+MESSAGE_CS_MOVE_RIGHT = 9
+MESSAGE_CS_MOVE_UP = 10
+MESSAGE_CS_MOVE_LEFT = 11
+MESSAGE_CS_USE = 12
+MESSAGE_CS_ATTACK_DOWN = 13
+MESSAGE_CS_ATTACK_RIGHT = 14
+MESSAGE_CS_ATTACK_UP = 15
+MESSAGE_CS_ATTACK_LEFT = 16
+MESSAGE_SC_REGULAR_UPDATE = 17
+
+MESSAGE_NAMES = {value: name[len('MESSAGE_'):] for name, value in globals().items() if name.startswith('MESSAGE_') and isinstance(value, int)}
+
+CS_MESSAGES = [value for value, name in MESSAGE_NAMES.items() if name.startswith('CS_')]
+MOVE_MESSAGES = [MESSAGE_CS_MOVE_DOWN, MESSAGE_CS_MOVE_RIGHT, MESSAGE_CS_MOVE_UP, MESSAGE_CS_MOVE_LEFT]
+ATTACK_MESSAGES = [MESSAGE_CS_ATTACK_DOWN, MESSAGE_CS_ATTACK_RIGHT, MESSAGE_CS_ATTACK_UP, MESSAGE_CS_ATTACK_LEFT]
+
+# Every packet starts with (message_type, message_target) as native ints, the server runs on x86
+HEADER = struct.Struct('<ii')
+# MessageOkJoin: header, mapx, mapy, x, y, name[MAX_PLAYER_NAME]
+OK_JOIN = struct.Struct('<iiiiii')
+# MessageXY: header, x, y
+XY = struct.Struct('<iiii')
+
+# Same as Constants.h
+CELL_NONE = 0
+CELL_EMPTY = 1
+CELL_OBJECT = 2
+CELL_PLAYER = 3
+
+# MESSAGE_SC_REGULAR_UPDATE as packed by WorldMap::updatePlayer, after the header:
+# position x, y, view x1, y1, x2, y2, life, attr, dir
+UPDATE_STATE = struct.Struct('<9i')
+# Then one terrain char per visible cell, column by column, then cells until CELL_NONE
+# CELL_PLAYER: x, y, life, attr, dir, IPaddress (Uint32 host, Uint16 port, padded to 8 bytes)
+UPDATE_PLAYER = struct.Struct('<5i8s')
+# CELL_OBJECT: x, y, attr, quantity
+UPDATE_OBJECT = struct.Struct('<4i')
+
+MAX_UDP_PACKET_SIZE = 65536
+
+
+def parse_address(address, default_host='127.0.0.1'):
+    '''
+    (host, port) of '<host>:<port>', an empty host is default_host as with run_client.py --port=:1747
+    '''
+    host, _, port = address.rpartition(':')
+    return (host if host else default_host, int(port))
+
+
+def pack_message(message_type, target=0):
+    return HEADER.pack(message_type, target)
+
+
+def unpack_header(data):
+    '''
+    (message_type, message_target) or (None, None) for a runt packet
+    '''
+    if len(data) < HEADER.size:
+        return None, None
+    return HEADER.unpack_from(data)
+
+
+def unpack_ok_join(data):
+    '''
+    (target, (mapx, mapy), (x, y), name) of a MESSAGE_SC_OK_JOIN packet
+    '''
+    _, target, mapx, mapy, x, y = OK_JOIN.unpack_from(data)
+    name = data[OK_JOIN.size:].split(b'\0', 1)[0].decode('ascii', errors='replace')
+    return target, (mapx, mapy), (x, y), name
+
+
+def unpack_xy(data):
+    _, target, x, y = XY.unpack_from(data)
+    return x, y
+
+
+def decompress_message(data):
+    '''
+    Packet as it would be without -D__COMPRESSED_MESSAGES__
+    Compressed packets are (message_type, uncompressed size, zlib data of everything past the type)
+    '''
+    message_type, size = HEADER.unpack_from(data)
+    payload = zlib.decompress(data[HEADER.size:])
+    if len(payload) != size:
+        raise ValueError('Decompressed ' + str(len(payload)) + ' bytes instead of ' + str(size))
+    return struct.pack('<i', message_type) + payload
+
+
+def decode_regular_update(data):
+    '''
+    {'position': (x, y), 'view': (x1, y1, x2, y2), 'life', 'attr', 'dir', 'terrain': bytes, 'players': [(x, y, life, attr, dir)], 'objects': [(x, y, attr, quantity)]}
+    Raises ValueError if data is not a well formed MESSAGE_SC_REGULAR_UPDATE
+    '''
+    try:
+        message_type, _ = HEADER.unpack_from(data)
+        if message_type != MESSAGE_SC_REGULAR_UPDATE:
+            raise ValueError('Not a regular update')
+        x, y, x1, y1, x2, y2, life, attr, direction = UPDATE_STATE.unpack_from(data, HEADER.size)
+        pos = HEADER.size + UPDATE_STATE.size
+        ncell = max(0, x2 - x1) * max(0, y2 - y1)
+        terrain = bytes(data[pos:pos+ncell])
+        if len(terrain) != ncell:
+            raise ValueError('Terrain cut short')
+        pos += ncell
+
+        players = list()
+        objects = list()
+        while True:
+            cell_type = data[pos]
+            pos += 1
+            if cell_type == CELL_NONE:
+                break
+            elif cell_type == CELL_PLAYER:
+                players.append(UPDATE_PLAYER.unpack_from(data, pos)[:5])
+                pos += UPDATE_PLAYER.size
+            elif cell_type == CELL_OBJECT:
+                objects.append(UPDATE_OBJECT.unpack_from(data, pos))
+                pos += UPDATE_OBJECT.size
+            else:
+                raise ValueError('Unknown cell type ' + str(cell_type))
+    except (struct.error, IndexError) as e:
+        raise ValueError('Malformed regular update: ' + str(e))
+    return {
+        'position': (x, y),
+        'view': (x1, y1, x2, y2),
+        'life': life,
+        'attr': attr,
+        'dir': direction,
+        'terrain': terrain,
+        'players': players,
+        'objects': objects,
+    }
+
+
+def open_udp_socket(bind_host='0.0.0.0', bind_port=0, buffer_size=1 << 20):
+    '''
+    Non-blocking UDP socket with enlarged buffers, the kernel default drops bursts of updates
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, buffer_size)
+        except OSError:
+            pass
+    sock.bind((bind_host, bind_port))
+    sock.setblocking(False)
+    return sock
+
+
+def raise_fd_limit(wanted):
+    '''
+    One socket per simulated client easily exceeds the default limit of 1024 descriptors
+    '''
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard) if hard != resource.RLIM_INFINITY else wanted, hard))
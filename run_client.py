@@ -7,6 +7,8 @@ import socket
 import subprocess
 import sys
 
+import placement
+
 try:
     import psutil
 except:
@@ -217,7 +219,14 @@ def main(args):
             else: # devnull
                 output = subprocess.DEVNULL
 
-        return subprocess.Popen(command, stdout=output, stderr=output)
+        return subprocess.Popen(command, stdout=output, stderr=output, preexec_fn=confine)
+
+    def confine():
+        # Keeps the clients off the cores of a server on the same machine
+        if args.cpus:
+            os.sched_setaffinity(0, placement.parse_cpu_list(args.cpus))
+        if args.nice:
+            os.nice(args.nice)
 
     pm = ProcessManager(launch_job)
     for _ in range(args.count):
@@ -238,6 +247,9 @@ def parse_arguments():
     parser.add_argument('--output', type=str, help='Directory to forward the stdout and stderr of each subprocesses. Default is devnull. Be aware of concurrent file writing!')
     parser.add_argument('--stdout', action='store_true', help='Forward the stdout and stderr of each subprocesses to stdout. Default is devnull.')
 
+    parser.add_argument('--cpus', type=str, help='Confine the subprocesses to these cpus, e.g. 4-7,12 like taskset -c. See the clients of a placement.json')
+    parser.add_argument('--nice', type=int, default=0, help='Niceness of the subprocesses')
+
     parser.add_argument('--wait', action='store_true', help='Disable the command shell, exit when all processes are done. Default is command shell.')
     
     return parser.parse_args()
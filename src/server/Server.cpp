@@ -130,16 +130,21 @@ void logPerformanceMetrics(WorldUpdateModule **wu_modules,const ServerData* sd )
 		auto t2 = module->requests_time_tracker;
 		auto t3 = module->updates_number_tracker;
 		auto t4 = module->updates_time_tracker;
+		auto t5 = module->tick_start_tracker;
 
 		auto t1Sample = t1->getCalculatedAverages();
 		auto t2Sample = t2->getCalculatedAverages();
 		auto t3Sample = t3->getCalculatedAverages();
 		auto t4Sample = t4->getCalculatedAverages();
+		auto t5Sample = t5->getCalculatedAverages();
 
 		int iterations = max(t1Sample.size(), max(t2Sample.size(), max(t3Sample.size(), t4Sample.size())));
 
 		vector<string> rows(iterations + 1, "");
-		rows[headerRow] += t1->getName() + " " + t2->getName() + " " + t3->getName() + " " + t4->getName();
+		rows[headerRow] += t1->getName() + " " + t2->getName() + " " + t3->getName() + " " + t4->getName() + " " + t5->getName();
+		for(auto tracker : module->phase_trackers){
+			rows[headerRow] += " " + tracker->getName();
+		}
 	
 		for(int i = 0 ; i < t1Sample.size(); ++ i){
 			rows[i + 1] += to_string(t1Sample[i]);
@@ -156,6 +161,23 @@ void logPerformanceMetrics(WorldUpdateModule **wu_modules,const ServerData* sd )
 		for(int i = 0 ; i < t4Sample.size(); ++ i){
 			rows[i + 1] += "," + to_string(t4Sample[i]);
 		}
+
+		// Only for rows that are complete so far, the tick may have started after the last update
+		for(int i = 0 ; i < t4Sample.size() && i < t5Sample.size(); ++ i){
+			rows[i + 1] += "," + to_string(t5Sample[i]);
+		}
+
+		// Phase breakdown, again only for the rows that have every phase
+		size_t phaseRows = min(t4Sample.size(), t5Sample.size());
+		for(auto tracker : module->phase_trackers){
+			phaseRows = min(phaseRows, tracker->getCalculatedAverages().size());
+		}
+		for(auto tracker : module->phase_trackers){
+			auto& sample = tracker->getCalculatedAverages();
+			for(size_t i = 0 ; i < phaseRows; ++ i){
+				rows[i + 1] += "," + to_string(sample[i]);
+			}
+		}
 			
 
 		for(auto row : rows){
@@ -163,6 +185,109 @@ void logPerformanceMetrics(WorldUpdateModule **wu_modules,const ServerData* sd )
 		}
 		logFile.close();
 	}
+
+	// Region assignment and load of every tick, for the analyzer regions subcommand
+	const WorldMap& wm = sd->wm;
+	int n_regions = wm.n_regs.x * wm.n_regs.y;
+	int row_size = 2 + 2 * n_regions;
+	size_t n_rows = min(wm.region_timestamps.size(), wm.region_samples.size() / row_size);
+
+	ofstream regionFile;
+	regionFile.open(dir_name + "/regions.txt");
+	regionFile << "timestamp balanced migrations";
+	for(string kind : {"layout", "players"}){
+		for(int i = 0; i < wm.n_regs.x; ++ i){
+			for(int j = 0; j < wm.n_regs.y; ++ j){
+				regionFile << " " << kind << "_" << i << "_" << j;
+			}
+		}
+	}
+	regionFile << "\n";
+	for(size_t row = 0; row < n_rows; ++ row){
+		regionFile << wm.region_timestamps[row];
+		for(int k = 0; k < row_size; ++ k){
+			regionFile << "," << wm.region_samples[row * row_size + k];
+		}
+		regionFile << "\n";
+	}
+	regionFile.close();
+
+	// Quest start and over events, for the analyzer to split the run into quest and idle phases
+	const vector<long long>& quest_events = wu_modules[0]->quest_events;
+	ofstream questFile;
+	questFile.open(dir_name + "/quests.txt");
+	questFile << "tick timestamp event x y\n";
+	for(size_t k = 0; k + 5 <= quest_events.size(); k += 5){
+		questFile << quest_events[k] << "," << quest_events[k + 1] << "," << quest_events[k + 2] << "," << quest_events[k + 3] << "," << quest_events[k + 4] << "\n";
+	}
+	questFile.close();
+
+	// Cpu of every thread at every tick, checked by the analyzer placement subcommand against the plan of the launcher
+	ofstream cpuFile;
+	cpuFile.open(dir_name + "/cpus.txt");
+	size_t n_ticks = wu_modules[0]->tick_cpus.size();
+	for(int i = 0; i < sd->num_threads; ++ i){
+		n_ticks = min(n_ticks, min(wu_modules[i]->tick_cpus.size(), wu_modules[i]->tick_nivcsw.size()));
+		cpuFile << (i ? " " : "") << "cpu_" << i;
+	}
+	for(int i = 0; i < sd->num_threads; ++ i){
+		cpuFile << " nivcsw_" << i;
+	}
+	cpuFile << "\n";
+	for(size_t row = 0; row < n_ticks; ++ row){
+		for(int i = 0; i < sd->num_threads; ++ i){
+			cpuFile << (i ? "," : "") << wu_modules[i]->tick_cpus[row];
+		}
+		for(int i = 0; i < sd->num_threads; ++ i){
+			cpuFile << "," << wu_modules[i]->tick_nivcsw[row];
+		}
+		cpuFile << "\n";
+	}
+	cpuFile.close();
+
+	// Files the launcher wrote about this server while it was running (placement.py, profiler.py, clocksync.py, super.py, impair.py), kept with the run they apply to
+	for(string name : {"placement.json", "profile.folded", "profile.svg", "clocks.json", "config.ini", "impair.txt"}){
+		size_t dot = name.find('.');
+		string launcher_name = "metrics/" + name.substr(0, dot) + "_" + to_string(local_port) + name.substr(dot);
+		rename(launcher_name.c_str(), (dir_name + "/" + name).c_str());
+	}
+}
+
+/***************************************************************************************************
+*
+* Live statistics: every stats_interval seconds metrics/live_<port>.csv is rewritten with the last
+* tick of each thread, for dashboards to poll without talking to the server
+*
+***************************************************************************************************/
+
+int stats_thread(void *data)
+{
+	WorldUpdateModule **wu_modules = (WorldUpdateModule**)data;
+	string file_name = "metrics/live_" + to_string(local_port) + ".csv";
+	string tmp_file_name = file_name + ".tmp";
+
+	while ( true )
+	{
+		SDL_Delay( sd->stats_interval * 1000 );
+
+		auto stamp = std::chrono::duration_cast< std::chrono::milliseconds >(std::chrono::system_clock::now().time_since_epoch()).count();
+
+		ofstream liveFile;
+		liveFile.open(tmp_file_name);
+		if ( !liveFile.is_open() )	continue;
+		liveFile << "timestamp thread players avg_wui avg_rui request_number request_time update_time\n";
+		for ( int i = 0; i < sd->num_threads; i++ )
+		{
+			auto module = wu_modules[i];
+			liveFile << stamp << "," << i << "," << sd->wm.players[i].size() << "," << module->avg_wui << "," << module->avg_rui << ","
+				<< module->last_requests << "," << module->last_request_time << "," << module->last_update_time << "\n";
+		}
+		liveFile.close();
+		/* readers never see half a file */
+		rename( tmp_file_name.c_str(), file_name.c_str() );
+	}
+
+	return 0;
 }
 
 /***************************************************************************************************
@@ -195,6 +320,10 @@ int main(int argc, char *argv[])
 		{
 			wu_module[i] = new WorldUpdateModule( i, comm_module, wu_barrier );				assert( wu_module[i] );
 		}
+		if ( sd->stats_interval > 0 )
+		{
+			assert( SDL_CreateThread( stats_thread, (void*)wu_module ) != NULL );
+		}
 		
 		
 		//* User input loop (type 'quit' to exit)
@@ -31,6 +31,8 @@ void ServerData::dataFromConfigurator( Configurator &conf )
 		throw "Config file: Too many threads";
 	}	
 	if ( this->regular_update_interval < 0 )		throw "Config file: Regular update interval must be positive";
+	/* seconds between live statistics dumps, 0 disables them */
+	this->stats_interval = conf.getIntAttribute("server.stats_interval");
 	
 	/* load balance */
 	strcpy( this->algorithm_name, conf.getAttribute( "server.balance" ) );
@@ -17,6 +17,7 @@ void WorldMap::generate()
 
 	players = new PlayerBucket[ sd->num_threads ];
 	n_players = 0;
+	migrations = 0;
 
 	list<Player*> pls;
 	list<GameObject*> objs;
@@ -256,6 +257,8 @@ void WorldMap::reassignRegion( Region* r, int new_layout )
 {
 	if(r->layout == new_layout) return;
 
+	++migrations;
+
 	list<Player*>::iterator pi;			//iterator for players
 	
 	for ( pi = r->players.begin(); pi != r->players.end(); pi++ )
@@ -305,12 +308,20 @@ void WorldMap::balance_spread()
 	return;
 }
 
-void WorldMap::balance()
+/* true when a balance invocation was due, even if the algorithm moved nothing */
+bool WorldMap::balance()
 {
 	Uint32 now = SDL_GetTicks();
-	if ( now - last_balance < sd->load_balance_limit )	return;
+	if ( now - last_balance < sd->load_balance_limit )	return false;
 	last_balance = now;
-	
+
+	migrations = 0;
+	rebalance();
+	return true;
+}
+
+void WorldMap::rebalance()
+{
 	if( !strcmp( sd->algorithm_name, "static" ) )		return;
 	
 	n_players = 0;
@@ -323,3 +334,17 @@ void WorldMap::balance()
 	printf("Algorithm %s is not implemented.\n", sd->algorithm_name);
 	return;
 }
+
+/* appends the current assignment and load of every region, called once per tick */
+void WorldMap::recordRegions( long long timestamp, bool balanced )
+{
+	region_timestamps.push_back( timestamp );
+	region_samples.push_back( balanced ? 1 : 0 );
+	region_samples.push_back( balanced ? migrations : 0 );
+	for( int i = 0; i < n_regs.x; i++ )
+		for( int j = 0; j < n_regs.y; j++ )
+			region_samples.push_back( regions[i][j].layout );
+	for( int i = 0; i < n_regs.x; i++ )
+		for( int j = 0; j < n_regs.y; j++ )
+			region_samples.push_back( regions[i][j].players.size() );
+}
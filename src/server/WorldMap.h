@@ -1,6 +1,8 @@
 #ifndef __WORLDMAP_H
 #define __WORLDMAP_H
 
+#include <vector>
+
 #include "../General.h"
 #include "../comm/Message.h"
 
@@ -29,6 +31,11 @@ public:
 
     Uint32 last_balance;   
     
+    /* region log: one row per tick of [balanced, migrations, layout of every region, players of every region] */
+    int migrations;					/* regions reassigned by the current balance invocation */
+    std::vector<long long> region_timestamps;
+    std::vector<int> region_samples;
+
 
 	void generate();
 	
@@ -44,12 +51,14 @@ public:
     
     Region* getRegionByLocation( Vector2D loc);
     
-    void balance();
+    bool balance();
+    void rebalance();
     void balance_lightest();
     void balance_spread();
 
     bool isOverloaded( int n_pl );
     void reassignRegion( Region* r, int new_layout );
+    void recordRegions( long long timestamp, bool balanced );
     
     void regenerateObjects();
     void rewardPlayers( Vector2D quest_pos );
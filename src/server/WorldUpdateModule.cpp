@@ -19,6 +19,12 @@
 #include "ServerData.h"
 #include "WorldUpdateModule.h"
 
+#ifdef __linux__
+#include <sched.h>
+#include <sys/prctl.h>
+#include <sys/resource.h>
+#endif
+
 /***************************************************************************************************
 *
 * Constructors and setup methods
@@ -36,11 +42,25 @@ WorldUpdateModule::WorldUpdateModule( int id, MessageModule *_comm, SDL_barrier
 	avg_wui = -1;
 	avg_rui = -1;
 
+	last_requests = 0;
+	last_request_time = 0;
+	last_update_time = 0;
+
 	requests_number_tracker = new MetricsTracker<int>(0, "request_number");
 	requests_time_tracker = new MetricsTracker<double>(0, "request_time");
 
 	updates_number_tracker = new MetricsTracker<int>(0, "update_number");
 	updates_time_tracker = new MetricsTracker<double>(0, "update_time");
+
+	tick_start_tracker = new MetricsTracker<double>(0, "tick_start");
+
+	request_wait_tracker = new MetricsTracker<double>(0, "request_wait");
+	barrier1_tracker = new MetricsTracker<double>(0, "barrier1_wait");
+	balance_tracker = new MetricsTracker<double>(0, "balance_time");
+	barrier2_tracker = new MetricsTracker<double>(0, "barrier2_wait");
+	send_tracker = new MetricsTracker<double>(0, "send_time");
+	barrier3_tracker = new MetricsTracker<double>(0, "barrier3_wait");
+	phase_trackers = { request_wait_tracker, barrier1_tracker, balance_tracker, barrier2_tracker, send_tracker, barrier3_tracker };
 	
 
 	assert( SDL_CreateThread( module_thread, (void*)this ) != NULL );
@@ -73,16 +93,44 @@ void WorldUpdateModule::run()
     	
 	printf("WorldUpdateModule started\n");
 
+#ifdef __linux__
+	/* launchers find the thread by this name to pin it (see placement.py) */
+	char thread_name[16];
+	snprintf( thread_name, sizeof(thread_name), "wu%d", t_id );
+	prctl( PR_SET_NAME, thread_name );
+#endif
+
+	/* duration of the phase since the last call (us) */
+	auto phase_start = std::chrono::high_resolution_clock::now();
+	auto end_phase = [&phase_start]() {
+		auto now = std::chrono::high_resolution_clock::now();
+		double duration = std::chrono::duration_cast< std::chrono::microseconds >(now - phase_start).count();
+		phase_start = now;
+		return duration;
+	};
+
 	/* main loop */
 	while ( true )
 	{
 		start_time = SDL_GetTicks();
 		timeout	= sd->regular_update_interval;
+		end_phase();
+		tick_start_tracker->addSample(std::chrono::duration_cast< std::chrono::milliseconds >(std::chrono::system_clock::now().time_since_epoch()).count());
+#ifdef __linux__
+		struct rusage usage;
+		getrusage( RUSAGE_THREAD, &usage );
+		tick_cpus.push_back( sched_getcpu() );
+		tick_nivcsw.push_back( usage.ru_nivcsw );
+#else
+		tick_cpus.push_back( -1 );
+		tick_nivcsw.push_back( -1 );
+#endif
 		
 		int requests = 0;
 		double processing_time = 0;
 		int updates = 0;
 		double updating_time = 0;
+		double sending_time = 0;
 	
         while( (m = comm->receive( timeout, t_id )) != NULL )
         {
@@ -128,12 +176,15 @@ void WorldUpdateModule::run()
 		
 	requests_number_tracker->addSample(requests);
 	requests_time_tracker->addSample(processing_time);
+	request_wait_tracker->addSample(end_phase() - processing_time);
         
         SDL_WaitBarrier(barrier);
+        barrier1_tracker->addSample(end_phase());
         
         if( t_id == 0 )
         {
-        	sd->wm.balance();
+        	bool balanced = sd->wm.balance();
+        	sd->wm.recordRegions( std::chrono::duration_cast< std::chrono::milliseconds >(std::chrono::system_clock::now().time_since_epoch()).count(), balanced );
         	
         	if( rand() % 100 < 10 )		sd->wm.regenerateObjects();
         	
@@ -145,17 +196,21 @@ void WorldUpdateModule::run()
 				sd->quest_pos.y = (rand() % sd->wm.n_regs.y) * CLIENT_MATRIX_SIZE + MAX_CLIENT_VIEW;
 				sd->send_start_quest = 1;
 				if( sd->display_quests )		printf("New quest %d,%d\n", sd->quest_pos.x, sd->quest_pos.y);
+				recordQuestEvent( 1 );
 			}			
 			if( start_time > end_quest )
 			{
 				sd->wm.rewardPlayers( sd->quest_pos );
 				end_quest = start_quest + sd->quest_min + rand() % (sd->quest_max-sd->quest_min+1);
 				sd->send_end_quest = 1;
-				if( sd->display_quests )		printf("Quest over\n");				
+				if( sd->display_quests )		printf("Quest over\n");
+				recordQuestEvent( 0 );				
 			}
         }
+        balance_tracker->addSample(end_phase());
         
         SDL_WaitBarrier(barrier);
+        barrier2_tracker->addSample(end_phase());
         
         wui = SDL_GetTicks() - start_time;
         avg_wui = ( avg_wui < 0 ) ? wui : ( avg_wui * 0.95 + (double)wui * 0.05 );        
@@ -173,19 +228,28 @@ void WorldUpdateModule::run()
 		    
 		    sd->wm.updatePlayer( p, s );
 	    	
+		auto send_start_time = std::chrono::high_resolution_clock::now();
 	    	ms->prepare();
 	    	comm->send( ms, t_id );
 	    	
 	    	if( sd->send_start_quest )		comm->send( new MessageXY(MESSAGE_SC_NEW_QUEST, t_id, p->address, sd->quest_pos), t_id );
 	    	if( sd->send_end_quest )		comm->send( new Message(MESSAGE_SC_QUEST_OVER, t_id, p->address), t_id );
+		sending_time += std::chrono::duration_cast< std::chrono::microseconds >(std::chrono::high_resolution_clock::now() - send_start_time).count();
 		
 		updating_time += std::chrono::duration_cast< std::chrono::microseconds >(std::chrono::high_resolution_clock::now() - update_start_time).count();
 	    }
 	
 	    updates_number_tracker->addSample(updates);
     	    updates_time_tracker->addSample(updating_time);
+	    send_tracker->addSample(sending_time);
+
+	    last_requests = requests;
+	    last_request_time = processing_time;
+	    last_update_time = updating_time;
 
+	    end_phase();
 	    SDL_WaitBarrier(barrier);
+	    barrier3_tracker->addSample(end_phase());
 	    rui = SDL_GetTicks() - start_time;    
 	    avg_rui = ( avg_rui < 0 ) ? rui : ( avg_rui * 0.95 + (double)rui * 0.05 );	    
 	}
@@ -235,3 +299,12 @@ void WorldUpdateModule::handle_move(Player* p, int _dir)
 	sd->wm.movePlayer( p );
 }
 
+/* the current tick is the last one whose requests were sampled */
+void WorldUpdateModule::recordQuestEvent( int event )
+{
+	quest_events.push_back( (long long)requests_number_tracker->getCalculatedAverages().size() - 1 );
+	quest_events.push_back( std::chrono::duration_cast< std::chrono::milliseconds >(std::chrono::system_clock::now().time_since_epoch()).count() );
+	quest_events.push_back( event );
+	quest_events.push_back( sd->quest_pos.x );
+	quest_events.push_back( sd->quest_pos.y );
+}
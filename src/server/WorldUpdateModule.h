@@ -39,6 +39,11 @@ public:
 	double avg_wui;			// average_world_update_interval
 	double avg_rui;			// average_regular_update_interval
 
+	/* last complete tick, read without locking by the live statistics dump */
+	int last_requests;
+	double last_request_time;
+	double last_update_time;
+
 	
 	MetricsTracker<int>* requests_number_tracker;
 	MetricsTracker<double>* requests_time_tracker;
@@ -46,6 +51,24 @@ public:
 	MetricsTracker<int>* updates_number_tracker;
 	MetricsTracker<double>* updates_time_tracker;
 
+	MetricsTracker<double>* tick_start_tracker;	// wall-clock start of every tick (ms since epoch)
+
+	/* the other phases of every tick (us): waiting for requests, the 3 barriers, the serial section of thread 0 (balance, quests) and the send part of the update time */
+	MetricsTracker<double>* request_wait_tracker;
+	MetricsTracker<double>* barrier1_tracker;
+	MetricsTracker<double>* balance_tracker;
+	MetricsTracker<double>* barrier2_tracker;
+	MetricsTracker<double>* send_tracker;
+	MetricsTracker<double>* barrier3_tracker;
+	vector<MetricsTracker<double>*> phase_trackers;	// the above in the order of their .csv columns
+
+	/* quest events seen by thread 0, 5 values each: tick, timestamp (ms since epoch), 1 = new quest / 0 = quest over, quest x, quest y */
+	vector<long long> quest_events;
+
+	/* cpu the thread ran on and its involuntary context switches so far, sampled at the start of every tick (-1 where not available) */
+	vector<int> tick_cpus;
+	vector<long> tick_nivcsw;
+
 public:
 	/* Constructor and setup methods */
 	WorldUpdateModule( int id, MessageModule *_comm, SDL_barrier *_barr );
@@ -58,6 +81,9 @@ public:
 	void handleClientLeaveRequest(Player* p);
 
 	void handle_move(Player* p, int _dir);	
+
+private:
+	void recordQuestEvent(int event);
 };
 
 #endif
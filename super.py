@@ -6,23 +6,34 @@ import datetime
 import multiprocessing
 import os
 import random
+import shutil
 import signal
 import socket
 import subprocess
+import threading
 import time
 import warnings
 
 warnings.filterwarnings(action='ignore',module='.*paramiko.*')
 
+import clocksync
+import placement
+import profiler
 import run_client
 import super_client
 
 
 # Process tombstone endpoint 1
 class SuperControlPrompt(super_client.ControlPrompt):
-    def __init__(self, time, ssh_manager, label_message):
-        super(SuperControlPrompt, self).__init__(time, ssh_manager)
+    def __init__(self, time, ssh_manager, label_message, port, refresh=1.0, before_exit=None):
+        super(SuperControlPrompt, self).__init__(time, ssh_manager, refresh)
         self.__label_message = label_message
+        self.__port = port
+        self.__before_exit = before_exit
+
+    def get_live_stats_path(self):
+        # The server runs in the current directory and rewrites it every server.stats_interval seconds
+        return os.path.join('metrics', 'live_' + str(self.__port) + '.csv')
 
     def do_load(self, arg=None):
         run_client.print_load()
@@ -31,6 +42,12 @@ class SuperControlPrompt(super_client.ControlPrompt):
         print('Info:', self.__label_message.get_label())
         print('Info:')
 
+    def do_exit(self, arg=None):
+        # Runs while the connections to the machines are still open
+        if self.__before_exit is not None:
+            self.__before_exit()
+        return super(SuperControlPrompt, self).do_exit(arg)
+
 
 class ServerProcessManager(run_client.ProcessManager):
     def __init__(self, process_creater):
@@ -80,14 +97,35 @@ class LabelMessenger():
 
 # Process tombstone endpoint 2
 class SignalHandler():
-    def __init__(self, ssh_manager, server_process_manager, label_message):
+    def __init__(self, ssh_manager, server_process_manager, label_message, clock_probe=None, port=None, impair_process_manager=None):
         self.__ssh_manager = ssh_manager
         self.__server_process_manager = server_process_manager
+        self.__impair_process_manager = impair_process_manager
         self.__label_message = label_message
+        self.__clock_probe = clock_probe
+        self.__port = port
         signal.signal(signal.SIGTERM, self.exit_gracefully)
 
+    def record_clocks(self):
+        '''
+        Probe the clocks at the end of the run, once, while the machines are still connected
+        The server is still running, so it moves them into its run directory on exit
+        '''
+        if self.__clock_probe is None:
+            return
+        clock_probe, self.__clock_probe = self.__clock_probe, None
+        clock_probe.end()
+        clock_probe.print_clocks()
+        print('Info:', 'Clock offsets are recorded in', clock_probe.write(self.__port))
+
     def exit_gracefully(self, signum, frame):
+        self.record_clocks()
         self.__ssh_manager.__del__()
+        # The proxy writes its last counters on SIGTERM, before the server moves them into its run directory
+        if self.__impair_process_manager is not None:
+            for proc in filter(None, self.__impair_process_manager.get_processes()):
+                proc.terminate()
+            self.__impair_process_manager.wait_all()
         self.__server_process_manager.__del__()
         exit(0)
 
@@ -126,23 +164,42 @@ def main(args):
     # print('Info:', args)
     print('Info:')
 
-    cur_host_name = socket.gethostname()
+    cur_host_name = 'localhost' if args.local else socket.gethostname()
     print('Info:', '@' + cur_host_name)
-    if not args.disable_server_check:
+    if not args.disable_server_check and not args.local:
         if cur_host_name not in allowed_server_host:
             print('Error:', 'Current server host', '@' + cur_host_name, 'is not allowed')
             print('Error:', '    ', 'List of allowed server hosts:', allowed_server_host)
             exit(0)
 
     local_path = os.path.expanduser(args.path)
-    config_path = get_server_config(path=local_path, quest=args.quest, noquest=args.noquest, spread=args.spread, static=args.static)
-    if config_path is None:
-        print('Error:', 'Could not find server config file in', local_path)
-        exit(0)
-
-    args.client_machines = super_client.get_remote_machines(args.client_machines)
+    if args.config is not None:
+        config_path = os.path.abspath(os.path.expanduser(args.config))
+        if not os.path.isfile(config_path):
+            print('Error:', 'Could not find server config file', config_path)
+            exit(0)
+    else:
+        config_path = get_server_config(path=local_path, quest=args.quest, noquest=args.noquest, spread=args.spread, static=args.static)
+        if config_path is None:
+            print('Error:', 'Could not find server config file in', local_path)
+            exit(0)
 
-    sm = super_client.SSHManager(args.client_machines, args.username, args.password)
+    server_cpus = list()
+    cpu_placement = None
+    if args.pin:
+        cpu_placement = placement.plan(placement.get_num_server_threads(config_path), args.local or 0)
+        server_cpus = placement.get_server_cpus(cpu_placement)
+    if args.local:
+        if cpu_placement is not None:
+            client_cpus = cpu_placement['machines']
+        else:
+            server_cpus, client_cpus = super_client.plan_local_cpus(args.local, args.server_cpus)
+        sm = super_client.LocalManager(client_cpus, args.client_nice)
+        if server_cpus:
+            print('Info:', 'Server on cpus', placement.format_cpu_list(server_cpus))
+    else:
+        args.client_machines = super_client.get_remote_machines(args.client_machines)
+        sm = super_client.SSHManager(args.client_machines, args.username, args.password)
     if sm.get_num_machines() == 0:
         print('Error:', 'Could not connect to any of the client machines!')
         exit(0)
@@ -151,23 +208,57 @@ def main(args):
     if args.port is None:
         args.port = random.randint(1500, 60000)
 
+    # The server moves it into its run directory on exit, so every run keeps the config it ran with
+    os.makedirs('metrics', exist_ok=True)
+    shutil.copyfile(config_path, os.path.join('metrics', 'config_' + str(args.port) + '.ini'))
+
     server_host_port = cur_host_name + ':' + str(args.port)
     def server_launcher(_):
         print('Info:', 'Launching server process', '@' + server_host_port)
         cmd = [os.path.join(local_path, 'server'), config_path, str(args.port)]
         print('Info:', '    ', ' '.join(cmd))
-        return subprocess.Popen(cmd, stdin=subprocess.PIPE)#, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        preexec_fn = (lambda: os.sched_setaffinity(0, server_cpus)) if server_cpus else None
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, preexec_fn=preexec_fn)#, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     spm = ServerProcessManager(server_launcher)
 
+    # Clients talk to the impairment proxy instead, on the next port of the server host
+    client_host_port = server_host_port
+    ipm = None
+    if args.impair_up or args.impair_down:
+        impair_port = args.impair_port if args.impair_port is not None else args.port + 1
+        client_host_port = cur_host_name + ':' + str(impair_port)
+        def impair_launcher(_):
+            print('Info:', 'Launching impairment proxy', '@' + client_host_port)
+            impair_cmd = [os.path.join(local_path, 'impair.py'), '--server', ':' + str(args.port), '--listen', ':' + str(impair_port), '--stats', os.path.join('metrics', 'impair_' + str(args.port) + '.txt')]
+            impair_cmd += ['--up', args.impair_up] if args.impair_up else []
+            impair_cmd += ['--down', args.impair_down] if args.impair_down else []
+            print('Info:', '    ', ' '.join(impair_cmd))
+            return subprocess.Popen(impair_cmd)
+        ipm = run_client.ProcessManager(impair_launcher)
+
     # Auto messenger on exit
     label_msger = LabelMessenger('quest' if args.quest else 'noquest', 'spread' if args.spread else 'static', args.count)
 
+    clock_probe = None
+    if args.clock_probes > 0:
+        clock_probe = clocksync.ClockProbe(sm, args.clock_probes)
+        clock_probe.start()
+        clock_probe.print_clocks()
+        print('Info:')
+
     # Register the signal handler
-    sh = SignalHandler(sm, spm, label_msger)
+    sh = SignalHandler(sm, spm, label_msger, clock_probe, args.port, ipm)
 
     spm.launch_process()
+    if ipm is not None:
+        ipm.launch_process()
     time.sleep(5 * args.delay)
 
+    if cpu_placement is not None:
+        placement.apply(spm.get_processes()[0].pid, cpu_placement, args.nice, args.realtime)
+        placement.print_placement(cpu_placement)
+        print('Info:', 'Placement is recorded in', placement.write(args.port, cpu_placement))
+
     print('Info:')
     launch_time = datetime.datetime.now()
     super_client.print_time(launch_time)
@@ -175,10 +266,18 @@ def main(args):
     super_client.launch_tasks(
         sshmanager=sm, 
         total_count=args.count, 
-        remote_launcher=os.path.join(args.path, 'run_client.py'), 
-        remote_cmd=os.path.join(args.path, 'client'), 
-        port=server_host_port, 
+        remote_launcher=os.path.join(local_path if args.local else args.path, 'run_client.py'), 
+        remote_cmd=os.path.join(local_path if args.local else args.path, 'client'), 
+        port=client_host_port, 
         delay=args.delay)
+
+    if args.profile is not None:
+        if not profiler.is_available():
+            print('Warning:', 'perf is not installed, the server is not profiled')
+        else:
+            if args.duration is not None and args.profile_delay + args.profile > args.duration:
+                print('Warning:', 'The profile ends after --duration, it will be dropped')
+            threading.Thread(target=profiler.capture, args=(spm.get_processes()[0].pid, args.port, args.profile_delay, args.profile, args.profile_frequency, args.call_graph), daemon=True).start()
     
     print('Info:')
     termination_time = None
@@ -189,7 +288,10 @@ def main(args):
         multiprocessing.Process(target=killer_process, args=(args.duration,), daemon=True).start()
     
     print('Info:')
-    SuperControlPrompt((launch_time, termination_time), sm, label_msger).cmdloop('DO NOT CTRL-C!')
+    prompt = SuperControlPrompt((launch_time, termination_time), sm, label_msger, args.port, args.refresh, sh.record_clocks)
+    if args.dashboard:
+        prompt.do_dash('on')
+    prompt.cmdloop('DO NOT CTRL-C!')
     sh.exit_gracefully(None, None)
 
 
@@ -207,11 +309,29 @@ def parse_arguments():
     parser.add_argument('--delay', type=float, default=1.0, help='Delay interval between jobs launching on each machine')
     parser.add_argument('--duration', type=float, default=None, help='Time in seconds to auto terminate this script')
     parser.add_argument('--port', type=int, default=None, help='Port to use. Random by default')
+    parser.add_argument('--dashboard', action='store_true', help='Start with the live dashboard on. Toggle it with the dash command')
+    parser.add_argument('--refresh', type=float, default=1.0, help='Seconds between redraws of the dashboard')
     parser.add_argument('--client_machines', type=str, nargs='+', help='Pool of machines for client')
     parser.add_argument('--disable_server_check', action='store_true', help='Disable the server machine check')
-    # Required
-    parser.add_argument('--username', type=str, required=True, help='Username for SSH')
-    parser.add_argument('--password', type=str, required=True, help='Password for SSH')
+    parser.add_argument('--local', type=int, default=None, help='Run the clients on this number of virtual hosts, as local process groups on their own cpus, instead of SSH. Skips the server machine check')
+    parser.add_argument('--server_cpus', type=int, default=0, help='With --local, number of cpus kept for the server. The virtual hosts share the rest')
+    parser.add_argument('--pin', action='store_true', help='Pin every server thread to a core of its own and the local clients to the remaining cores. Replaces --server_cpus. The placement is recorded in the run directory')
+    parser.add_argument('--nice', type=int, default=-5, help='With --pin, niceness of the server threads')
+    parser.add_argument('--realtime', type=int, default=None, help='With --pin, run the server threads under SCHED_FIFO with this priority instead of --nice')
+    parser.add_argument('--client_nice', type=int, default=0, help='With --local, niceness of the clients')
+    parser.add_argument('--profile', type=float, default=None, help='Sample the stacks of the server with perf for this many seconds. The folded stacks and a flamegraph are stored in the run directory')
+    parser.add_argument('--profile_delay', type=float, default=60., help='Seconds after all clients are launched to start --profile, to skip the ramp up')
+    parser.add_argument('--profile_frequency', type=int, default=99, help='Stack samples per second and thread of --profile')
+    parser.add_argument('--call_graph', type=str, default='fp', choices=['fp', 'dwarf', 'lbr'], help='How perf unwinds the stacks of --profile. fp needs the server built with -fno-omit-frame-pointer, dwarf works without but records much more')
+    parser.add_argument('--clock_probes', type=int, default=20, help='Probes of the clock of every client machine at the start and the end of the run. The offsets and drifts are recorded in the run directory. 0 to skip')
+    parser.add_argument('--config', type=str, default=None, help='Server config file to run instead of the one of --quest/--noquest and --spread/--static in --path, e.g. a variant written by sweep.py')
+    parser.add_argument('--impair_up', type=str, default=None, help='Run the clients through impair.py, with this impairment of their packets to the server, e.g. delay=40,jitter=10,dist=normal,loss=1. See impair.py --help')
+    parser.add_argument('--impair_down', type=str, default=None, help='Impairment of the packets from the server to the clients, as --impair_up')
+    parser.add_argument('--impair_port', type=int, default=None, help='Port of the impairment proxy, the server port + 1 by default')
+
+    # Required unless --local
+    parser.add_argument('--username', type=str, help='Username for SSH')
+    parser.add_argument('--password', type=str, help='Password for SSH')
     qmode_group = parser.add_mutually_exclusive_group(required=True)
     qmode_group.add_argument('--quest', action='store_true')
     qmode_group.add_argument('--noquest', action='store_true')
@@ -220,7 +340,10 @@ def parse_arguments():
     lmode_group.add_argument('--spread', action='store_true')
     parser.add_argument('--count', type=int, required=True, help='Number of clients to deploy')
     
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.local and (args.username is None or args.password is None):
+        parser.error('--username and --password are required without --local')
+    return args
 
 
 if __name__ == '__main__':
@@ -8,42 +8,46 @@ import itertools
 import math
 import multiprocessing
 import os
+import queue
 import random
 import signal
+import socket
+import subprocess
+import threading
 import time
 
+import dashboard
+import placement
+
 try:
     import paramiko
 except:
     print('paramiko is not installed. Try "pip install paramiko"')
 
 
-class SSHManager:
-    def __init__(self, machines, username, password):
-        def connect_client(machine, username, password):
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            try:
-                client.connect(machine, username=username, password=password)
-                print('Info:', 'Connected to', machine, 'successfully')
-                return client
-            except:
-                print('Error:', 'Could not connect to', machine)
-                return None
-
-        machines_connected = [(machine, connect_client(machine, username, password)) for machine in machines]
-        machines_connected = list(filter(lambda x: x[1] is not None, machines_connected))
-        
+class MachineManager:
+    def __init__(self, machines_connected):
+        '''
+        machines_connected = [(machine_name, machine)]
+        machine.exec_command(command, get_pty=True) returns (stdin, stdout, stderr) like paramiko.SSHClient
+        '''
         self.__machine_names = None
         self.__machines = None
         self.__ioe = None
+        self.__counts = None
+        # The dashboard thread refreshes and reads __ioe while the prompt launches tasks
+        self.__lock = threading.Lock()
     
         if len(machines_connected) > 0:
             self.__machine_names, self.__machines = zip(*machines_connected)
             self.__ioe = [None] * len(self.__machines)
+            self.__counts = [0] * len(self.__machines)
 
     def get_num_machines(self):
         return len(self.__machines)
+
+    def is_closed(self):
+        return self.__machines is None
     
     def get_machine(self, idx):
         assert idx < self.get_num_machines()
@@ -51,7 +55,26 @@ class SSHManager:
 
     def get_ioe(self, idx):
         assert idx < self.get_num_machines()
-        return self.__ioe[idx]
+        with self.__lock:
+            return self.__ioe[idx]
+
+    def get_count(self, idx):
+        '''
+        Number of clients the running task was launched with, 0 when unknown or idling
+        '''
+        assert idx < self.get_num_machines()
+        with self.__lock:
+            return self.__counts[idx] if self.__ioe[idx] is not None else 0
+
+    def get_states(self):
+        '''
+        [(machine_name_str, running, count)] of every machine, read at once. Empty once closed
+        '''
+        with self.__lock:
+            if self.__machines is None:
+                return list()
+            return [(self.get_machine_name_str(idx), ioe is not None, count if ioe is not None else 0)
+                    for idx, (ioe, count) in enumerate(zip(self.__ioe, self.__counts))]
 
     def refresh_ioe(self):
         def check_alive(ioe):
@@ -60,7 +83,9 @@ class SSHManager:
                     return ioe
             else:
                 return None
-        self.__ioe = list(map(check_alive, self.__ioe))
+        with self.__lock:
+            if self.__ioe is not None:
+                self.__ioe = list(map(check_alive, self.__ioe))
 
     def get_machine_name(self, idx):
         assert idx < self.get_num_machines()
@@ -70,13 +95,17 @@ class SSHManager:
         assert idx < self.get_num_machines()
         return '[' + str(idx) + ']' + ' ' + self.__machine_names[idx]
 
-    def launch_task_on_machine(self, idx, task_launcher):
+    def launch_task_on_machine(self, idx, task_launcher, count=None):
         '''
         (stdin, stdout, stderr) = task_launcher(idx, machine, machine_name)
+        count is the number of clients the task runs, if known
         '''
         assert idx < self.get_num_machines()
         assert task_launcher is not None
-        self.__ioe[idx] = task_launcher(idx, self.get_machine(idx), self.get_machine_name(idx))
+        ioe = task_launcher(idx, self.get_machine(idx), self.get_machine_name(idx))
+        with self.__lock:
+            self.__ioe[idx] = ioe
+            self.__counts[idx] = count if count is not None else 0
 
     def close_machine(self, idx):
         assert idx < self.get_num_machines()
@@ -88,24 +117,144 @@ class SSHManager:
             for idx in range(self.get_num_machines()):
                 self.close_machine(idx)
     
-            self.__machine_names = None
-            self.__machines = None
-            self.__ioe = None
+            with self.__lock:
+                self.__machine_names = None
+                self.__machines = None
+                self.__ioe = None
+                self.__counts = None
     
     def __del__(self):
         self.close_all()
 
 
+class SSHManager(MachineManager):
+    def __init__(self, machines, username, password):
+        def connect_client(machine, username, password):
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(machine, username=username, password=password)
+                print('Info:', 'Connected to', machine, 'successfully')
+                return client
+            except:
+                print('Error:', 'Could not connect to', machine)
+                return None
+
+        machines_connected = [(machine, connect_client(machine, username, password)) for machine in machines]
+        machines_connected = list(filter(lambda x: x[1] is not None, machines_connected))
+        super(SSHManager, self).__init__(machines_connected)
+
+
+class LocalChannel:
+    def __init__(self, proc):
+        self.__proc = proc
+        self.__timeout = None
+
+    def settimeout(self, timeout):
+        self.__timeout = timeout
+
+    def gettimeout(self):
+        return self.__timeout
+
+    @property
+    def closed(self):
+        return self.__proc.poll() is not None
+
+
+class LocalOutput:
+    '''
+    Output lines of a local process, read like a paramiko ChannelFile
+    Iterating raises socket.timeout when no line comes within channel.settimeout seconds
+    '''
+    def __init__(self, proc):
+        self.channel = LocalChannel(proc)
+        self.__lines = queue.Queue()
+        threading.Thread(target=self.__read, args=(proc.stdout,), daemon=True).start()
+
+    def __read(self, stream):
+        for line in stream:
+            self.__lines.put(line)
+        self.__lines.put(None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            line = self.__lines.get(timeout=self.channel.gettimeout())
+        except queue.Empty:
+            raise socket.timeout()
+        if line is None:
+            # Stay at the end for the next reader
+            self.__lines.put(None)
+            raise StopIteration
+        return line
+
+
+class LocalMachine:
+    '''
+    Virtual host standing in for a paramiko.SSHClient
+    Every command runs in its own process group confined to cpus at the niceness nice, close terminates the groups
+    '''
+    def __init__(self, cpus, nice=0):
+        self.__cpus = cpus
+        self.__nice = nice
+        self.__processes = list()
+
+    def get_cpus(self):
+        return self.__cpus
+
+    def exec_command(self, command, get_pty=True):
+        '''
+        (stdin, stdout, stderr) of command run by the shell, stderr is merged into stdout as on a pty
+        '''
+        proc = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, bufsize=1, start_new_session=True, preexec_fn=self.__confine,
+            # Python tasks only flush line by line on a pty
+            env=dict(os.environ, PYTHONUNBUFFERED='1'))
+        self.__processes.append(proc)
+        stdout = LocalOutput(proc)
+        return proc.stdin, stdout, stdout
+
+    def __confine(self):
+        os.sched_setaffinity(0, self.__cpus)
+        if self.__nice:
+            os.nice(self.__nice)
+
+    def close(self):
+        for proc in self.__processes:
+            if proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        self.__processes = list()
+
+
+class LocalManager(MachineManager):
+    def __init__(self, cpus_per_machine, nice=0):
+        '''
+        One virtual host on this machine per entry of cpus_per_machine, see plan_local_cpus and placement.plan
+        '''
+        machines_connected = [('local' + str(idx), LocalMachine(cpus, nice)) for idx, cpus in enumerate(cpus_per_machine)]
+        for machine_name, machine in machines_connected:
+            print('Info:', 'Started virtual host', machine_name, 'on cpus', placement.format_cpu_list(machine.get_cpus()))
+        super(LocalManager, self).__init__(machines_connected)
+
+
 class ControlPrompt(cmd.Cmd):
-    def __init__(self, time, ssh_manager):
+    def __init__(self, time, ssh_manager, refresh=1.0):
         '''
-        ssh_manager is SSHManager
+        ssh_manager is SSHManager or LocalManager
         time = (launch_time, termination_time=None)
+        refresh is the seconds between redraws of the dashboard
         '''
-        assert isinstance(ssh_manager, SSHManager)
+        assert isinstance(ssh_manager, MachineManager)
         super(ControlPrompt, self).__init__()
         self.__time = time
         self.__ssh_manager = ssh_manager
+        self.__refresh = refresh
+        self.__dashboard = None
     
     def get_time(self):
         return self.__time
@@ -113,6 +262,31 @@ class ControlPrompt(cmd.Cmd):
     def get_ssh_manager(self):
         return self.__ssh_manager
 
+    def get_live_stats_path(self):
+        '''
+        Live statistics file of the server to show on the dashboard, None if there is no local server
+        '''
+        return None
+
+    def do_dash(self, arg=None):
+        '''
+        Usage: dash {on|off}
+        Info:
+            1. Pins a live view of the machines, the local load, the server threads and the time left to the top of the terminal
+            2. Commands keep working below it. Toggles if {on|off} is left empty
+        '''
+        if self.__dashboard is None:
+            self.__dashboard = dashboard.Dashboard(self.__ssh_manager, self.__time, self.get_live_stats_path(), self.__refresh)
+        turn_on = (arg.strip() == 'on') if arg and arg.strip() else not self.__dashboard.is_running()
+        if turn_on:
+            self.__dashboard.start()
+        else:
+            self.__dashboard.stop()
+
+    def postloop(self):
+        if self.__dashboard is not None:
+            self.__dashboard.stop()
+
     def do_list(self, arg=None):
         self.__ssh_manager.refresh_ioe()
         num_machines = self.__ssh_manager.get_num_machines()
@@ -228,7 +402,7 @@ class ControlPrompt(cmd.Cmd):
 
 class SuperClientControlPrompt(ControlPrompt):
     def __init__(self, time, ssh_manager, args):
-        super(SuperClientControlPrompt, self).__init__(time, ssh_manager)
+        super(SuperClientControlPrompt, self).__init__(time, ssh_manager, args.refresh)
         self.__args = args
     
     def do_launch(self, arg):
@@ -251,7 +425,7 @@ class SuperClientControlPrompt(ControlPrompt):
         if self.get_ssh_manager().get_ioe(idx) is not None:
             print('Error:', self.__ssh_manager.get_machine_name_str(idx), 'is already running')
 
-        self.get_ssh_manager().launch_task_on_machine(idx, construct_launcher(remote_launcher=self.__args.remote_launcher, cmd=self.__args.cmd, count=count, port=self.__args.port, stdout=self.__args.stdout))
+        self.get_ssh_manager().launch_task_on_machine(idx, construct_launcher(remote_launcher=self.__args.remote_launcher, cmd=self.__args.cmd, count=count, port=self.__args.port, stdout=self.__args.stdout), count)
         print('')
 
 
@@ -281,6 +455,16 @@ def print_time(launch_time, termination_time=None, show_elapsed=False):
         print('Info:', 'left        :', '{:.2f}'.format((termination_time - now).total_seconds()), 'seconds')
 
 
+def plan_local_cpus(num_machines, num_server_cpus=0):
+    '''
+    (server_cpus, [cpus of every virtual host]) out of the cpus this process may run on
+    The first num_server_cpus go to the server, the rest is split into contiguous sets that are shared round robin when there are more hosts than cpus
+    '''
+    cpus = sorted(os.sched_getaffinity(0))
+    server_cpus, cpus = cpus[:num_server_cpus], (cpus[num_server_cpus:] or cpus)
+    return server_cpus, placement.split_cpus(cpus, num_machines)
+
+
 def get_remote_machines(machines):
     if machines is None:
         machines = [
@@ -336,7 +520,7 @@ def launch_tasks(sshmanager, total_count, remote_launcher, remote_cmd, port, del
         machine_idx_to_run = next(machine_iter)
         count_to_use = min(target_count_to_use, count_left)
 
-        sshmanager.launch_task_on_machine(machine_idx_to_run, construct_launcher(remote_launcher=remote_launcher, cmd=remote_cmd, count=count_to_use, port=port, stdout=stdout))
+        sshmanager.launch_task_on_machine(machine_idx_to_run, construct_launcher(remote_launcher=remote_launcher, cmd=remote_cmd, count=count_to_use, port=port, stdout=stdout), count_to_use)
         time.sleep(delay)
 
         count_left = count_left - count_to_use
@@ -346,7 +530,11 @@ def main(args):
     print('Info:', args)
     print('Info:')
 
-    args.machines = get_remote_machines(args.machines)
+    if args.local:
+        print('Info:', 'Running', args.local, 'virtual hosts on this machine')
+        args.machines = ['local' + str(idx) for idx in range(args.local)]
+    else:
+        args.machines = get_remote_machines(args.machines)
 
     if args.admin:
         print('Info:', 'Running in admin mode')
@@ -359,7 +547,15 @@ def main(args):
             print('Info:', '    Still needs', int(required_machines_count - len(args.machines)), 'machines')
             exit(0)
 
-    sm = SSHManager(args.machines, args.username, args.password)
+    if args.local:
+        sm = LocalManager(plan_local_cpus(args.local)[1])
+        # Local process groups outlive this script unless they are terminated, e.g. on --duration
+        def exit_gracefully(signum, frame):
+            sm.close_all()
+            exit(0)
+        signal.signal(signal.SIGTERM, exit_gracefully)
+    else:
+        sm = SSHManager(args.machines, args.username, args.password)
     print('Info:')
     launch_time = datetime.datetime.now()
     print_time(launch_time)
@@ -375,7 +571,10 @@ def main(args):
         print_time(launch_time, termination_time)
         multiprocessing.Process(target=killer_process, args=(args.duration,), daemon=True).start()
     
-    SuperClientControlPrompt((launch_time, termination_time), sm, args).cmdloop()
+    prompt = SuperClientControlPrompt((launch_time, termination_time), sm, args)
+    if args.dashboard:
+        prompt.do_dash('on')
+    prompt.cmdloop()
 
 
 def killer_process(wait_time):
@@ -394,16 +593,22 @@ def parse_arguments():
     parser.add_argument('--threshold', type=int, default=500, help='Limited number of processes to launch for each machine')
     parser.add_argument('--delay', type=float, default=1.0, help='Delay interval between jobs launching on each machine')
     parser.add_argument('--duration', type=float, default=None, help='Time in seconds to auto terminate this script')
+    parser.add_argument('--dashboard', action='store_true', help='Start with the live dashboard on. Toggle it with the dash command')
+    parser.add_argument('--refresh', type=float, default=1.0, help='Seconds between redraws of the dashboard')
     # Forwarded to remote_launcher
     parser.add_argument('--port', type=str, default=':1747', help='Forward to remote_launcher Server @<IP>:<PORT>')
     parser.add_argument('--cmd', type=str, default='~/ece1747/SimMud/client', help='Forward to remote_launcher --cmd')
     parser.add_argument('--stdout', action='store_true', help='Forward to remote_launcher --stdout')
     # SSH-related
     parser.add_argument('--machines', type=str, nargs='+', help='Pool of machines for SSH')
-    parser.add_argument('--username', type=str, required=True, help='Username for SSH')
-    parser.add_argument('--password', type=str, required=True, help='Password for SSH')
+    parser.add_argument('--username', type=str, help='Username for SSH')
+    parser.add_argument('--password', type=str, help='Password for SSH')
+    parser.add_argument('--local', type=int, default=None, help='Run this number of virtual hosts as local process groups on their own cpus instead of SSH')
     
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.local and (args.username is None or args.password is None):
+        parser.error('--username and --password are required without --local')
+    return args
 
 
 if __name__ == '__main__':
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+
+import argparse
+import configparser
+import csv
+import datetime
+import itertools
+import os
+import random
+import shlex
+import subprocess
+import sys
+import time
+
+
+# Not a server setting: the number of clients super.py deploys
+COUNT_PARAM = 'count'
+DESIGNS = ['lhs', 'fractional']
+DESIGN_FILENAME = 'design.csv'
+
+
+def parse_param(spec):
+    '''
+    {'name', 'kind', 'low', 'high', 'levels'} of name=low:high[:int|:float] or name=level,level,...
+    kind is None for a range without one, resolve_kind settles it against the template
+    '''
+    name, _, values = spec.partition('=')
+    if not name or not values:
+        raise ValueError('Parameter ' + spec + ' is not name=low:high[:int|:float] or name=level,level,...')
+    if ':' in values:
+        parts = values.split(':')
+        kind = parts[2] if len(parts) > 2 else None
+        if kind not in [None, 'int', 'float']:
+            raise ValueError('Parameter ' + spec + ' has an unknown kind ' + kind)
+        low, high = float(parts[0]), float(parts[1])
+        if not low < high:
+            raise ValueError('Parameter ' + spec + ' needs low < high')
+        return {'name': name, 'kind': kind, 'low': low, 'high': high, 'levels': None}
+    return {'name': name, 'kind': 'choice', 'low': None, 'high': None, 'levels': values.split(',')}
+
+
+def is_int(text):
+    try:
+        int(text)
+        return True
+    except ValueError:
+        return False
+
+
+def resolve_kind(param, template):
+    '''
+    Kind of a range param: int for the client count and for settings the template holds as an int, float otherwise
+    Raises ValueError for a float range over an int setting, the server would not parse it
+    '''
+    if param['kind'] == 'choice':
+        return 'choice'
+    if param['name'] == COUNT_PARAM:
+        integer = True
+    else:
+        integer = is_int(template[find_section(template, param['name'])][param['name']])
+    if integer and param['kind'] == 'float':
+        raise ValueError(param['name'] + ' is an integer setting, it cannot take a float range')
+    return 'int' if integer else param['kind'] or 'float'
+
+
+def to_value(param, unit):
+    '''
+    Setting of param at unit in [0, 1] of its range
+    '''
+    if param['kind'] == 'choice':
+        return param['levels'][min(len(param['levels']) - 1, int(unit * len(param['levels'])))]
+    value = param['low'] + unit * (param['high'] - param['low'])
+    return int(round(value)) if param['kind'] == 'int' else round(value, 6)
+
+
+def latin_hypercube(nparam, npoint, rng):
+    '''
+    [npoint][nparam] units in [0, 1], every parameter hitting each of npoint equal strata once
+    '''
+    columns = list()
+    for _ in range(nparam):
+        strata = list(range(npoint))
+        rng.shuffle(strata)
+        columns.append([(stratum + rng.random()) / npoint for stratum in strata])
+    return [list(point) for point in zip(*columns)]
+
+
+def fractional_factorial(nparam, nbase=None):
+    '''
+    [2^nbase][nparam] levels in {-1, 1} of a two level fractional factorial design
+    The first nbase parameters form a full factorial, each other one is the product of a distinct set of at least two of them,
+    largest sets first so main effects stay clear of two factor interactions when there are enough runs
+    By default nbase is the smallest that still separates every main effect
+    '''
+    if nbase is None:
+        nbase = 1
+        while 2 ** nbase < nparam + 1:
+            nbase += 1
+    nbase = min(nbase, nparam)
+    generators = [combo for size in range(nbase, 1, -1) for combo in itertools.combinations(range(nbase), size)]
+    if nparam - nbase > len(generators):
+        raise ValueError(str(nparam) + ' parameters need more than 2^' + str(nbase) + ' runs')
+    points = list()
+    for base in itertools.product([-1, 1], repeat=nbase):
+        point = list(base)
+        for combo in generators[:nparam - nbase]:
+            level = 1
+            for idx in combo:
+                level *= base[idx]
+            point.append(level)
+        points.append(point)
+    return points, ['x'.join('abcdefghijklmnopqrstuvwxyz'[idx] for idx in combo) for combo in generators[:nparam - nbase]]
+
+
+def find_section(config, key):
+    for section in config.sections():
+        if key in config[section]:
+            return section
+    return None
+
+
+def write_variant(template, settings, path):
+    '''
+    The template config with settings {key: value} applied, keys found in whatever section holds them
+    '''
+    config = configparser.ConfigParser()
+    config.read(template)
+    for key, value in settings.items():
+        section = find_section(config, key)
+        if section is None:
+            raise KeyError(key + ' is not a setting of ' + template)
+        config[section][key] = str(value)
+    with open(path, mode='w') as f:
+        config.write(f)
+
+
+def read_design(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def write_design(path, rows):
+    with open(path + '.tmp', mode='w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(path + '.tmp', path)
+
+
+def design(args):
+    params = [parse_param(spec) for spec in args.param]
+    template = configparser.ConfigParser()
+    template.read(args.template)
+    for param in params:
+        if param['name'] != COUNT_PARAM and find_section(template, param['name']) is None:
+            print('Error:', param['name'], 'is not a setting of', args.template)
+            sys.exit(1)
+        try:
+            param['kind'] = resolve_kind(param, template)
+        except ValueError as e:
+            print('Error:', e)
+            sys.exit(1)
+
+    rng = random.Random(args.seed)
+    if args.design == 'lhs':
+        units = latin_hypercube(len(params), args.points, rng)
+        print('Info:', 'Latin hypercube of', len(units), 'points over', len(params), 'parameters')
+    else:
+        points, aliases = fractional_factorial(len(params), args.base)
+        units = [[(level + 1) / 2. for level in point] for point in points] + [[0.5] * len(params) for _ in range(args.center)]
+        print('Info:', '2^(' + str(len(params)) + '-' + str(len(aliases)) + ') fractional factorial,', len(points), 'runs and', args.center, 'center points')
+        for param, alias in zip(params[len(params) - len(aliases):], aliases):
+            print('Info:', '    ', param['name'], '=', alias)
+        print('Info:', '    ', 'where', ', '.join('abcdefghijklmnopqrstuvwxyz'[idx] + '=' + param['name'] for idx, param in enumerate(params[:len(params) - len(aliases)])))
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    rows = list()
+    for point_idx, unit in enumerate(units):
+        settings = {param['name']: to_value(param, u) for param, u in zip(params, unit)}
+        count = settings.pop(COUNT_PARAM, args.count)
+        config_path = os.path.join(args.work_dir, 'config_' + str(point_idx) + '.ini')
+        write_variant(args.template, settings, config_path)
+        for replicate in range(args.replicates):
+            row = {'point': point_idx, 'replicate': replicate, COUNT_PARAM: count}
+            row.update(settings)
+            row.update({'config': os.path.abspath(config_path), 'run': ''})
+            rows.append(row)
+    # Replicates spread over the sweep, so slow drift of the machines does not line up with a design point
+    if args.shuffle:
+        rng.shuffle(rows)
+    path = os.path.join(args.work_dir, DESIGN_FILENAME)
+    write_design(path, rows)
+    print('Info:', len(rows), 'runs of', len(units), 'configs written to', path)
+
+
+def run(args):
+    path = os.path.join(args.work_dir, DESIGN_FILENAME)
+    rows = read_design(path)
+    group = args.group or os.path.basename(os.path.normpath(args.work_dir))
+    todo = [row for row in rows if not row['run']]
+    print('Info:', len(rows) - len(todo), 'of', len(rows), 'runs already done, group', group)
+    super_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'super.py')
+
+    for idx, row in enumerate(todo):
+        cmd = [sys.executable, super_path, '--config', row['config'], '--count', row[COUNT_PARAM], '--duration', str(args.duration)] + shlex.split(args.super_args)
+        print('Info:')
+        print('Info:', '[' + str(idx + 1) + '/' + str(len(todo)) + ']', 'point', row['point'], 'replicate', row['replicate'], datetime.datetime.now().strftime('%H:%M:%S'))
+        print('Info:', '    ', ' '.join(cmd))
+        if args.dry_run:
+            continue
+        os.makedirs(args.metrics, exist_ok=True)
+        before = set(os.listdir(args.metrics))
+        # super.py reads commands from stdin, an open pipe keeps it waiting for --duration
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=None if args.verbose else subprocess.DEVNULL)
+        try:
+            proc.wait()
+        except KeyboardInterrupt:
+            proc.terminate()
+            proc.wait()
+            print('Warning:', 'Interrupted, rerun to continue the sweep')
+            sys.exit(1)
+        new_runs = sorted(name for name in set(os.listdir(args.metrics)).difference(before) if os.path.isdir(os.path.join(args.metrics, name)))
+        if not new_runs:
+            print('Error:', 'The run wrote no metrics, it will be retried by the next sweep.py run')
+            continue
+        row['run'] = new_runs[-1]
+        with open(os.path.join(args.metrics, row['run'], 'group.txt'), mode='w') as f:
+            f.write(group)
+        write_design(path, rows)
+        print('Info:', '    ', 'Run', row['run'])
+        if args.pause > 0 and idx + 1 < len(todo):
+            time.sleep(args.pause)
+
+    print('Info:')
+    print('Info:', 'Fit the surrogate with: python analyzer doe --path', args.metrics, '--whitelist', group)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='sweep.py')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_design = subparsers.add_parser('design', description='Write a config variant per point of a design over a parameter space, and the list of runs to do')
+    parser_design.add_argument('--param', type=str, nargs='+', required=True, help='Parameters as name=low:high[:int|:float] or name=level,level,... Ranges are int for the settings the template holds as integers. name is a setting of the template, e.g. server.light_level, or ' + COUNT_PARAM + ' for the number of clients')
+    parser_design.add_argument('--design', type=str, default='lhs', choices=DESIGNS, help='Latin hypercube, or two level fractional factorial at the ends of every range')
+    parser_design.add_argument('--points', type=int, default=20, help='Number of points of --design lhs')
+    parser_design.add_argument('--base', type=int, default=None, help='2^base runs of --design fractional. The fewest that separate every main effect by default')
+    parser_design.add_argument('--center', type=int, default=2, help='Center points added to --design fractional, to see curvature')
+    parser_design.add_argument('--replicates', type=int, default=1, help='Runs per point')
+    parser_design.add_argument('--shuffle', action='store_true', help='Run the points in random order')
+    parser_design.add_argument('--template', type=str, default='config_spread_quest.ini', help='Config the variants start from')
+    parser_design.add_argument('--count', type=int, default=500, help='Number of clients when ' + COUNT_PARAM + ' is not a parameter')
+    parser_design.add_argument('--seed', type=int, default=0, help='Seed of the design and of --shuffle')
+    parser_design.add_argument('--work_dir', type=str, required=True, help='Directory for the variants and ' + DESIGN_FILENAME)
+    parser_design.set_defaults(func=design)
+
+    parser_run = subparsers.add_parser('run', description='Run every design point not run yet through super.py and tag its run directory, can be stopped and run again')
+    parser_run.add_argument('--work_dir', type=str, required=True, help='Directory written by sweep.py design')
+    parser_run.add_argument('--duration', type=float, default=300., help='Seconds per run, passed to super.py')
+    parser_run.add_argument('--super_args', type=str, required=True, help='Other super.py arguments, e.g. "--quest --spread --local 4 --path ."')
+    parser_run.add_argument('--metrics', type=str, default='metrics', help='Directory the server writes its runs to')
+    parser_run.add_argument('--group', type=str, default=None, help='Group written to group.txt of every run, the name of --work_dir by default')
+    parser_run.add_argument('--pause', type=float, default=10., help='Seconds between runs for the clients to go away')
+    parser_run.add_argument('--verbose', action='store_true', help='Show the output of super.py')
+    parser_run.add_argument('--dry_run', action='store_true', help='Only print the super.py commands')
+    parser_run.set_defaults(func=run)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    print('Info:', args)
+    print('Info:')
+    args.func(args)